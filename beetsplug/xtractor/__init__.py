@@ -8,8 +8,64 @@ import os
 
 from beets.plugins import BeetsPlugin
 from beets.dbcore import types
-from confuse import ConfigSource, load_yaml
-from beetsplug.xtractor.command import XtractorCommand
+from beets.ui import Subcommand
+from confuse import ConfigSource
+from beetsplug.xtractor import helper
+
+
+class XtractorSubcommand(Subcommand):
+    """The `xtractor` subcommand as beets sees it on every invocation: the
+    command, and the extraction machinery it imports, is only loaded when its
+    options are needed (to run it or to show its help).
+    """
+    config = None
+
+    _command = None
+    _root_parser = None
+
+    def __init__(self, config):
+        self.config = config
+        self._command = None
+        super(XtractorSubcommand, self).__init__(
+            name=helper.plg_ns['__PLUGIN_NAME__'],
+            aliases=[helper.plg_ns['__PLUGIN_ALIAS__']] if helper.plg_ns['__PLUGIN_ALIAS__'] else [],
+            help=helper.plg_ns['__PLUGIN_SHORT_DESCRIPTION__']
+        )
+
+    @property
+    def command(self):
+        if self._command is None:
+            from beetsplug.xtractor.command import XtractorCommand
+            self._command = XtractorCommand(self.config)
+            if self._root_parser:
+                self._command.root_parser = self._root_parser
+
+        return self._command
+
+    @property
+    def parser(self):
+        return self.command.parser
+
+    @parser.setter
+    def parser(self, parser):
+        # The parser of the command is used
+        pass
+
+    @property
+    def root_parser(self):
+        return self._root_parser
+
+    @root_parser.setter
+    def root_parser(self, root_parser):
+        self._root_parser = root_parser
+        if self._command:
+            self._command.root_parser = root_parser
+
+    def parse_args(self, args):
+        return self.command.parse_args(args)
+
+    def func(self, lib, options, arguments):
+        return self.command.func(lib, options, arguments)
 
 
 class XtractorPlugin(BeetsPlugin):
@@ -48,13 +104,21 @@ class XtractorPlugin(BeetsPlugin):
         'is_instrumental': types.Float(6),
         'is_voice': types.Float(6),
     }
+    album_types = helper.get_album_types(item_types)
 
     def __init__(self):
         super(XtractorPlugin, self).__init__()
         config_file_path = os.path.join(os.path.dirname(__file__), self._default_plugin_config_file_name_)
-        source = ConfigSource(load_yaml(config_file_path) or {}, config_file_path)
+        source = ConfigSource(helper.load_default_config(config_file_path), config_file_path)
         self.config.add(source)
 
+        self.auto_extractor = None
+        if self.config["auto"].get(bool):
+            # The extractor (and the command it runs) is only loaded by the first import
+            self.register_listener('item_imported', self.on_item_imported)
+            self.register_listener('album_imported', self.on_album_imported)
+            self.register_listener('cli_exit', self.on_cli_exit)
+
         # @todo: activate this to store the attributes in media files
         # field = mediafile.MediaField(
         #     mediafile.MP3DescStorageStyle(u'danceability'), mediafile.StorageStyle(u'danceability')
@@ -67,4 +131,22 @@ class XtractorPlugin(BeetsPlugin):
         # self.add_media_field('beats_count', field)
 
     def commands(self):
-        return [XtractorCommand(self.config)]
+        return [XtractorSubcommand(self.config)]
+
+    def get_auto_extractor(self):
+        if self.auto_extractor is None:
+            from beetsplug.xtractor.auto import AutoExtractor
+            from beetsplug.xtractor.command import XtractorCommand
+            self.auto_extractor = AutoExtractor(XtractorCommand(self.config), drain=self.config["auto_drain"].get(bool))
+
+        return self.auto_extractor
+
+    def on_item_imported(self, lib, item):
+        self.get_auto_extractor().enqueue(lib, [item])
+
+    def on_album_imported(self, lib, album):
+        self.get_auto_extractor().enqueue(lib, album.items())
+
+    def on_cli_exit(self, lib):
+        if self.auto_extractor:
+            self.auto_extractor.finish()
@@ -0,0 +1,362 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import hashlib
+import json
+from optparse import OptionParser
+
+from beets.library import Library, Item, Album, parse_query_string
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.helper import get_aggregate_fields
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+FINGERPRINT_FIELD = "xtractor_fingerprint"
+
+
+class LibraryArrays(object):
+    """The descriptors of the album items loaded with one query per field: a
+    float array per numeric field (nan when missing) and an object array per
+    categorical field (None when missing), all aligned on `item_ids`.
+    """
+    item_ids = None
+    album_ids = None
+    numeric = None
+    categorical = None
+
+    def __init__(self, item_ids, album_ids, numeric=None, categorical=None):
+        self.item_ids = item_ids
+        self.album_ids = album_ids
+        self.numeric = numeric or {}
+        self.categorical = categorical or {}
+
+
+def load_arrays(lib: Library, numeric_fields, categorical_fields, album_ids=None, albums_only=True, item_ids=None,
+                chunk_size=500):
+    """reads the fields of the items belonging to an album (or to one of the
+    `album_ids`), or with `albums_only=False` of all items (or of the `item_ids`)
+    """
+    source = "items JOIN albums ON albums.id = items.album_id" if albums_only else "items"
+    if album_ids is not None:
+        item_ids = _get_album_item_ids(lib, album_ids, chunk_size)
+    chunks = [None]
+    if item_ids is not None:
+        item_ids = sorted(item_ids)
+        chunks = [item_ids[i:i + chunk_size] for i in range(0, len(item_ids), chunk_size)]
+
+    def query(tx, statement, subvals=(), id_column="items.id"):
+        rows = []
+        for chunk in chunks:
+            if chunk is None:
+                rows.extend(tx.query(statement.format(where=""), subvals))
+            else:
+                rows.extend(tx.query(statement.format(where=" AND {} IN ({})".format(id_column, ", ".join("?" * len(
+                    chunk)))), tuple(subvals) + tuple(chunk)))
+        return rows
+
+    with lib.transaction() as tx:
+        rows = query(tx, "SELECT items.id, items.album_id FROM " + source + " WHERE 1{where} ORDER BY items.id")
+        ids = numpy.array([row[0] for row in rows], dtype=numpy.int64)
+        arrays = LibraryArrays(ids, numpy.array([row[1] or 0 for row in rows], dtype=numpy.int64))
+
+        for field in numeric_fields:
+            values = numpy.full(len(ids), numpy.nan)
+            if field in Item._fields:
+                rows = query(tx, "SELECT items." + field + " FROM " + source + " WHERE 1{where} ORDER BY items.id")
+                values[:] = _to_floats([row[0] for row in rows])
+                # 0 is the default of the fixed fields (ex.: bpm)
+                values[values == 0] = numpy.nan
+            else:
+                _assign(ids, values, query(tx, "SELECT entity_id, value FROM " + Item._flex_table +
+                                           " WHERE key = ?{where}", (field,), "entity_id"), _to_floats)
+            arrays.numeric[field] = values
+
+        for field in categorical_fields:
+            values = numpy.full(len(ids), None, dtype=object)
+            _assign(ids, values, query(tx, "SELECT entity_id, value FROM " + Item._flex_table +
+                                       " WHERE key = ?{where}", (field,), "entity_id"),
+                    lambda v: numpy.array(v, dtype=object))
+            arrays.categorical[field] = values
+
+    return arrays
+
+
+def _get_album_item_ids(lib: Library, album_ids, chunk_size=500):
+    item_ids = []
+    with lib.transaction() as tx:
+        for where, subvals in _album_chunks(album_ids, chunk_size):
+            item_ids.extend(row[0] for row in tx.query("SELECT id FROM items WHERE album_id IS NOT NULL" + where,
+                                                       subvals))
+
+    return item_ids
+
+
+def _album_chunks(album_ids, chunk_size=500):
+    """the conditions restricting a query on the items to the albums, a chunk of album ids at a time
+    """
+    if album_ids is None:
+        return [("", ())]
+
+    album_ids = sorted(album_ids)
+    return [(" AND items.album_id IN ({})".format(", ".join("?" * len(chunk))), tuple(chunk))
+            for chunk in (album_ids[i:i + chunk_size] for i in range(0, len(album_ids), chunk_size))]
+
+
+def _numeric_values(field):
+    """the query of the (album_id, value) rows of a numeric field of the album items (the values
+    are NULL when missing) - to be completed with the album condition
+    """
+    if field in Item._fields:
+        # 0 is the default of the fixed fields (ex.: bpm)
+        return ("SELECT items.album_id AS album_id, NULLIF(items.{0}, 0) AS value FROM items "
+                "JOIN albums ON albums.id = items.album_id WHERE 1{{where}}".format(field)), ()
+
+    return ("SELECT items.album_id AS album_id, CAST(attr.value AS REAL) AS value FROM {0} AS attr "
+            "JOIN items ON items.id = attr.entity_id JOIN albums ON albums.id = items.album_id "
+            "WHERE attr.key = ? AND attr.value IS NOT NULL AND attr.value != ''{{where}}".format(
+                Item._flex_table)), (field,)
+
+
+def _assign(item_ids, values, rows, convert):
+    """sets the values of the (entity_id, value) rows at the position of their item
+    """
+    if not rows or not len(item_ids):
+        return
+
+    ids = numpy.array([row[0] for row in rows], dtype=numpy.int64)
+    positions = numpy.minimum(numpy.searchsorted(item_ids, ids), len(item_ids) - 1)
+    found = item_ids[positions] == ids
+    values[positions[found]] = convert([row[1] for row in rows])[found]
+
+
+def _to_floats(values):
+    try:
+        return numpy.array(values, dtype=float)
+    except (TypeError, ValueError):
+        return numpy.array([_to_float(v) for v in values], dtype=float)
+
+
+def _to_float(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return numpy.nan
+
+
+def _group(album_ids):
+    """returns the distinct album ids and the index of the album of each item
+    """
+    return numpy.unique(album_ids, return_inverse=True)
+
+
+def load_album_fingerprints(lib: Library, numeric_fields, categorical_fields, album_ids=None, chunk_size=500):
+    """returns a fingerprint of the items and values of each album (or of the `album_ids`) to find the
+    albums which changed - computed from the counts and sums of the values grouped by album in SQLite,
+    without loading the values
+    """
+    parts = {}
+    with lib.transaction() as tx:
+        def query(statement, subvals=()):
+            for where, album_subvals in _album_chunks(album_ids, chunk_size):
+                yield from tx.query(statement.format(where=where), tuple(subvals) + album_subvals)
+
+        for album_id, count, total in query("SELECT items.album_id, COUNT(*), TOTAL(items.id) FROM items JOIN albums "
+                                            "ON albums.id = items.album_id WHERE 1{where} GROUP BY items.album_id"):
+            parts[album_id] = [count, total]
+
+        for field in sorted(numeric_fields):
+            statement, subvals = _numeric_values(field)
+            for album_id, count, total in query("SELECT album_id, COUNT(value), TOTAL(value) FROM (" + statement +
+                                                ") GROUP BY album_id", subvals):
+                parts[album_id].extend((field, count, round(total, 6)))
+
+        for field in sorted(categorical_fields):
+            for album_id, value, count in query(
+                    "SELECT items.album_id, attr.value, COUNT(*) FROM " + Item._flex_table + " AS attr JOIN items ON "
+                    "items.id = attr.entity_id JOIN albums ON albums.id = items.album_id WHERE attr.key = ? AND "
+                    "attr.value IS NOT NULL{where} GROUP BY items.album_id, attr.value ORDER BY attr.value",
+                    (field,)):
+                parts[album_id].extend((field, str(value), count))
+
+    return {album_id: hashlib.sha1(json.dumps(values).encode()).hexdigest()[:16] for album_id, values in parts.items()}
+
+
+def compute_album_aggregates(arrays: LibraryArrays):
+    """returns the album ids and the aggregates (attribute -> array aligned on the album ids)
+    """
+    albums, index = _group(arrays.album_ids)
+    n = len(albums)
+    aggregates = {}
+
+    with numpy.errstate(invalid="ignore", divide="ignore"):
+        for field, values in arrays.numeric.items():
+            valid = ~numpy.isnan(values)
+            count = numpy.bincount(index[valid], minlength=n)
+            total = numpy.bincount(index[valid], weights=values[valid], minlength=n)
+            squares = numpy.bincount(index[valid], weights=values[valid] ** 2, minlength=n)
+            mean = total / count
+            aggregates[field + "_mean"] = mean
+            aggregates[field + "_std"] = numpy.sqrt(numpy.maximum(squares / count - mean ** 2, 0.0))
+
+            # Sorted by album then by value (nan last): the median is in the middle of the valid values
+            order = numpy.lexsort((values, index))
+            starts = numpy.searchsorted(index[order], numpy.arange(n))
+            ordered = values[order]
+            has = count > 0
+            low = numpy.where(has, starts + (count - 1) // 2, 0)
+            high = numpy.where(has, starts + count // 2, 0)
+            aggregates[field + "_median"] = numpy.where(has, (ordered[low] + ordered[high]) / 2.0, numpy.nan) \
+                if len(ordered) else numpy.full(n, numpy.nan)
+
+    for field, values in arrays.categorical.items():
+        valid = numpy.not_equal(values, None)
+        dominant = numpy.full(n, None, dtype=object)
+        labels, codes = numpy.unique(values[valid].astype(str), return_inverse=True)
+        if len(labels):
+            counts = numpy.bincount(index[valid] * len(labels) + codes,
+                                    minlength=n * len(labels)).reshape(n, len(labels))
+            has = counts.sum(axis=1) > 0
+            dominant[has] = labels[counts.argmax(axis=1)[has]]
+        aggregates[field + "_dominant"] = dominant
+
+    return albums, aggregates
+
+
+def load_histograms(lib: Library, numeric_fields, album_ids=None, bins=10, chunk_size=500):
+    """returns the histogram (bin edges and counts, with the bins of numpy.histogram) of each numeric
+    field of the album items (or of the items of the `album_ids`), counted in SQLite
+    """
+    histograms = {}
+    with lib.transaction() as tx:
+        def query(statement, subvals=()):
+            for where, album_subvals in _album_chunks(album_ids, chunk_size):
+                yield from tx.query(statement.format(where=where), tuple(subvals) + album_subvals)
+
+        for field in numeric_fields:
+            statement, subvals = _numeric_values(field)
+            ranges = [row for row in query("SELECT MIN(value), MAX(value) FROM (" + statement + ")", subvals)
+                      if row[0] is not None]
+            if not ranges:
+                continue
+            low = min(row[0] for row in ranges)
+            high = max(row[1] for row in ranges)
+            if low == high:
+                low, high = low - 0.5, high + 0.5
+            width = (high - low) / bins
+
+            counts = [0] * bins
+            for index, count in query("SELECT MIN(CAST((value - ?) / ? AS INTEGER), ?) AS bin, COUNT(*) FROM (" +
+                                      statement + ") WHERE value IS NOT NULL GROUP BY bin",
+                                      (low, width, bins - 1) + tuple(subvals)):
+                counts[index] += count
+            edges = [low + i * width for i in range(bins)] + [high]
+            histograms[field] = {"edges": edges, "counts": counts}
+
+    return histograms
+
+
+def load_fingerprints(lib: Library):
+    with lib.transaction() as tx:
+        rows = tx.query("SELECT entity_id, value FROM {} WHERE key = ?".format(Album._flex_table),
+                        (FINGERPRINT_FIELD,))
+
+    return {row[0]: row[1] for row in rows}
+
+
+def store_album_aggregates(lib: Library, albums, aggregates, fingerprints):
+    """writes the aggregates as album attributes in a single transaction (the
+    attributes without a value are removed)
+    """
+    upserts = []
+    # attribute -> album ids
+    deletes = {}
+    for attr, values in aggregates.items():
+        for album_id, value in zip(albums.tolist(), values.tolist()):
+            if value is None or value != value:
+                deletes.setdefault(attr, []).append(album_id)
+            else:
+                upserts.append((album_id, attr, value))
+    upserts.extend((album_id, FINGERPRINT_FIELD, fingerprint) for album_id, fingerprint in zip(albums.tolist(),
+                                                                                              fingerprints))
+
+    # Many rows per statement (SQLite allows 999 variables)
+    with lib.transaction() as tx:
+        for attr, album_ids in deletes.items():
+            for i in range(0, len(album_ids), 500):
+                chunk = album_ids[i:i + 500]
+                tx.mutate("DELETE FROM {} WHERE key = ? AND entity_id IN ({})".format(
+                    Album._flex_table, ", ".join("?" * len(chunk))), [attr] + chunk)
+        for i in range(0, len(upserts), 300):
+            chunk = upserts[i:i + 300]
+            tx.mutate("INSERT OR REPLACE INTO {} (entity_id, key, value) VALUES {}".format(
+                Album._flex_table, ", ".join(["(?, ?, ?)"] * len(chunk))), [value for row in chunk for value in row])
+
+
+class AggregateCommand(object):
+    """`beet xtractor aggregate [options] [QUERY...]`: computes the album
+    aggregates of the extracted descriptors (mean, median and standard
+    deviation of the numeric ones, the dominant value of the categorical ones)
+    and the library histograms. Only the albums whose items changed since the
+    last run are computed again and written.
+    """
+    config = None
+    parser = None
+
+    def __init__(self, config):
+        self.config = config
+        self.parser = OptionParser(usage='beet {plg} aggregate [options] [QUERY...]'.format(
+            plg=helper.plg_ns['__PLUGIN_NAME__']))
+        self.parser.add_option('-f', '--force', action='store_true', dest='force', default=False,
+                               help=u'compute the aggregates of all albums, changed or not')
+        self.parser.add_option('-d', '--dry-run', action='store_true', dest='dryrun', default=False,
+                               help=u'compute the aggregates without storing them')
+        self.parser.add_option('-b', '--bins', action='store', dest='bins', type='int', default=10,
+                               help=u'[default: 10] the number of bins of the library histograms')
+        self.parser.add_option('--histogram-file', action='store', dest='histogram_file', default=None,
+                               help=u'write the library histograms to this json file')
+        self.parser.add_option('-q', '--quiet', action='store_true', dest='quiet', default=False,
+                               help=u'mute all output')
+
+    def func(self, lib: Library, options, arguments):
+        if numpy is None:
+            helper.say("The aggregates require NumPy: pip install beets-xtractor[numpy]", log_only=False,
+                       is_error=True)
+            return
+
+        from beetsplug.xtractor import XtractorPlugin
+        numeric, categorical = get_aggregate_fields(XtractorPlugin.item_types)
+
+        album_ids = None
+        if arguments:
+            query, _ = parse_query_string(" ".join(arguments), Album)
+            album_ids = [album.id for album in lib.albums(query)]
+
+        fingerprints = load_album_fingerprints(lib, numeric, categorical, album_ids)
+        if not options.force:
+            stored = load_fingerprints(lib)
+            changed = {album_id: fingerprint for album_id, fingerprint in fingerprints.items()
+                       if stored.get(album_id) != fingerprint}
+        else:
+            changed = fingerprints
+
+        helper.say("Albums: {0}, changed: {1}".format(len(fingerprints), len(changed)), log_only=options.quiet)
+
+        if changed:
+            # Only the items of the changed albums are loaded
+            aggregate_albums, aggregates = compute_album_aggregates(load_arrays(lib, numeric, categorical, changed))
+            if not options.dryrun:
+                store_album_aggregates(lib, aggregate_albums, aggregates,
+                                       [changed[album_id] for album_id in aggregate_albums.tolist()])
+
+        histograms = load_histograms(lib, numeric, album_ids, bins=options.bins)
+        if not options.quiet:
+            for field, histogram in histograms.items():
+                helper.say("{0}: {1:.3f}..{2:.3f} {3}".format(field, histogram["edges"][0], histogram["edges"][-1],
+                                                              histogram["counts"]), log_only=False)
+        if options.histogram_file:
+            with open(options.histogram_file, "w") as f:
+                json.dump(histograms, f, indent=2)
@@ -0,0 +1,91 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import queue
+import threading
+
+from beets.library import Library, Item
+
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.command import XtractorCommand
+from beetsplug.xtractor.query import MissingFieldsQuery
+
+_STOP = object()
+
+
+class AutoExtractor(object):
+    """Extracts the newly imported items in the background so that the import
+    is never held up by the extractor. Imported items are put on a work queue
+    served by the extraction pipeline running in a background thread. When
+    beets exits the queue is either drained or left in the journal as pending
+    to be picked up by `beet xtractor --resume`.
+    """
+    command: XtractorCommand = None
+    drain = True
+
+    _queue = None
+    _thread = None
+    _stopping = False
+    _missing_query = None
+
+    def __init__(self, command: XtractorCommand, drain=True):
+        self.command = command
+        self.drain = drain
+        self._queue = queue.Queue()
+        self._missing_query = MissingFieldsQuery(helper.get_required_fields(command.config))
+
+    def enqueue(self, lib: Library, items):
+        """queues the items which do not have the required fields yet
+        (unchanged items of a re-import are skipped)
+        """
+        items = [item for item in items if self._missing_query.match(item)]
+        if not items:
+            return
+
+        if not self._thread and not self._start(lib):
+            return
+
+        self.command.journal.mark_pending(item.id for item in items)
+        for item in items:
+            self._queue.put(item)
+        helper.say("Queued for background extraction: {}".format(len(items)))
+
+    def finish(self):
+        """called when beets exits: drains the queue (or leaves it for the next run)
+        """
+        if not self._thread:
+            return
+
+        if not self.drain:
+            self._stopping = True
+            helper.say("Leaving {} items pending for the next run".format(self._queue.qsize()), log_only=False)
+        else:
+            helper.say("Waiting for the background extraction of {} items".format(self._queue.qsize()),
+                       log_only=False)
+
+        self._queue.put(_STOP)
+        self._thread.join()
+        self._thread = None
+        self.command.close_run()
+
+    def _start(self, lib: Library):
+        self.command.lib = lib
+        self.command.cfg_quiet = True
+        self.command.adjust_thread_count()
+        if not self.command.open_run():
+            return False
+
+        self._thread = threading.Thread(target=self._run, name="xtractor-auto", daemon=True)
+        self._thread.start()
+        return True
+
+    def _run(self):
+        self.command._execute_on_each_items(self._iter_items(), total=0)
+
+    def _iter_items(self):
+        while not self._stopping:
+            item: Item = self._queue.get()
+            if item is _STOP:
+                return
+            yield item
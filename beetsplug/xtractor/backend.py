@@ -0,0 +1,277 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import importlib
+import importlib.util
+import os
+import queue
+import signal
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import get_context
+
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.process import ProcessLimits
+
+
+class ExtractionResult(object):
+    # the reason of the failure (None on success)
+    error = None
+    # the descriptors when the backend returns them directly (otherwise they are in the output file)
+    audiodata = None
+    wall_time = 0.0
+    # user + system time of the extraction (None when not available)
+    cpu_time = None
+
+
+class ExtractorBackend(object):
+    """Runs the music extractor on audio files. `extract` either writes the
+    descriptors to `output_path` (json) or returns them in the result. The
+    backend is started before the first extraction of a run and stopped at its
+    end; `extract` is called from several threads at once.
+    """
+
+    @classmethod
+    def from_config(cls, config, limits: ProcessLimits, workers):
+        return cls()
+
+    def start(self):
+        pass
+
+    def stop(self):
+        pass
+
+    def extract(self, input_path, output_path, profile_path) -> ExtractionResult:
+        raise NotImplementedError()
+
+
+class SubprocessBackend(ExtractorBackend):
+    """Runs an extractor process (`streaming_extractor_music`) for each file,
+    with the resource limits of the run.
+    """
+    extractor_path = None
+    limits: ProcessLimits = None
+
+    def __init__(self, extractor_path, limits: ProcessLimits = None):
+        self.extractor_path = extractor_path
+        self.limits = limits or ProcessLimits()
+
+    @classmethod
+    def from_config(cls, config, limits: ProcessLimits, workers):
+        return cls(helper.get_extractor_path(config), limits)
+
+    def extract(self, input_path, output_path, profile_path) -> ExtractionResult:
+        cmd_and_args = [self.extractor_path, input_path, output_path, profile_path]
+        helper.say("Executing: {0}".format(' '.join(f'"{a}"' for a in cmd_and_args)))
+        process = self.limits.run(cmd_and_args)
+
+        helper.say("The process exited with code: {0}".format(process.returncode))
+        helper.say("Process stdout: {0}".format(process.stdout.decode(errors="replace")))
+        helper.say("Process stderr: {0}\n".format(process.stderr.decode(errors="replace")))
+
+        result = ExtractionResult()
+        result.wall_time = process.wall_time
+        result.cpu_time = process.cpu_time
+        if process.failed:
+            result.error = "killed after {0}s".format(self.limits.timeout) if process.timed_out \
+                else "exit code {0}".format(process.returncode)
+        elif not os.path.isfile(output_path):
+            result.error = "no output"
+
+        return result
+
+
+class WorkerPoolBackend(ExtractorBackend):
+    """Keeps `workers` long-lived processes which load the extractor once (with
+    the profile and the svm models it lists) and send the descriptors back
+    directly. The extractor is built by `loader` (a "module:function" taking
+    the profile path and returning a function of the input path), by default
+    the MusicExtractor of the essentia python bindings.
+    Every worker is a slot of its own (a single process executor) so that an
+    extraction is only submitted to an idle, started process: the timeout does
+    not count the time spent waiting for a worker and a worker killed on a
+    timeout does not take the extractions of the other workers with it.
+    """
+    loader = "beetsplug.xtractor.backend:load_essentia_extractor"
+    workers = 1
+    timeout = None
+    nice = 0
+
+    _slots = None
+    _idle_slots = None
+    _lock = None
+
+    def __init__(self, workers=1, timeout=None, nice=0, loader=None):
+        self.workers = max(1, workers)
+        self.timeout = timeout
+        self.nice = nice or 0
+        self.loader = loader or self.loader
+        self._lock = threading.Lock()
+
+        if self.loader == WorkerPoolBackend.loader and importlib.util.find_spec("essentia") is None:
+            raise ValueError("The 'workers' extractor backend requires the essentia python bindings")
+
+    @classmethod
+    def from_config(cls, config, limits: ProcessLimits, workers):
+        return cls(workers, timeout=limits.timeout, nice=limits.nice)
+
+    def start(self):
+        with self._lock:
+            if self._slots is None:
+                self._slots = [_WorkerSlot(self.nice) for _ in range(self.workers)]
+                self._idle_slots = queue.Queue()
+                for slot in self._slots:
+                    self._idle_slots.put(slot)
+
+    def stop(self):
+        with self._lock:
+            slots, self._slots, self._idle_slots = self._slots, None, None
+        for slot in slots or []:
+            slot.shutdown()
+
+    def extract(self, input_path, output_path, profile_path) -> ExtractionResult:
+        self.start()
+        idle_slots = self._idle_slots
+        slot = idle_slots.get()
+        result = ExtractionResult()
+        started = time.monotonic()
+        try:
+            future = slot.start().submit(_extract_in_worker, self.loader, input_path, profile_path)
+            result.audiodata, result.cpu_time = future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            result.error = "killed after {0}s".format(self.timeout)
+            slot.kill()
+        except BrokenProcessPool:
+            result.error = "worker process died"
+            slot.kill()
+        except Exception as e:
+            result.error = "{0}: {1}".format(e.__class__.__name__, e)
+        finally:
+            result.wall_time = time.monotonic() - started
+            idle_slots.put(slot)
+
+        return result
+
+
+class _WorkerSlot(object):
+    """a worker process of the pool: started on demand, and again after it was killed
+    """
+    nice = 0
+    pid = None
+
+    _executor = None
+
+    def __init__(self, nice=0):
+        self.nice = nice
+
+    def start(self):
+        if self._executor is None:
+            # Spawned (not forked) from a parent running threads
+            self._executor = ProcessPoolExecutor(max_workers=1, mp_context=get_context("spawn"),
+                                                 initializer=_init_worker, initargs=(self.nice,))
+            # Waits for the process to be up before the first extraction (and its timeout) starts
+            self.pid = self._executor.submit(os.getpid).result()
+
+        return self._executor
+
+    def kill(self):
+        executor, self._executor = self._executor, None
+        if executor is None:
+            return
+
+        try:
+            os.kill(self.pid, getattr(signal, "SIGKILL", signal.SIGTERM))
+        except OSError:
+            # Already gone
+            pass
+        executor.shutdown(wait=False)
+
+    def shutdown(self):
+        executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown()
+
+
+# The extractors loaded by a worker process, by loader and profile
+_extractors = {}
+
+
+def _init_worker(nice):
+    if nice and hasattr(os, "nice"):
+        os.nice(nice)
+
+
+def _extract_in_worker(loader, input_path, profile_path):
+    extractor = _extractors.get((loader, profile_path))
+    if extractor is None:
+        extractor = _extractors[(loader, profile_path)] = import_string(loader)(profile_path)
+
+    started = time.process_time()
+    audiodata = extractor(input_path)
+
+    return audiodata, time.process_time() - started
+
+
+def load_essentia_extractor(profile_path):
+    """returns the extraction function of an essentia MusicExtractor configured by the profile
+    """
+    from essentia.standard import MusicExtractor
+
+    extractor = MusicExtractor(profile=profile_path)
+
+    def extract(input_path):
+        features, _ = extractor(input_path)
+        return pool_to_dict(features)
+
+    return extract
+
+
+def pool_to_dict(pool):
+    """converts an essentia pool ("rhythm.bpm": 120, ...) to the nested structure of the json output
+    """
+    data = {}
+    for name in pool.descriptorNames():
+        value = pool[name]
+        if hasattr(value, "tolist"):
+            value = value.tolist()
+        node = data
+        parents = name.split(".")
+        for parent in parents[:-1]:
+            node = node.setdefault(parent, {})
+        node[parents[-1]] = value
+
+    return data
+
+
+def import_string(path):
+    """imports "module:name"
+    """
+    module_name, _, name = path.partition(":")
+    if not name:
+        raise ValueError("Invalid import path '{}' (expected module:name)".format(path))
+
+    return getattr(importlib.import_module(module_name), name)
+
+
+BACKENDS = {
+    "subprocess": SubprocessBackend,
+    "workers": WorkerPoolBackend,
+}
+
+
+def open_extractor_backend(name, config, limits: ProcessLimits, workers=1):
+    """returns the extractor backend for the `extractor_backend` configuration option: one
+    of the built-in backends or the "module:Class" of an ExtractorBackend
+    """
+    if name in BACKENDS:
+        backend_class = BACKENDS[name]
+    elif ":" in name:
+        backend_class = import_string(name)
+    else:
+        raise ValueError("Invalid extractor backend '{}' (valid: {}, or module:Class)".format(
+            name, ", ".join(BACKENDS)))
+
+    return backend_class.from_config(config, limits, workers)
@@ -0,0 +1,99 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import sqlite3
+import threading
+import time
+import zlib
+
+from beetsplug.xtractor import helper
+
+
+class ResultCache(object):
+    """Persistent store of extractor results keyed by the content of the audio
+    file and by the hash of the extractor profile that produced them.
+    Identical (or relocated) audio files share the same entry.
+    """
+    path = None
+
+    _connection = None
+    _lock = None
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS results (
+                    content_key TEXT,
+                    profile_hash TEXT,
+                    data BLOB,
+                    created REAL,
+                    PRIMARY KEY (content_key, profile_hash));
+                """)
+
+    def get(self, content_key, profile_hash):
+        """returns the parsed extractor output or None if it is not cached
+        """
+        data = self.get_bytes(content_key, profile_hash)
+        if data is None:
+            return None
+
+        return helper.json_backend.loads(data)
+
+    def get_bytes(self, content_key, profile_hash):
+        """returns the raw (json) extractor output or None if it is not cached
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT data FROM results WHERE content_key = ? AND profile_hash = ?",
+                (content_key, profile_hash)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return zlib.decompress(row[0])
+
+    def has(self, content_key, profile_hash):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT 1 FROM results WHERE content_key = ? AND profile_hash = ?",
+                (content_key, profile_hash)
+            ).fetchone()
+
+        return row is not None
+
+    def put(self, content_key, profile_hash, data: bytes):
+        """stores the raw (json) extractor output
+        """
+        blob = zlib.compress(data)
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO results (content_key, profile_hash, data, created) VALUES (?, ?, ?, ?)",
+                (content_key, profile_hash, blob, time.time())
+            )
+
+    def put_file(self, content_key, profile_hash, output_path):
+        with open(output_path, "rb") as f:
+            self.put(content_key, profile_hash, f.read())
+
+    def alias(self, content_key, new_content_key, profile_hash):
+        """makes the result of `content_key` available under `new_content_key`
+        as well (ex.: after writing tags to the media file)
+        """
+        if content_key == new_content_key:
+            return
+
+        with self._lock, self._connection:
+            self._connection.execute("""
+                INSERT OR REPLACE INTO results (content_key, profile_hash, data, created)
+                SELECT ?, profile_hash, data, created FROM results
+                WHERE content_key = ? AND profile_hash = ?
+                """, (new_content_key, content_key, profile_hash))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
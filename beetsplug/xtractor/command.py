@@ -2,39 +2,93 @@
 #  Author: Adam Jakab <adam at jakab dot pro>
 #  License: See LICENSE.txt
 
-from concurrent import futures
 import hashlib
 import json
 import multiprocessing
 from optparse import OptionParser
 import os
-from subprocess import Popen, PIPE
+import shutil
 import tempfile
+import threading
+import time
 
 import yaml
+from mediafile import MediaFile
 
 from beets import dbcore
 from beets.library import Library, Item, parse_query_string
 from beets.ui import Subcommand, decargs
 from beetsplug.xtractor import helper
+from beetsplug.xtractor.backend import ExtractorBackend, SubprocessBackend, import_string, \
+    open_extractor_backend
+from beetsplug.xtractor.cache import ResultCache
+from beetsplug.xtractor.governor import ConcurrencyGovernor
+from beetsplug.xtractor.job import XtractorJob
+from beetsplug.xtractor.journal import Journal
+from beetsplug.xtractor.pipeline import Pipeline, Stage, RateLimiter
+from beetsplug.xtractor.prefetch import Prefetcher
+from beetsplug.xtractor.process import ProcessLimits
+from beetsplug.xtractor.query import MissingFieldsQuery, FieldChangedQuery, IdSetQuery, ItemStream, count_items
+from beetsplug.xtractor.scheduler import ExtractionRates, estimate_audio_seconds
+from beetsplug.xtractor.spool import Spool, STATUS_DONE
+from beetsplug.xtractor.stats import RunStats
+from beetsplug.xtractor.store import OutputStore, open_output_store
 from confuse import Subview
 
 
 class XtractorCommand(Subcommand):
     config: Subview = None
 
+    # Actions invoked as: beet xtractor ACTION [options] [QUERY...] ("module:Class", imported when invoked)
+    actions = {
+        "aggregate": "beetsplug.xtractor.aggregate:AggregateCommand",
+        "export": "beetsplug.xtractor.export:ExportCommand",
+        "similar": "beetsplug.xtractor.similar:SimilarCommand",
+    }
+
     lib = None
     query = None
     parser = None
 
-    items_to_analyse = None
+    items_to_analyse: ItemStream = None
+    items_count = 0
+    targets = None
+    cache = None
+    rates = None
+    limits = None
+    journal = None
+    spool = None
+    store: OutputStore = None
+    stats: RunStats = None
+    prefetcher: Prefetcher = None
+    backend: ExtractorBackend = None
+    write_limiter: RateLimiter = None
+    governor: ConcurrencyGovernor = None
+
+    _spool_locks = None
+    _spool_lock = None
+    _output_refs = None
+    _output_lock = None
+    _stored_ids = None
+    _backend_lock = None
+    profile_hash = None
+    low_level_profile_hash = None
+    two_phase = False
 
     cfg_auto = False
     cfg_dry_run = False
     cfg_write = True
     cfg_threads = 1
+    cfg_adaptive = False
     cfg_force = False
     cfg_quiet = False
+    cfg_resume = False
+    cfg_retry_failed = False
+    cfg_spool = None
+    cfg_from_output = False
+    cfg_incremental = False
+    cfg_stats = False
+    cfg_stats_file = None
 
     def __init__(self, config):
         self.config = config
@@ -44,14 +98,23 @@ class XtractorCommand(Subcommand):
         self.cfg_dry_run = cfg.get("dry-run")
         self.cfg_write = cfg.get("write")
         self.cfg_threads = cfg.get("threads")
+        self.cfg_adaptive = cfg.get("adaptive")
         self.cfg_force = cfg.get("force")
         self.cfg_version = False
         self.cfg_count_only = False
         self.cfg_quiet = cfg.get("quiet")
+        self.cfg_resume = False
+        self.cfg_retry_failed = False
+        self.cfg_spool = cfg.get("spool_path")
+        self.cfg_from_output = False
+        self.cfg_incremental = cfg.get("incremental")
+        self.cfg_stats = cfg.get("stats")
+        self.cfg_stats_file = cfg.get("stats_file")
 
         self.parser = OptionParser(
-            usage='beet {plg} [options] [QUERY...]'.format(
-                plg=helper.plg_ns['__PLUGIN_NAME__']
+            usage='beet {plg} [options] [QUERY...]\n       beet {plg} {actions} [options] [QUERY...]'.format(
+                plg=helper.plg_ns['__PLUGIN_NAME__'],
+                actions="|".join(sorted(self.actions))
             ))
 
         self.parser.add_option(
@@ -78,6 +141,13 @@ class XtractorCommand(Subcommand):
                 self.cfg_threads)
         )
 
+        self.parser.add_option(
+            '--adaptive',
+            action='store_true', dest='adaptive', default=self.cfg_adaptive,
+            help=u'[default: {}] adjust the number of concurrent extractions to the load, the available memory '
+                 u'and the throughput of the machine'.format(self.cfg_adaptive)
+        )
+
         self.parser.add_option(
             '-f', '--force',
             action='store_true', dest='force', default=self.cfg_force,
@@ -90,6 +160,53 @@ class XtractorCommand(Subcommand):
             help=u'[default: {}] Show the number of items to be processed'.format(self.cfg_count_only)
         )
 
+        self.parser.add_option(
+            '-r', '--resume',
+            action='store_true', dest='resume', default=self.cfg_resume,
+            help=u'[default: {}] only process the items left pending by an interrupted run'.format(self.cfg_resume)
+        )
+
+        self.parser.add_option(
+            '--retry-failed',
+            action='store_true', dest='retry_failed', default=self.cfg_retry_failed,
+            help=u'[default: {}] retry failed items without waiting for their retry delay'.format(
+                self.cfg_retry_failed)
+        )
+
+        self.parser.add_option(
+            '-s', '--spool',
+            action='store', dest='spool', default=self.cfg_spool,
+            help=u'[default: {}] hand the extractions over to `xtractor-worker` processes through '
+                 u'this (shared) spool directory'.format(self.cfg_spool)
+        )
+
+        self.parser.add_option(
+            '--from-output',
+            action='store_true', dest='from_output', default=self.cfg_from_output,
+            help=u'[default: {}] re-map the targets from the stored outputs without running the '
+                 u'extractor'.format(self.cfg_from_output)
+        )
+
+        self.parser.add_option(
+            '-i', '--incremental',
+            action='store_true', dest='incremental', default=self.cfg_incremental,
+            help=u'[default: {}] also analyse the items whose audio file or extractor profile changed since '
+                 u'their analysis'.format(self.cfg_incremental)
+        )
+
+        self.parser.add_option(
+            '--stats',
+            action='store_true', dest='stats', default=self.cfg_stats,
+            help=u'[default: {}] show the timers and counters of the run'.format(self.cfg_stats)
+        )
+
+        self.parser.add_option(
+            '--stats-file',
+            action='store', dest='stats_file', default=self.cfg_stats_file,
+            help=u'[default: {}] write the timers and counters of the run to this file (json, or '
+                 u'Prometheus text format for a .prom file)'.format(self.cfg_stats_file)
+        )
+
         self.parser.add_option(
             '-q', '--quiet',
             action='store_true', dest='quiet', default=self.cfg_quiet,
@@ -111,19 +228,38 @@ class XtractorCommand(Subcommand):
             help=helper.plg_ns['__PLUGIN_SHORT_DESCRIPTION__']
         )
 
+    def parse_args(self, args):
+        if args and args[0] in self.actions:
+            action = import_string(self.actions[args[0]])(self.config)
+            options, arguments = action.parser.parse_args(args[1:])
+            options.action = action
+            return options, arguments
+
+        return super(XtractorCommand, self).parse_args(args)
+
     def func(self, lib: Library, options, arguments):
+        action = getattr(options, "action", None)
+        if action:
+            action.func(lib, options, decargs(arguments))
+            return
+
         self.cfg_dry_run = options.dryrun
         self.cfg_write = options.write
         self.cfg_threads = options.threads
+        self.cfg_adaptive = options.adaptive
         self.cfg_force = options.force
         self.cfg_version = options.version
         self.cfg_count_only = options.count_only
         self.cfg_quiet = options.quiet
+        self.cfg_resume = options.resume
+        self.cfg_retry_failed = options.retry_failed
+        self.cfg_spool = options.spool
+        self.cfg_from_output = options.from_output
+        self.cfg_incremental = options.incremental
+        self.cfg_stats = options.stats
+        self.cfg_stats_file = options.stats_file
 
-        # Auto Thread Count
-        if self.cfg_threads == 0:
-            self.cfg_threads = multiprocessing.cpu_count()
-            self._say("Adjusting max threads to CPU count: {0}".format(self.cfg_threads), True)
+        self.adjust_thread_count()
 
         self.lib = lib
         self.query = decargs(arguments)
@@ -134,70 +270,356 @@ class XtractorCommand(Subcommand):
 
         self.xtract()
 
-    def xtract(self):
-        self.find_items_to_analyse()
-        self._say("Number of items to be processed: {}".format(len(self.items_to_analyse)), False)
+    def adjust_thread_count(self):
+        # Adaptive: as many threads as the ceiling, the governor decides how many of them extract at once
+        if self.cfg_adaptive:
+            self.cfg_threads = self.config["adaptive_max_threads"].get(int) or multiprocessing.cpu_count()
+            self._say("Adjusting max threads to the adaptive ceiling: {0}".format(self.cfg_threads), True)
 
-        # Count only and exit
-        if self.cfg_count_only:
+        # Auto Thread Count
+        if not self.cfg_threads:
+            self.cfg_threads = multiprocessing.cpu_count()
+            self._say("Adjusting max threads to CPU count: {0}".format(self.cfg_threads), True)
+
+    def xtract(self):
+        if not self.open_run():
             return
 
-        # Run tasks on selected items
-        self._execute_on_each_items(self.items_to_analyse, self.run_full_analysis)
+        try:
+            with self.stats.timer("query"):
+                self.find_items_to_analyse()
+            self._say("Number of items to be processed: {}".format(self.items_count), False)
+
+            # Count only and exit
+            if self.cfg_count_only:
+                return
+
+            if not self.cfg_dry_run and not self.cfg_from_output:
+                self.journal.mark_pending(self.items_to_analyse.ids())
+
+            # Run tasks on selected items (streamed from the database as the pipeline takes them)
+            self._execute_on_each_items(self.items_to_analyse, total=self.items_count)
+        finally:
+            self.close_run()
+
+    def open_run(self):
+        """prepares the resources of an extraction run (returns False on configuration errors)
+        """
+        self.stats = RunStats()
+        try:
+            self.limits = self._get_process_limits()
+            self.store = open_output_store(self.config["output_store"].as_str(), self._get_extraction_output_path(),
+                                           compression=self.config["output_compression"].as_str())
+            self.prefetcher = self._get_prefetcher()
+            self.governor = self._get_governor()
+        except (ValueError, FileNotFoundError) as e:
+            self._say("Configuration error: {0}".format(e), log_only=False, is_error=True)
+            return False
+
+        self._stored_ids = []
+        self.write_limiter = RateLimiter(self.config["write_rate"].as_number())
+        self._backend_lock = threading.Lock()
+        self.targets = helper.compile_targets(self.config)
+        self.two_phase = bool(self.config["essentia_svm_extractor"].get())
+        self.low_level_profile_hash = self._get_profile_hash()
+        self.profile_hash = self._get_svm_profile_hash() if self.two_phase else self.low_level_profile_hash
+        self.journal = Journal(self._get_data_path("journal.db"),
+                               retry_delay=self.config["retry_delay"].as_number(),
+                               retry_max_delay=self.config["retry_max_delay"].as_number())
+        if self.config["cache"].get(bool):
+            self.cache = ResultCache(self._get_cache_path())
+        self.rates = ExtractionRates(self._get_data_path("rates.json"))
+        self._output_refs = {}
+        self._output_lock = threading.Lock()
+        if self.cfg_spool:
+            self.spool = Spool(os.path.expanduser(self.cfg_spool), lease_timeout=self.config["spool_lease"].as_number())
+            self._spool_locks = {}
+            self._spool_lock = threading.Lock()
+
+        return True
+
+    def close_run(self):
+        if self._stored_ids:
+            from beetsplug.xtractor.similar import update_similarity_index
+            update_similarity_index(self.lib, self.config, self._stored_ids)
+        self.report_stats()
+        self.rates.save()
+        self.store.close()
+        if self.backend:
+            self.backend.stop()
+            self.backend = None
+        if self.prefetcher:
+            self.prefetcher.close()
+            self.prefetcher = None
+        self.governor = None
+        self.journal.close()
+        self.journal = None
+        if self.cache:
+            self.cache.close()
+            self.cache = None
 
         # Delete profiles (if config wants)
         if self.config["keep_profiles"].exists() and not self.config["keep_profiles"].get():
-            os.unlink(self._get_extractor_profile_path())
+            try:
+                output_path = self._get_extraction_output_path()
+            except FileNotFoundError:
+                return
+            for profile_name in (self._get_extractor_profile_name(), self._get_svm_profile_name()):
+                profile_path = os.path.join(output_path, profile_name)
+                if os.path.isfile(profile_path):
+                    os.unlink(profile_path)
+
+    def report_stats(self):
+        if self.cfg_stats:
+            for line in self.stats.format():
+                self._say(line, log_only=False)
+
+        if self.cfg_stats_file:
+            try:
+                self.stats.write(os.path.expanduser(self.cfg_stats_file))
+            except OSError as e:
+                self._say("Unable to write the stats file: {0}".format(e), log_only=False, is_error=True)
 
     def find_items_to_analyse(self):
+        combined_query, parsed_sort = self._get_items_query()
+        blocked_ids = set() if self.cfg_retry_failed or self.cfg_from_output else self.journal.get_blocked_ids()
+
+        # The items are not loaded here: SQLite counts them and they are streamed to the pipeline later
+        if self.cfg_resume:
+            pending_ids = [item_id for item_id in self.journal.get_pending_ids() if item_id not in blocked_ids]
+            self.items_to_analyse = ItemStream(self.lib, combined_query, item_ids=pending_ids)
+            self.items_count = self._count_matching_ids(combined_query, pending_ids)
+            self._say("Resuming {} pending items".format(self.items_count))
+        else:
+            self.items_to_analyse = self._get_item_stream(combined_query, parsed_sort, blocked_ids)
+            self.items_count = count_items(self.lib, combined_query)
+
+            # Skip items which failed recently
+            if blocked_ids:
+                skipped = self._count_matching_ids(combined_query, blocked_ids)
+                self._say("Skipping recently failed items: {}".format(skipped))
+                self.items_count -= skipped
+                self.stats.incr("skipped", skipped)
+
+        if self.items_count == 0:
+            self._say("No items to process")
+            return
+
+    def _get_item_stream(self, query, sort, exclude_ids):
+        """streams the items in the order of the `schedule` option
+        """
+        schedule = self.config["schedule"].as_str()
+        if schedule == "longest_first" and not self.cfg_from_output:
+            # The items with the longest expected extraction time first
+            order_by, order_subvals = self.rates.get_cost_clause()
+            return ItemStream(self.lib, query, order_by=order_by, order_subvals=order_subvals, descending=True,
+                              exclude_ids=exclude_ids)
+
+        if schedule == "directory":
+            # The files of a folder are read one after the other
+            return ItemStream(self.lib, query, order_by="path", exclude_ids=exclude_ids)
+
+        return ItemStream(self.lib, query, sort=sort, exclude_ids=exclude_ids)
+
+    def _get_items_query(self):
         # Parse the incoming query
         parsed_query, parsed_sort = parse_query_string(" ".join(self.query), Item)
         combined_query = parsed_query
 
         # Add unprocessed items query
         if not self.cfg_force:
-            # Set up the query for unprocessed items
-            subqueries = []
-            target_maps = ["low_level_targets", "high_level_targets"]
-            for map_key in target_maps:
-                target_map = self.config[map_key]
-                for fld in target_map:
-                    if target_map[fld]["required"].exists() and target_map[fld]["required"].get(bool):
-                        fast = fld in Item._fields
-                        query_item = dbcore.query.MatchQuery(fld, None, fast=fast)
-                        subqueries.append(query_item)
-
-            unprocessed_items_query = dbcore.query.OrQuery(subqueries)
+            # Set up the query for unprocessed items (evaluated by SQLite)
+            unprocessed_items_query = MissingFieldsQuery(helper.get_required_fields(self.config))
+            if self.cfg_incremental and not self.cfg_from_output:
+                unprocessed_items_query = dbcore.query.OrQuery([
+                    unprocessed_items_query,
+                    FieldChangedQuery(helper.PROFILE_FIELD, self.profile_hash[:12]),
+                    IdSetQuery(self._find_changed_items(parsed_query)),
+                ])
             combined_query = dbcore.query.AndQuery([parsed_query, unprocessed_items_query])
 
         self._say("Combined query: {}".format(combined_query))
 
-        # Get the library items
-        self.items_to_analyse = self.lib.items(combined_query, parsed_sort)
-        if len(self.items_to_analyse) == 0:
-            self._say("No items to process")
+        return combined_query, parsed_sort
+
+    def _find_changed_items(self, query):
+        """incremental mode: returns the ids of the analysed items whose audio file changed since
+        their analysis. The fingerprints of the files touched without a change of their content
+        (with `fingerprint_hash`) and of the items analysed before the fingerprints were recorded
+        are updated on the way
+        """
+        use_hash = self.config["fingerprint_hash"].get(bool)
+        analysed_query = dbcore.query.NotQuery(MissingFieldsQuery(helper.get_required_fields(self.config)))
+        changed_ids = set()
+        updated = []
+        for item in ItemStream(self.lib, dbcore.query.AndQuery([query, analysed_query])):
+            fingerprint = item.get(helper.FILE_FINGERPRINT_FIELD)
+            try:
+                current = helper.get_file_fingerprint(self._get_input_path_for_item(item))
+                if fingerprint is None:
+                    # Analysed before the fingerprints were recorded: take the file as it is now
+                    self._set_fingerprint(item, use_hash)
+                    output_key = item.get(helper.OUTPUT_KEY_FIELD)
+                    item[helper.PROFILE_FIELD] = output_key.rsplit("-", 1)[1] if output_key \
+                        else self.profile_hash[:12]
+                    updated.append(item)
+                elif fingerprint.split(":")[:2] != current.split(":"):
+                    if use_hash and len(fingerprint.split(":")) > 2 \
+                            and self._get_content_key_for_item(item) == fingerprint.split(":")[2]:
+                        self._set_fingerprint(item, use_hash)
+                        updated.append(item)
+                    else:
+                        changed_ids.add(item.id)
+            except FileNotFoundError as e:
+                self._say("File not found error: {0}".format(e))
+
+        if updated and not self.cfg_dry_run and not self.cfg_count_only:
+            batch_size = self.config["db_batch_size"].get(int)
+            for i in range(0, len(updated), batch_size):
+                with self.lib.transaction():
+                    for item in updated[i:i + batch_size]:
+                        item.store()
+        self._say("Changed items: {0}, fingerprints updated: {1}".format(len(changed_ids), len(updated)))
+        self.stats.incr("changed", len(changed_ids))
+
+        return changed_ids
+
+    def _set_fingerprint(self, item: Item, use_hash, content_key=None):
+        if use_hash and not content_key:
+            content_key = self._get_content_key_for_item(item)
+        item[helper.FILE_FINGERPRINT_FIELD] = helper.get_file_fingerprint(
+            self._get_input_path_for_item(item), content_key if use_hash else None)
+
+    def _count_matching_ids(self, query, item_ids, chunk_size=500):
+        item_ids = list(item_ids)
+        count = 0
+        for i in range(0, len(item_ids), chunk_size):
+            chunk_query = dbcore.query.InQuery("id", item_ids[i:i + chunk_size])
+            count += count_items(self.lib, dbcore.query.AndQuery([query, chunk_query]))
+
+        return count
+
+    def _get_pipeline_stages(self):
+        """extract (cpu bound) -> parse -> tag-write (io bound) -> store (batched, single writer)
+        In remap mode (--from-output) the extract stage is replaced by a lookup of the stored outputs.
+        """
+        queue_size = self.config["queue_size"].get(int)
+        parse_workers = self.config["parse_threads"].get(int)
+        if self.cfg_from_output:
+            stages = [Stage("locate", self._stage_locate_output, workers=parse_workers, queue_size=queue_size)]
+        elif self.prefetcher:
+            # A single reader copies the files in order, the extract queue holds the copies ready to be analysed
+            stages = [Stage("prefetch", self._stage_prefetch, workers=1, queue_size=queue_size),
+                      Stage("extract", self._stage_extract, workers=self.cfg_threads,
+                            queue_size=self.config["prefetch_count"].get(int))]
+        else:
+            # With a spool the extract workers only wait for the remote workers
+            extract_workers = self.config["spool_jobs"].get(int) if self.spool else self.cfg_threads
+            stages = [Stage("extract", self._stage_extract, workers=extract_workers, queue_size=queue_size)]
+        stages.append(Stage("parse", self._stage_parse, workers=parse_workers, queue_size=queue_size))
+
+        if not self.cfg_dry_run:
+            # The tags are written first so that the fingerprint of the written file is stored
+            if self.cfg_write:
+                stages.append(Stage("write", self._stage_write, workers=self.config["write_threads"].get(int),
+                                    queue_size=queue_size))
+            stages.append(Stage("store", self._stage_store, workers=1, queue_size=queue_size,
+                                batch_size=self.config["db_batch_size"].get(int),
+                                batch_interval=self.config["db_batch_interval"].as_number()))
+
+        return stages
+
+    def _stage_prefetch(self, job: XtractorJob):
+        """copies the input file to the local scratch directory unless the audio is not needed
+        """
+        if not self._prepare_job(job):
             return
 
-    def run_full_analysis(self, item):
-        self._run_analysis(item)
-        self._run_write_to_item(item)
+        if not self._needs_audio(job):
+            return job
 
-        # Delete output files (if config wants)
-        if self.config["keep_output"].exists() and not self.config["keep_output"].get():
-            output_path = self._get_output_path_for_item(item)
-            if os.path.isfile(output_path):
-                os.unlink(output_path)
+        try:
+            with self.stats.timer("prefetch"):
+                job.local_path = self.prefetcher.fetch(job.input_path)
+        except OSError as e:
+            # The extractor reads the original file
+            self._say("Prefetch failed for: {0} ({1})".format(job.input_path, e), is_error=True)
+            return job
+        self.stats.incr("prefetched")
+
+        return job
+
+    def _stage_extract(self, job: XtractorJob):
+        if job.content_key is None and not self._prepare_job(job):
+            return
 
-    def _run_write_to_item(self, item):
-        if not self.cfg_dry_run:
-            if self.cfg_write:
-                item.try_write()
+        if self.governor:
+            self.governor.acquire()
+        work = 0.0
+        try:
+            result = self._extract(job)
+            if result is not None and self.governor:
+                # The throughput is measured in seconds of audio: the extraction time follows the length
+                work = estimate_audio_seconds(job.item) or 1.0
+            return result
+        finally:
+            if self.governor:
+                self.governor.release(work)
+            # The local copy is only needed by the extractor
+            if job.local_path:
+                self.prefetcher.release(job.local_path)
+                job.local_path = None
+
+    def _prepare_job(self, job: XtractorJob):
+        """finds the input file and the content key of the job (returns False if the file is missing)
+        """
+        try:
+            job.input_path = self._get_input_path_for_item(job.item)
+            job.content_key = self._get_content_key_for_item(job.item)
+        except FileNotFoundError as e:
+            self._say("File not found error: {0}".format(e))
+            job.error = str(e)
+            return False
+
+        job.output_key = self._get_output_key(job.content_key)
+        self._hold_output(job.content_key)
+        self._adopt_legacy_output(job.item, job.output_key)
+
+        return True
+
+    def _needs_audio(self, job: XtractorJob):
+        """returns False when the job can be completed from the stored outputs or the cache
+        """
+        profile_hashes = [self.profile_hash, self.low_level_profile_hash] if self.two_phase else [self.profile_hash]
+        for profile_hash in profile_hashes:
+            if self.store.exists(self._get_output_key(job.content_key, profile_hash)):
+                return False
+            if self.cache and self.cache.has(job.content_key, profile_hash):
+                return False
+
+        return True
+
+    def _extract(self, job: XtractorJob):
+        if self.cache:
+            job.audiodata = self.cache.get(job.content_key, self.profile_hash)
+            if job.audiodata is not None:
+                self._say("Cached result found for: {0}".format(job.input_path))
+                self.stats.incr("cache_hits")
+                return job
+
+        if self.two_phase:
+            return self._run_two_phase_extraction(job)
+
+        return self._run_low_level_extraction(job, job.output_key)
+
+    def _run_low_level_extraction(self, job: XtractorJob, output_key):
+        """runs the extractor (locally or through the spool) on the audio file of the job
+        """
+        if self.spool:
+            return self._run_spool_extraction(job, output_key)
 
-    def _run_analysis(self, item):
         try:
-            extractor_path = self._get_extractor_path()
-            input_path = self._get_input_path_for_item(item)
-            output_path = self._get_output_path_for_item(item)
+            backend = self._get_backend()
             profile_path = self._get_extractor_profile_path()
         except ValueError as e:
             self._say("Value error: {0}".format(e))
@@ -209,83 +631,438 @@ class XtractorCommand(Subcommand):
             self._say("File not found error: {0}".format(e))
             return
 
-        self._say("Running analysis for: {0}".format(input_path))
-        self._run_essentia_extractor(extractor_path, input_path, output_path, profile_path)
+        self._say("Running analysis for: {0}".format(job.input_path))
+        started = time.monotonic()
+        job.error = self._run_essentia_extractor(job, backend, job.local_path or job.input_path, output_key,
+                                                 profile_path)
+        if job.error:
+            return
+        self.rates.record(job.item.get("format"), estimate_audio_seconds(job.item), time.monotonic() - started)
+
+        return job
+
+    def _run_two_phase_extraction(self, job: XtractorJob):
+        """low-level extraction of the audio (unless its result is cached) followed by the
+        high-level (svm) extraction from the low-level result
+        """
+        if self.store.exists(job.output_key):
+            self._say("Output exists: {0}".format(job.output_key))
+            return job
+
+        low_level_key = self._get_output_key(job.content_key, self.low_level_profile_hash)
+        data = None
+        if self.cache:
+            data = self.cache.get_bytes(job.content_key, self.low_level_profile_hash)
+        if data is not None:
+            self._say("Cached low-level result found for: {0}".format(job.input_path))
+            self.stats.incr("low_level_cache_hits")
+        else:
+            if not self._run_low_level_extraction(job, low_level_key):
+                return
+            try:
+                data = self.store.get_bytes(low_level_key)
+            except FileNotFoundError as e:
+                job.error = str(e)
+                return
+            if self.cache:
+                self.cache.put(job.content_key, self.low_level_profile_hash, data)
 
-        # Extract low level targets
         try:
-            audiodata_low = helper.extract_from_output(output_path, self.config["low_level_targets"])
-        except FileNotFoundError as e:
-            self._say("File not found: {0}".format(e))
+            svm_extractor_path = self._get_extractor_path("essentia_svm_extractor")
+            profile_path = self._get_extractor_profile_path(svm=True)
+        except (KeyError, FileNotFoundError) as e:
+            self._say("Configuration error: {0}".format(e))
             return
 
-        # Extract high level targets
+        job.error = self._run_svm_extractor(svm_extractor_path, data, job, profile_path)
+        if job.error:
+            return
+
+        return job
+
+    def _run_spool_extraction(self, job: XtractorJob, output_key):
+        """hands the extraction over to the spool workers and waits for the result
+        """
         try:
-            audiodata_high = helper.extract_from_output(output_path, self.config["high_level_targets"])
-        except FileNotFoundError as e:
-            self._say("File not found: {0}".format(e))
+            profile_name = self._get_extractor_profile_name()
+            self._get_extractor_profile_path(self.spool.path)
+        except (KeyError, FileNotFoundError) as e:
+            self._say("Configuration error: {0}".format(e))
+            return
+
+        job_id = output_key
+        # Items sharing the same audio share the same job
+        with self._spool_lock:
+            lock = self._spool_locks.setdefault(job_id, threading.Lock())
+
+        with lock:
+            if self.store.exists(output_key):
+                self._say("Output exists: {0}".format(output_key))
+                return job
+
+            self._say("Spooling job {0} for: {1}".format(job_id, job.input_path))
+            self.spool.submit(job_id, {
+                "item_id": job.item.id,
+                "input_path": job.input_path,
+                "extractor": self.config["essentia_extractor"].as_filename(),
+                "profile": profile_name,
+            })
+            status = self.spool.wait(job_id, poll_interval=self.config["spool_poll"].as_number())
+
+            if status["status"] != STATUS_DONE:
+                job.error = "Extraction failed on {0} ({1})".format(status.get("worker"), status.get("reason"))
+                self._say(job.error, is_error=True)
+                self.spool.remove(job_id)
+                return
+
+            self.store.put_file(output_key, self.spool.get_output_path(job_id))
+            self.spool.remove(job_id)
+
+        return job
+
+    def _stage_locate_output(self, job: XtractorJob):
+        """remap mode: finds the output the item was extracted to (in the output store or in the cache)
+        """
+        output_key = job.item.get(helper.OUTPUT_KEY_FIELD)
+        if output_key:
+            content_key = output_key.rsplit("-", 1)[0]
+        else:
+            # Items extracted before the output key was recorded
+            try:
+                content_key = self._get_content_key_for_item(job.item)
+            except FileNotFoundError as e:
+                self._say("File not found error: {0}".format(e))
+                return
+            output_key = self._get_output_key(content_key)
+
+        if self.store.exists(output_key):
+            job.output_key = output_key
+            return job
+
+        if self.cache:
+            job.audiodata = self.cache.get(content_key, self.profile_hash)
+            if job.audiodata is not None:
+                job.output_key = self._get_output_key(content_key)
+                return job
+
+        # The profile of a legacy output is unknown
+        legacy_key = self._get_output_key(content_key, helper.LEGACY_PROFILE)
+        if self._adopt_legacy_output(job.item, legacy_key):
+            job.output_key = legacy_key
+            return job
+
+        self._say("No stored output for: {0}".format(job.item.get("path").decode("utf-8")), log_only=False)
+        self.stats.incr("skipped")
+
+    def _stage_parse(self, job: XtractorJob):
+        if job.audiodata is None:
+            try:
+                data = self.store.get_bytes(job.output_key)
+                with self.stats.timer("json_parse"):
+                    job.audiodata = helper.json_backend.loads(data)
+            except FileNotFoundError as e:
+                self._say("File not found: {0}".format(e))
+                job.error = str(e)
+                return
+            except ValueError as e:
+                self._say("Invalid output: {0}".format(e))
+                job.error = "Invalid output: {0}".format(e)
+                return
+
+            if self.cache and job.content_key:
+                self.cache.put(job.content_key, self.profile_hash, data)
+
+        # Extract all targets from a single parse of the output
+        with self.stats.timer("target_map"):
+            job.values = helper.extract_from_audiodata(job.audiodata, self.targets)
+        job.audiodata = None
+        self._say("Audiodata: {}".format(job.values))
+
+        if self.cfg_dry_run:
             return
 
-        # Merge audio data
-        audiodata = {**audiodata_low, **audiodata_high}
-        self._say("Audiodata: {}".format(audiodata))
+        # Update Item (only the values which change)
+        for attr, value in job.values.items():
+            if value is not None:
+                self._set_field(job, attr, value)
+        # Keep track of the output so that the targets can be re-mapped later (--from-output)
+        self._set_field(job, helper.OUTPUT_KEY_FIELD, job.output_key)
+        # A remapped output keeps the profile it was extracted with (from its key)
+        profile = job.output_key.rsplit("-", 1)[1] if self.cfg_from_output else self.profile_hash[:12]
+        self._set_field(job, helper.PROFILE_FIELD, profile)
+        job.write_tags = self.cfg_write and not job.changed_fields.isdisjoint(MediaFile.fields())
+        if not job.write_tags:
+            self._record_file_fingerprint(job, job.content_key)
+
+        return job
 
-        # Update and Store Item
-        if not self.cfg_dry_run:
-            for attr in audiodata.keys():
-                if audiodata.get(attr):
-                    setattr(item, attr, audiodata.get(attr))
-            item.store()
-
-    def _run_essentia_extractor(self, extractor_path, input_path, output_path, profile_path):
-        if os.path.isfile(output_path):
-            self._say("Output exists: {0}".format(output_path))
+    @staticmethod
+    def _set_field(job: XtractorJob, field, value):
+        if helper.value_changed(job.item._type(field), job.item.get(field), value):
+            job.item[field] = value
+            job.changed_fields.add(field)
+
+    def _hold_output(self, content_key):
+        """items sharing the same audio share the same output - it is kept until the last one is done
+        """
+        with self._output_lock:
+            self._output_refs[content_key] = self._output_refs.get(content_key, 0) + 1
+
+    def _keeps_output(self):
+        return not self.config["keep_output"].exists() or self.config["keep_output"].get()
+
+    def _release_output(self, content_key):
+        with self._output_lock:
+            self._output_refs[content_key] -= 1
+            if self._output_refs[content_key] > 0:
+                return
+            del self._output_refs[content_key]
+
+        # Delete output files (if config wants)
+        if not self._keeps_output():
+            self.store.delete(self._get_output_key(content_key))
+            if self.two_phase:
+                self.store.delete(self._get_output_key(content_key, self.low_level_profile_hash))
+
+    def _stage_store(self, jobs):
+        changed = [job for job in jobs if job.changed_fields]
+        if changed:
+            with self.stats.timer("db_store"), self.lib.transaction():
+                for job in changed:
+                    job.item.store()
+        self.stats.incr("stored", len(changed))
+        self.stats.incr("unchanged", len(jobs) - len(changed))
+        self._stored_ids.extend(job.item.id for job in changed)
+        self.journal.mark_done(job.item.id for job in jobs)
+        self._say("Stored batch of {0} items ({1} unchanged)".format(len(changed), len(jobs) - len(changed)))
+
+        return jobs
+
+    def _stage_write(self, job: XtractorJob):
+        if not job.write_tags:
+            return job
+
+        waited = self.write_limiter.wait()
+        if waited:
+            self.stats.add_time("write_throttle", waited)
+        with self.stats.timer("tag_write"):
+            job.item.try_write()
+        self.stats.incr("written")
+
+        # Writing tags changes the file content - keep the cached result reachable
+        new_content_key = None
+        if self.cache and job.content_key:
+            try:
+                new_content_key = self._get_content_key_for_item(job.item)
+            except FileNotFoundError:
+                return job
+            self.cache.alias(job.content_key, new_content_key, self.profile_hash)
+            if self.two_phase:
+                self.cache.alias(job.content_key, new_content_key, self.low_level_profile_hash)
+        self._record_file_fingerprint(job, new_content_key)
+
+        return job
+
+    def _record_file_fingerprint(self, job: XtractorJob, content_key=None):
+        """records the file as it is after the analysis (for the incremental mode)
+        """
+        if self.cfg_from_output:
             return
 
-        self._say("Extractor: {0}".format(extractor_path))
+        try:
+            fingerprint = job.item.get(helper.FILE_FINGERPRINT_FIELD)
+            self._set_fingerprint(job.item, self.config["fingerprint_hash"].get(bool), content_key)
+            if job.item.get(helper.FILE_FINGERPRINT_FIELD) != fingerprint:
+                job.changed_fields.add(helper.FILE_FINGERPRINT_FIELD)
+        except FileNotFoundError as e:
+            self._say("File not found error: {0}".format(e))
+
+    def _run_essentia_extractor(self, job: XtractorJob, backend: ExtractorBackend, input_path, output_key,
+                                profile_path):
+        """runs the extractor and returns the reason of the failure (None on success)
+        """
+        if self.store.exists(output_key):
+            self._say("Output exists: {0}".format(output_key))
+            self.stats.incr("outputs_reused")
+            return
+
+        self._say("Extractor: {0}".format(backend.__class__.__name__))
         self._say("Input: {0}".format(input_path))
-        self._say("Output: {0}".format(output_path))
+        self._say("Output: {0}".format(output_key))
         self._say("Profile: {0}".format(profile_path))
 
-        cmd_and_args = [extractor_path, input_path, output_path, profile_path]
-        self._say("Executing: {0}".format(' '.join(f'"{a}"' for a in cmd_and_args)))
-        proc = Popen(cmd_and_args, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = proc.communicate()
-
-        self._say("The process exited with code: {0}".format(proc.returncode))
-        self._say("Process stdout: {0}".format(stdout.decode()))
-        self._say("Process stderr: {0}\n".format(stderr.decode()))
-
-        # Make sure file is encoded correctly
-        # Sometimes media files have funky tags
-        helper.asciify_file_content(output_path)
-
-    def _execute_on_each_items(self, items, func):
-        total = len(items)
-        finished = 0
-        with futures.ThreadPoolExecutor(max_workers=self.cfg_threads) as e:
-            if total and not self.cfg_quiet:
-                self._show_progress(finished, total)
-            for _ in e.map(func, items):
-                finished += 1
-                if not self.cfg_quiet:
-                    self._show_progress(finished, total)
+        # The extractor writes to a temporary file which is only renamed to the final output when complete
+        tmp_output_path = self._get_tmp_output_path(output_key)
+        result = self._run_backend(backend, input_path, tmp_output_path, profile_path)
+        if result.error:
+            return result.error
+
+        if result.audiodata is None:
+            # Make sure file is encoded correctly
+            # Sometimes media files have funky tags
+            with self.stats.timer("asciify"):
+                helper.asciify_file_content(tmp_output_path)
+        else:
+            # The descriptors came back directly: no need to parse them again, and no output file
+            # unless it is kept or read back (the low-level result of a two phase extraction)
+            final = output_key == job.output_key
+            if final:
+                job.audiodata = result.audiodata
+                if not self.cache and not self._keeps_output():
+                    return
+            data = json.dumps(result.audiodata, ensure_ascii=True).encode()
+            if final and self.cache:
+                self.cache.put(job.content_key, self.profile_hash, data)
+                if not self._keeps_output():
+                    return
+            with open(tmp_output_path, "wb") as f:
+                f.write(data)
+        self.store.put_file(output_key, tmp_output_path)
+
+    def _run_svm_extractor(self, extractor_path, low_level_data, job: XtractorJob, profile_path):
+        """runs the high-level (svm) extractor on the low-level result and stores the merged output
+        (returns the reason of the failure or None on success)
+        """
+        tmp_input_path = self._get_tmp_output_path(job.output_key, "lowlevel")
+        tmp_output_path = self._get_tmp_output_path(job.output_key)
+        with open(tmp_input_path, "wb") as f:
+            f.write(low_level_data)
+
+        try:
+            result = self._run_backend(SubprocessBackend(extractor_path, self.limits), tmp_input_path,
+                                       tmp_output_path, profile_path, job.input_path)
+        finally:
+            os.unlink(tmp_input_path)
+        if result.error:
+            return result.error
+
+        try:
+            high_level = helper.load_output(tmp_output_path)
+        except ValueError as e:
+            os.unlink(tmp_output_path)
+            return "Invalid high-level output: {0}".format(e)
+
+        audiodata = helper.json_backend.loads(low_level_data)
+        audiodata["highlevel"] = high_level.get("highlevel", {})
+        data = json.dumps(audiodata, ensure_ascii=True).encode()
+        with open(tmp_output_path, "wb") as f:
+            f.write(data)
+        self.store.put_file(job.output_key, tmp_output_path)
+
+        if self.cache:
+            self.cache.put(job.content_key, self.profile_hash, data)
+        job.audiodata = audiodata
+
+    def _run_backend(self, backend: ExtractorBackend, input_path, tmp_output_path, profile_path, display_path=None):
+        """returns the result of the extraction (with the reason of the failure as error)
+        """
+        result = backend.extract(input_path, tmp_output_path, profile_path)
+        self.stats.add_time("extractor_wall", result.wall_time)
+        if result.cpu_time is not None:
+            self.stats.add_time("extractor_cpu", result.cpu_time)
+
+        if result.error:
+            self._say("Extraction failed for: {0} ({1})".format(display_path or input_path, result.error),
+                      is_error=True)
+            # Never leave a partial output around
+            if os.path.isfile(tmp_output_path):
+                os.unlink(tmp_output_path)
+            result.error = "Extraction failed ({0})".format(result.error)
+            return result
+
+        self.stats.incr("extractions")
+
+        return result
+
+    def _get_backend(self):
+        """the extractor backend of the run (started on the first extraction)
+        """
+        with self._backend_lock:
+            if self.backend is None:
+                backend = open_extractor_backend(self.config["extractor_backend"].as_str(), self.config, self.limits,
+                                                 workers=self.config["extractor_workers"].get(int) or self.cfg_threads)
+                backend.start()
+                self.backend = backend
+
+        return self.backend
+
+    def _get_tmp_output_path(self, output_key, suffix=None):
+        return os.path.join(self._get_extraction_output_path(), "{}.part-{}-{}{}.json".format(
+            output_key, os.getpid(), threading.get_ident(), "." + suffix if suffix else ""))
+
+    def _execute_on_each_items(self, items, total=None):
+        """runs the pipeline on the items - when `total` is given the items can be
+        any iterable (they are consumed as the pipeline takes them)
+        """
+        if total is None:
+            total = len(items)
+
+        progress = {"finished": 0}
+
+        def on_done(job):
+            progress["finished"] += 1
+            self.stats.incr("items")
+            if job.error:
+                self.stats.incr("failures")
+            if job.content_key:
+                self._release_output(job.content_key)
+            if job.error and not self.cfg_dry_run and not self.cfg_from_output:
+                self.journal.mark_failed(job.item.id, job.error)
+            if not self.cfg_quiet:
+                self._show_progress(progress["finished"], total)
+
+        if total and not self.cfg_quiet:
+            self._show_progress(0, total)
+
+        def on_error(job, e):
+            if isinstance(job, list):
+                for j in job:
+                    j.error = str(e)
+            else:
+                job.error = str(e)
+
+        # Jobs are reported in completion order
+        pipeline = Pipeline(self._get_pipeline_stages(), on_done=on_done, on_error=on_error, stats=self.stats)
+        pipeline.run(XtractorJob(item) for item in items)
 
     def _show_progress(self, done, total):
         print('Finished: [%d/%d]\r' % (done, total), end="")
 
-    def _get_output_path_for_item(self, item: Item):
+    def _get_output_key(self, content_key, profile_hash=None):
+        return "{}-{}".format(content_key, (profile_hash or self.profile_hash)[:12])
+
+    def _get_legacy_output_path(self, item: Item):
+        """the output of the item as named by the versions before the output store: after the
+        MusicBrainz track id or the md5 of the path
+        """
         identifier = item.get("mb_trackid")
         if not identifier or '/' in identifier:
-            input_path = self._get_input_path_for_item(item)
-            identifier = hashlib.md5(input_path.encode('utf-8')).hexdigest()
+            identifier = hashlib.md5(item.get("path")).hexdigest()
 
-        output_file = "{id}.{ext}".format(
-            id=identifier,
-            ext="json"
-        )
+        return os.path.join(self._get_extraction_output_path(), "{}.json".format(identifier))
+
+    def _adopt_legacy_output(self, item: Item, output_key):
+        """copies the legacy output of the item (if any) to the store under the output key unless
+        the store has it already - returns False when there is neither
+        """
+        if self.store.exists(output_key):
+            return True
+
+        legacy_path = self._get_legacy_output_path(item)
+        if not os.path.isfile(legacy_path):
+            return False
+
+        self._say("Legacy output found: {0}".format(legacy_path))
+        tmp_output_path = self._get_tmp_output_path(output_key)
+        shutil.copyfile(legacy_path, tmp_output_path)
+        self.store.put_file(output_key, tmp_output_path)
+        self.stats.incr("legacy_outputs")
 
-        return os.path.join(self._get_extraction_output_path(), output_file)
+        return True
+
+    def _get_content_key_for_item(self, item: Item):
+        full = self.config["cache_key"].as_str() == "full"
+        return helper.get_content_key(self._get_input_path_for_item(item), full=full)
 
     def _get_input_path_for_item(self, item: Item):
         input_path = item.get("path").decode("utf-8")
@@ -310,41 +1087,121 @@ class XtractorCommand(Subcommand):
 
         return output_path
 
-    def _get_extractor_profile_path(self):
-        profile_key = "extractor_profile"
-        profile_filename = "profile.yml"
-        profile_path = os.path.join(self._get_extraction_output_path(), profile_filename)
+    def _get_extractor_profile_path(self, directory=None, svm=False):
+        directory = directory or self._get_extraction_output_path()
+        profile_name = self._get_svm_profile_name() if svm else self._get_extractor_profile_name()
+        profile_path = os.path.join(directory, profile_name)
 
         if not os.path.isfile(profile_path):
             # Generate profile file
-            if not self.config[profile_key].exists():
-                raise KeyError("Key '{}' is not defined".format(profile_key))
-
-            profile_content = self.config[profile_key].flatten()
-            profile_content = json.loads(json.dumps(profile_content))
-            # Override outputFormat (we only handle json for now)
-            profile_content["outputFormat"] = "json"
+            profile_content = self._get_svm_profile_content() if svm else self._get_extractor_profile_content()
 
-            f = open(profile_path, 'w+')
-            yaml.dump(profile_content, f, allow_unicode=True)
+            with open(profile_path, 'w+') as f:
+                yaml.dump(profile_content, f, allow_unicode=True)
 
             if not os.path.isfile(profile_path):
                 raise FileNotFoundError("Extractor profile({}) not created!".format(profile_path))
 
         return profile_path
 
-    def _get_extractor_path(self):
-        extractor_key = "essentia_extractor"
-        if not self.config[extractor_key].exists():
-            raise KeyError("Key '{}' is not defined".format(extractor_key))
+    def _get_extractor_profile_name(self):
+        # Profiles are named by their hash so that a changed profile is never mixed up with an old one
+        return "profile-{}.yml".format(self.low_level_profile_hash[:12])
 
-        extractor_path = self.config[extractor_key].as_filename()
+    def _get_svm_profile_name(self):
+        return "profile-svm-{}.yml".format(self.profile_hash[:12])
 
-        if not os.path.isfile(extractor_path):
-            raise FileNotFoundError("Extractor({}) is not found!".format(
-                extractor_path))
+    def _get_extractor_profile_content(self):
+        profile_key = "extractor_profile"
+        if not self.config[profile_key].exists():
+            raise KeyError("Key '{}' is not defined".format(profile_key))
+
+        profile_content = self.config[profile_key].flatten()
+        profile_content = json.loads(json.dumps(profile_content))
+        # Override outputFormat (we only handle json for now)
+        profile_content["outputFormat"] = "json"
+
+        # The high-level descriptors are computed in a separate phase from the low-level result
+        if self.two_phase:
+            profile_content.pop("highlevel", None)
+
+        return profile_content
+
+    def _get_svm_profile_content(self):
+        profile_content = self._get_extractor_profile_content()
+        highlevel = self.config["extractor_profile"]["highlevel"].flatten() \
+            if self.config["extractor_profile"]["highlevel"].exists() else {}
+
+        return {
+            "outputFormat": profile_content["outputFormat"],
+            "highlevel": json.loads(json.dumps(highlevel)),
+        }
+
+    def _get_profile_hash(self):
+        extractor_path = None
+        if self.config["essentia_extractor"].exists():
+            extractor_path = self.config["essentia_extractor"].as_filename()
+
+        return helper.get_profile_hash(self._get_extractor_profile_content(), extractor_path)
+
+    def _get_svm_profile_hash(self):
+        """the high-level results depend on the low-level profile too
+        """
+        profile_content = dict(self._get_svm_profile_content(), lowlevel=self.low_level_profile_hash)
+
+        return helper.get_profile_hash(profile_content, self.config["essentia_svm_extractor"].as_filename())
+
+    def _get_process_limits(self):
+        cpu_affinity = self.config["cpu_affinity"].get()
+        ionice_level = self.config["ionice_level"].get()
+
+        return ProcessLimits(nice=self.config["nice"].get(int),
+                             ionice=self.config["ionice"].as_str(),
+                             ionice_level=ionice_level,
+                             timeout=self.config["timeout"].as_number(),
+                             memory_limit=self.config["memory_limit"].get(int),
+                             cpu_affinity=cpu_affinity,
+                             slots=self.cfg_threads)
+
+    def _get_prefetcher(self):
+        """the prefetcher (None if disabled) - the remote workers of a spool read the files themselves
+        """
+        if not self.config["prefetch_path"].get() or self.cfg_spool or self.cfg_from_output:
+            return None
+
+        return Prefetcher(self.config["prefetch_path"].as_filename(),
+                          budget=self.config["prefetch_size"].get(int) * 1024 * 1024)
+
+    def _get_governor(self):
+        """the governor of the concurrent extractions (None if not adaptive) - not used with a spool
+        whose remote workers run the extractions
+        """
+        if not self.cfg_adaptive or self.cfg_spool or self.cfg_from_output:
+            return None
+
+        min_workers = self.config["adaptive_min_threads"].get(int)
+        if min_workers > self.cfg_threads:
+            raise ValueError("adaptive_min_threads({}) is above the ceiling of {} threads".format(
+                min_workers, self.cfg_threads))
+
+        return ConcurrencyGovernor(min_workers=min_workers, max_workers=self.cfg_threads,
+                                   max_load=self.config["adaptive_max_load"].as_number(),
+                                   min_memory=self.config["adaptive_min_memory"].as_number(),
+                                   interval=self.config["adaptive_interval"].as_number(),
+                                   stats=self.stats)
+
+    def _get_cache_path(self):
+        if self.config["cache_path"].exists():
+            return self.config["cache_path"].as_filename()
+
+        return self._get_data_path("cache.db")
+
+    @staticmethod
+    def _get_data_path(name):
+        return helper.get_data_path(name)
 
-        return extractor_path
+    def _get_extractor_path(self, extractor_key="essentia_extractor"):
+        return helper.get_extractor_path(self.config, extractor_key)
 
     def show_version_information(self):
         self._say("{pt}({pn}) plugin for Beets: v{ver}".format(
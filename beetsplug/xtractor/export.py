@@ -0,0 +1,454 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import csv
+import hashlib
+import json
+import os
+import shutil
+import struct
+import tempfile
+import time
+from array import array
+from optparse import OptionParser
+
+from beets.library import Library, Item, parse_query_string
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.query import ItemStream
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class ExportColumns(object):
+    """The exported columns: the item id and path, then the numeric fields
+    (floats, nan when missing) and the categorical ones (strings, None when
+    missing).
+    """
+    numeric = None
+    categorical = None
+
+    def __init__(self, numeric, categorical):
+        self.numeric = list(numeric)
+        self.categorical = list(categorical)
+
+    @property
+    def names(self):
+        return ["id", "path"] + self.numeric + self.categorical
+
+
+def iter_export_chunks(lib: Library, columns: ExportColumns, where="1", subvals=(), chunk_size=5000):
+    """yields the rows (tuples in the order of the columns) of the items, ordered by id, a
+    chunk at a time: the items are read by id ranges straight from SQLite, which also converts
+    the values
+    """
+    # 0 is the default of the fixed fields (ex.: bpm)
+    fixed = ["NULLIF({0}, 0)".format(field) for field in columns.numeric if field in Item._fields]
+    fixed_positions = [index for index, field in enumerate(columns.numeric) if field in Item._fields]
+    numeric = [field for field in columns.numeric if field not in Item._fields]
+    categorical = [field for field in columns.categorical if field not in Item._fields]
+    positions = {field: index for index, field in enumerate(columns.numeric + columns.categorical)}
+    template = [float("nan")] * len(columns.numeric) + [None] * len(columns.categorical)
+    flex_query = "SELECT entity_id, key, CAST(value AS {type}) FROM " + Item._flex_table + \
+                 " WHERE entity_id BETWEEN ? AND ? AND key IN ({keys}) AND value IS NOT NULL"
+
+    last_id = 0
+    while True:
+        with lib.transaction():
+            # Plain tuples: much faster to fetch than the rows of the library connection
+            cursor = lib._connection().cursor()
+            cursor.row_factory = None
+            rows = cursor.execute("SELECT {cols} FROM {table} WHERE id > ? AND {where} ORDER BY id LIMIT ?".format(
+                cols=", ".join(["id", "path"] + fixed), table=Item._table, where=where),
+                (last_id,) + tuple(subvals) + (chunk_size,)).fetchall()
+            if not rows:
+                return
+            first_id, last_id = rows[0][0], rows[-1][0]
+            flex_rows = []
+            for fields, value_type in ((numeric, "REAL"), (categorical, "TEXT")):
+                if fields:
+                    flex_rows.extend(cursor.execute(
+                        flex_query.format(type=value_type, keys=", ".join("?" * len(fields))),
+                        (first_id, last_id) + tuple(fields)).fetchall())
+
+        values = {}
+        for row in rows:
+            row_values = values[row[0]] = list(template)
+            for index, value in zip(fixed_positions, row[2:]):
+                if value is not None:
+                    row_values[index] = float(value)
+        for entity_id, key, value in flex_rows:
+            if entity_id in values:
+                values[entity_id][positions[key]] = value
+
+        yield [(row[0], row[1] if isinstance(row[1], bytes) else os.fsencode(row[1])) + tuple(values[row[0]])
+               for row in rows]
+
+
+def get_row_hash(row):
+    """a 64 bit digest of the exported values of an item
+    """
+    digest = hashlib.blake2b(repr(row).encode(errors="replace"), digest_size=8).digest()
+    return struct.unpack("<q", digest)[0]
+
+
+class ExportState(object):
+    """What the last export of an output contained: its format and columns, and
+    the digest of the row of each item (sorted by item id), in `<output>.state`.
+    """
+    path = None
+    format = None
+    columns = None
+    # id, digest, id, digest...
+    digests = None
+
+    def __init__(self, output_path):
+        self.path = output_path.rstrip(os.sep) + ".state"
+        self.digests = array("q")
+
+    def exists(self):
+        return os.path.isfile(self.path)
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            header = json.loads(f.readline())
+            self.digests = array("q")
+            self.digests.frombytes(f.read())
+        self.format = header["format"]
+        self.columns = header["columns"]
+
+    def save(self, export_format, columns, digests):
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(json.dumps({"format": export_format, "columns": columns}).encode() + b"\n")
+            digests.tofile(f)
+        os.replace(tmp_path, self.path)
+
+    def iter_digests(self):
+        for i in range(0, len(self.digests), 2):
+            yield self.digests[i], self.digests[i + 1]
+
+
+class ExportWriter(object):
+    """Writes the rows of an export. With `append` the rows are added to the
+    ones of the existing output (written with the same columns).
+    """
+    path = None
+    columns = None
+    append = False
+
+    def __init__(self, path, columns, append=False):
+        self.path = path
+        self.columns = columns
+        self.append = append
+
+    def write(self, rows):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+    def abort(self):
+        self.close()
+
+
+class CsvWriter(ExportWriter):
+    """A CSV file with a header (missing values are empty)."""
+    _file = None
+    _writer = None
+
+    def __init__(self, path, columns, append=False):
+        super(CsvWriter, self).__init__(path, columns, append)
+        exists = append and os.path.isfile(path) and os.path.getsize(path) > 0
+        self._file = open(path, "a" if exists else "w", newline="", encoding="utf-8")
+        self._writer = csv.writer(self._file)
+        if not exists:
+            self._writer.writerow(columns.names)
+
+    def write(self, rows):
+        self._writer.writerows(
+            (row[0], row[1].decode("utf-8", "replace")) + tuple("" if v is None or v != v else v for v in row[2:])
+            for row in rows)
+
+    def close(self):
+        if self._file:
+            self._file.close()
+            self._file = None
+
+
+class NpyWriter(ExportWriter):
+    """A directory of .npy files (one per column, memory-mappable with
+    `numpy.load(path, mmap_mode="r")`): `id` (int64), `path` (utf-8 bytes) and
+    the fields (float64, nan when missing, or unicode strings, empty when
+    missing). The rows are spooled to a temporary directory and the arrays are
+    written in chunks when the export is complete.
+    """
+    _spool_path = None
+    _spools = None
+    _widths = None
+    _count = 0
+
+    def __init__(self, path, columns, append=False):
+        super(NpyWriter, self).__init__(path, columns, append)
+        os.makedirs(path, exist_ok=True)
+        self._spool_path = tempfile.mkdtemp(prefix=".spool-", dir=path)
+        self._spools = [open(os.path.join(self._spool_path, name), "wb") for name in columns.names]
+        self._widths = [0] * len(columns.names)
+        self._count = 0
+
+    def write(self, rows):
+        for index, values in enumerate(zip(*rows)):
+            if index == 0:
+                array("q", values).tofile(self._spools[index])
+            elif 1 < index < 2 + len(self.columns.numeric):
+                array("d", values).tofile(self._spools[index])
+            else:
+                encoded = [v if isinstance(v, bytes) else (v or "").encode("utf-8") for v in values]
+                self._widths[index] = max([self._widths[index]] + [len(v) for v in encoded])
+                for value in encoded:
+                    self._spools[index].write(struct.pack("<I", len(value)) + value)
+        self._count += len(rows)
+
+    def close(self, chunk_size=65536):
+        for spool in self._spools:
+            spool.close()
+
+        for index, name in enumerate(self.columns.names):
+            array_path = os.path.join(self.path, name + ".npy")
+            spool_path = os.path.join(self._spool_path, name)
+            existing = numpy.load(array_path, mmap_mode="r") if self.append and os.path.isfile(array_path) else None
+            offset = len(existing) if existing is not None else 0
+
+            if index == 0:
+                dtype = numpy.dtype(numpy.int64)
+            elif 1 < index < 2 + len(self.columns.numeric):
+                dtype = numpy.dtype(numpy.float64)
+            else:
+                # utf-8 bytes for the paths, unicode for the categories
+                width = max(1, self._widths[index], existing.dtype.itemsize // (4 if index > 1 else 1)
+                            if existing is not None else 0)
+                dtype = numpy.dtype("S{}".format(width) if index == 1 else "U{}".format(width))
+
+            tmp_path = array_path + ".tmp.npy"
+            target = numpy.lib.format.open_memmap(tmp_path, mode="w+", dtype=dtype, shape=(offset + self._count,))
+            for start in range(0, offset, chunk_size):
+                end = min(start + chunk_size, offset)
+                target[start:end] = existing[start:end]
+            with open(spool_path, "rb") as spool:
+                position = offset
+                if dtype.kind in ("i", "f"):
+                    while True:
+                        values = numpy.fromfile(spool, dtype=dtype, count=chunk_size)
+                        if not len(values):
+                            break
+                        target[position:position + len(values)] = values
+                        position += len(values)
+                else:
+                    for position, value in enumerate(_read_spooled_strings(spool), offset):
+                        target[position] = value if dtype.kind == "S" else value.decode("utf-8")
+            target.flush()
+            del target
+            del existing
+            os.replace(tmp_path, array_path)
+
+        shutil.rmtree(self._spool_path, ignore_errors=True)
+
+    def abort(self):
+        for spool in self._spools:
+            spool.close()
+        shutil.rmtree(self._spool_path, ignore_errors=True)
+
+
+def _read_spooled_strings(spool):
+    while True:
+        header = spool.read(4)
+        if not header:
+            return
+        yield spool.read(struct.unpack("<I", header)[0])
+
+
+class ParquetWriter(ExportWriter):
+    """A Parquet file (a row group per chunk) written with pyarrow. On append
+    the existing row groups are copied to a new file followed by the new rows.
+    """
+    _writer = None
+    _tmp_path = None
+    _schema = None
+
+    def __init__(self, path, columns, append=False):
+        super(ParquetWriter, self).__init__(path, columns, append)
+        import pyarrow
+        import pyarrow.parquet
+
+        self._schema = pyarrow.schema([("id", pyarrow.int64()), ("path", pyarrow.string())]
+                                      + [(field, pyarrow.float64()) for field in columns.numeric]
+                                      + [(field, pyarrow.string()) for field in columns.categorical])
+        self._tmp_path = path + ".tmp"
+        self._writer = pyarrow.parquet.ParquetWriter(self._tmp_path, self._schema)
+        if append and os.path.isfile(path):
+            existing = pyarrow.parquet.ParquetFile(path)
+            if not existing.schema_arrow.equals(self._schema):
+                self.abort()
+                raise ValueError("The columns of {} differ from the exported ones".format(path))
+            for batch in existing.iter_batches():
+                self._writer.write_batch(batch)
+
+    def write(self, rows):
+        import pyarrow
+
+        values = list(zip(*rows))
+        values[1] = [path.decode("utf-8", "replace") for path in values[1]]
+        self._writer.write_table(pyarrow.Table.from_arrays(
+            [pyarrow.array(column, type=field.type, from_pandas=True)
+             for column, field in zip(values, self._schema)], schema=self._schema))
+
+    def close(self):
+        self._writer.close()
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self):
+        self._writer.close()
+        if os.path.isfile(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+
+EXPORT_FORMATS = {
+    "csv": CsvWriter,
+    "npy": NpyWriter,
+    "parquet": ParquetWriter,
+}
+
+
+def get_export_format(output_path):
+    """the format of the output by its extension: .csv, .parquet or a directory of .npy files
+    """
+    extension = os.path.splitext(output_path)[1].lower().lstrip(".")
+    return extension if extension in ("csv", "parquet") else "npy"
+
+
+def export_items(lib: Library, output_path, columns: ExportColumns, export_format=None, incremental=False,
+                 where="1", subvals=(), chunk_size=5000):
+    """writes the items to the output - with `incremental` only the ones which changed since the
+    last export (of the same columns to the same output) are appended. Returns the number of
+    items read and of items written.
+    """
+    export_format = export_format or get_export_format(output_path)
+    if export_format not in EXPORT_FORMATS:
+        raise ValueError("Invalid export format '{}' (valid: {})".format(export_format, ", ".join(EXPORT_FORMATS)))
+
+    state = ExportState(output_path)
+    if incremental and state.exists():
+        state.load()
+        if state.format != export_format or state.columns != columns.names:
+            raise ValueError("The last export to {} has other columns or another format: "
+                             "export all the items again (without --incremental)".format(output_path))
+    else:
+        incremental = False
+        if export_format == "npy" and os.path.isdir(output_path):
+            for name in os.listdir(output_path):
+                if name.endswith(".npy"):
+                    os.unlink(os.path.join(output_path, name))
+
+    previous = state.iter_digests() if incremental else iter(())
+    previous_id, previous_digest = next(previous, (None, None))
+    digests = array("q")
+    read = written = 0
+
+    writer = EXPORT_FORMATS[export_format](output_path, columns, append=incremental)
+    try:
+        for chunk in iter_export_chunks(lib, columns, where, subvals, chunk_size):
+            changed = []
+            for row in chunk:
+                digest = get_row_hash(row)
+                # Both are ordered by id
+                while previous_id is not None and previous_id < row[0]:
+                    previous_id, previous_digest = next(previous, (None, None))
+                if previous_id != row[0] or previous_digest != digest:
+                    changed.append(row)
+                digests.extend((row[0], digest))
+            if changed:
+                writer.write(changed)
+            read += len(chunk)
+            written += len(changed)
+    except BaseException:
+        writer.abort()
+        raise
+    writer.close()
+
+    state.save(export_format, columns.names, digests)
+
+    return read, written
+
+
+class ExportCommand(object):
+    """`beet xtractor export [options] [QUERY...]`: writes the extracted
+    descriptors of the items (with their id and path) to a CSV, Parquet or
+    memory-mappable .npy output, read in chunks straight from the database.
+    """
+    config = None
+    parser = None
+
+    def __init__(self, config):
+        self.config = config
+        self.parser = OptionParser(usage='beet {plg} export [options] [QUERY...]'.format(
+            plg=helper.plg_ns['__PLUGIN_NAME__']))
+        self.parser.add_option('-o', '--output', action='store', dest='output', default=None,
+                               help=u'the output: a .csv or .parquet file, or a directory of .npy files')
+        self.parser.add_option('-f', '--format', action='store', dest='format', default=None,
+                               help=u'the format of the output: csv, parquet or npy (by default from the extension)')
+        self.parser.add_option('-i', '--incremental', action='store_true', dest='incremental', default=False,
+                               help=u'only append the items which changed since the last export to the output')
+        self.parser.add_option('--chunk-size', action='store', dest='chunk_size', type='int', default=5000,
+                               help=u'[default: 5000] the number of items read from the database at a time')
+        self.parser.add_option('-q', '--quiet', action='store_true', dest='quiet', default=False,
+                               help=u'mute all output')
+
+    def func(self, lib: Library, options, arguments):
+        if not options.output:
+            helper.say("The output of the export is missing: use --output", log_only=False, is_error=True)
+            return
+
+        output_path = os.path.expanduser(options.output)
+        export_format = options.format or get_export_format(output_path)
+        if export_format == "npy" and numpy is None:
+            helper.say("The .npy export requires NumPy: pip install beets-xtractor[numpy]", log_only=False,
+                       is_error=True)
+            return
+
+        from beetsplug.xtractor import XtractorPlugin
+        columns = ExportColumns(*helper.get_aggregate_fields(XtractorPlugin.item_types))
+        where, subvals = self.get_where(lib, arguments)
+
+        started = time.perf_counter()
+        try:
+            read, written = export_items(lib, output_path, columns, export_format, incremental=options.incremental,
+                                         where=where, subvals=subvals, chunk_size=options.chunk_size)
+        except ImportError as e:
+            helper.say("The {0} export requires {1}: pip install {1}".format(export_format, e.name), log_only=False,
+                       is_error=True)
+            return
+        except ValueError as e:
+            helper.say(str(e), log_only=False, is_error=True)
+            return
+
+        helper.say("Exported {0} of {1} items to {2} in {3:.1f}s".format(
+            written, read, output_path, time.perf_counter() - started), log_only=options.quiet)
+
+    @staticmethod
+    def get_where(lib: Library, arguments):
+        """the SQL condition of the items matching the query
+        """
+        if not arguments:
+            return "1", ()
+
+        query, _ = parse_query_string(" ".join(arguments), Item)
+        where, subvals = query.clause()
+        if where is not None:
+            return where, tuple(subvals)
+
+        # Matched in python: the ids are collected first
+        ids = list(ItemStream(lib, query).ids())
+        return "id IN (SELECT value FROM json_each(?))", (json.dumps(ids),)
@@ -0,0 +1,191 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import multiprocessing
+import os
+import threading
+import time
+
+from beetsplug.xtractor import helper
+
+
+# Weight of the throughput of a new window in the smoothed throughput of the current limit
+THROUGHPUT_SMOOTHING = 0.5
+# Windows measured at a limit before the throughput is compared with the one of the previous limit
+SETTLE_WINDOWS = 2
+# Windows without a new slot after one was taken away for a lower throughput
+HOLD_WINDOWS = 6
+
+
+class ConcurrencyGovernor(object):
+    """Limits the number of concurrent extractions to a limit which is adjusted
+    at runtime between `min_workers` and `max_workers`: every `interval`
+    seconds it is lowered when the load average (per cpu) is above `max_load`
+    or the available memory is below `min_memory` (MB). The throughput (the
+    work, ex.: seconds of audio, extracted per second) is measured over windows
+    of at least `interval` seconds and `min_completions` extractions (and one
+    per slot), and smoothed over the windows at the same limit: once it
+    settled, the limit is raised while more extractions wait than there are
+    free slots, and lowered again when the last slot added made the throughput
+    drop.
+    No extraction is started while the memory is low (unless none is running).
+    """
+    min_workers = 1
+    max_workers = 1
+    limit = 1
+    active = 0
+    max_load = 1.0
+    min_memory = 0
+    interval = 10.0
+    min_completions = 4
+
+    _condition = None
+    _cpu_count = 1
+    _waiting = 0
+    _finished = 0
+    _work = 0.0
+    _checked_at = 0.0
+    # The smoothed throughput at the current limit and at the previous one
+    _level = None
+    _previous_level = None
+    _windows = 0
+    _hold = 0
+    _last_change = 0
+    _stats = None
+
+    def __init__(self, min_workers=1, max_workers=None, max_load=1.0, min_memory=0, interval=10.0,
+                 min_completions=4, load_average=None, available_memory=None, stats=None):
+        self._cpu_count = multiprocessing.cpu_count()
+        self.max_workers = max(1, max_workers or self._cpu_count)
+        self.min_workers = min(max(1, min_workers or 1), self.max_workers)
+        self.limit = self.min_workers
+        self.active = 0
+        self.max_load = max_load
+        self.min_memory = min_memory or 0
+        self.interval = interval
+        self.min_completions = max(1, min_completions)
+        self._condition = threading.Condition()
+        self._waiting = 0
+        self._finished = 0
+        self._work = 0.0
+        self._checked_at = time.monotonic()
+        self._level = None
+        self._previous_level = None
+        self._windows = 0
+        self._hold = 0
+        self._last_change = 0
+        self._stats = stats
+        if load_average:
+            self.get_load_average = load_average
+        if available_memory:
+            self.get_available_memory = available_memory
+
+    def acquire(self):
+        """waits for a free extraction slot
+        """
+        with self._condition:
+            self._waiting += 1
+            try:
+                while True:
+                    self._adjust()
+                    if self.active < self.limit and (not self.active or not self._is_memory_low()):
+                        self.active += 1
+                        return
+                    self._condition.wait(timeout=self.interval)
+            finally:
+                self._waiting -= 1
+
+    def release(self, work=1.0):
+        """frees the slot of an extraction which did `work` (ex.: its seconds of audio, 0 when it failed)
+        """
+        with self._condition:
+            self.active -= 1
+            self._finished += 1
+            self._work += work
+            self._adjust()
+            self._condition.notify_all()
+
+    def get_load_average(self):
+        """the 1 minute load average per cpu (None when not available)
+        """
+        if not hasattr(os, "getloadavg"):
+            return None
+        return os.getloadavg()[0] / self._cpu_count
+
+    @staticmethod
+    def get_available_memory():
+        """the memory available to new processes in MB (None when not available)
+        """
+        try:
+            with open("/proc/meminfo") as f:
+                for line in f:
+                    if line.startswith("MemAvailable:"):
+                        return int(line.split()[1]) / 1024
+        except (OSError, ValueError, IndexError):
+            pass
+
+        try:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+        except (AttributeError, ValueError, OSError):
+            return None
+
+    def _is_memory_low(self):
+        if not self.min_memory:
+            return False
+        available = self.get_available_memory()
+        return available is not None and available < self.min_memory
+
+    def _adjust(self):
+        now = time.monotonic()
+        elapsed = now - self._checked_at
+        if elapsed < self.interval:
+            return
+
+        load = self.get_load_average()
+        if self._is_memory_low():
+            self._set_limit(self.limit - 1, "low memory")
+        elif load is not None and load > self.max_load:
+            self._set_limit(self.limit - 1, "load {0:.2f}".format(load))
+        elif self._finished < max(self.min_completions, self.limit):
+            # Too few extractions for a throughput: the window goes on
+            return
+        else:
+            self._measure(self._work / elapsed)
+        self._finished = 0
+        self._work = 0.0
+        self._checked_at = now
+
+    def _measure(self, throughput):
+        self._level = throughput if self._level is None else \
+            self._level + THROUGHPUT_SMOOTHING * (throughput - self._level)
+        self._windows += 1
+        self._hold = max(0, self._hold - 1)
+        if self._windows < SETTLE_WINDOWS:
+            return
+
+        reason = "throughput {0:.2f}/s".format(self._level)
+        # The last slot added is judged once, when the throughput settled (a later drop comes from elsewhere)
+        added, self._last_change = self._last_change > 0, 0
+        if added and self._previous_level and self._level < 0.95 * self._previous_level:
+            # The last slot added made things slower
+            self._set_limit(self.limit - 1, reason)
+            self._hold = HOLD_WINDOWS
+        elif self._waiting and self._waiting >= self.limit - self.active and not self._hold:
+            self._set_limit(self.limit + 1, reason)
+
+    def _set_limit(self, limit, reason):
+        limit = min(max(limit, self.min_workers), self.max_workers)
+        if limit == self.limit:
+            return
+
+        helper.say("Concurrent extractions: {0} -> {1} ({2})".format(self.limit, limit, reason))
+        self._last_change = limit - self.limit
+        self.limit = limit
+        # The throughput is measured again at the new limit
+        self._previous_level = self._level
+        self._level = None
+        self._windows = 0
+        if self._stats:
+            self._stats.incr("concurrency_up" if self._last_change > 0 else "concurrency_down")
+        self._condition.notify_all()
@@ -2,63 +2,295 @@
 #  Author: Adam Jakab <adam at jakab dot pro>
 #  License: See LICENSE.txt
 
+import copy
+import hashlib
 import json
 import logging
 import os
+import pickle
 
-from confuse import Subview
+from beets import config as beets_config
+from beets.dbcore import types
+from confuse import Subview, load_yaml
+
+from beetsplug.xtractor import about
 
 # Get values as: plg_ns['__PLUGIN_NAME__']
-plg_ns = {}
-about_path = os.path.join(os.path.dirname(__file__), u'about.py')
-with open(about_path) as about_file:
-    exec(about_file.read(), plg_ns)
+plg_ns = {name: value for name, value in vars(about).items() if name.startswith("__")}
 
 __logger__ = logging.getLogger(
     'beets.{plg}'.format(plg=plg_ns['__PLUGIN_NAME__']))
 
+_json_backend = None
+
 
-def extract_from_output(output_path, target_map: Subview):
-    """extracts data from the json file as mapped out in the
-    `low_level_targets` / `high_level_targets` configuration keys
+def _get_json_backend():
+    """returns the fastest json parser installed - imported with the first output parsed
+    (not with the plugin, which beets loads on every invocation)
     """
-    data = {}
+    global _json_backend
+    if _json_backend is None:
+        try:
+            import orjson as backend
+        except ImportError:
+            try:
+                import ujson as backend
+            except ImportError:
+                backend = json
+        _json_backend = backend
+
+    return _json_backend
+
+
+def __getattr__(name):
+    # `helper.json_backend`
+    if name == "json_backend":
+        return _get_json_backend()
+    raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+
+
+TARGET_MAP_KEYS = ("low_level_targets", "high_level_targets")
+AGGREGATE_STATS = ("mean", "median", "std")
+
+# Flexible attribute recording the key of the output the item was mapped from
+OUTPUT_KEY_FIELD = "xtractor_output"
+# Flexible attributes recording the audio file (size, mtime and content key) and the profile of the last analysis
+FILE_FINGERPRINT_FIELD = "xtractor_file"
+PROFILE_FIELD = "xtractor_profile"
+# The profile (in the output key) of the outputs of the older versions, extracted with an unknown profile
+LEGACY_PROFILE = "legacy"
+
+
+def _cast_integer(value):
+    return int(round(float(value)))
+
+
+def _cast_none(value):
+    return value
+
+
+TARGET_CASTERS = {
+    "string": str,
+    "float": float,
+    "integer": _cast_integer,
+}
+
+
+def compile_targets(config: Subview, map_keys=TARGET_MAP_KEYS):
+    """compiles the `low_level_targets` / `high_level_targets` configuration
+    keys into a flat list of (field, path tuple, caster) entries so that the
+    configuration is only looked up once per run
+    """
+    targets = []
+    for map_key in map_keys:
+        target_map = config[map_key]
+        if not target_map.exists():
+            continue
+        for field in target_map.keys():
+            path = tuple(target_map[field]["path"].as_str().split("."))
+            value_type = target_map[field]["type"].as_str()
+            caster = TARGET_CASTERS.get(value_type, _cast_none)
+            targets.append((field, path, caster))
+
+    return targets
 
-    if os.path.isfile(output_path):
-        with open(output_path, "r") as json_file:
-            audiodata = json.load(json_file)
-            for key in target_map.keys():
-                try:
-                    val = extract_value_from_audiodata(audiodata, target_map[key])
-                except AttributeError:
-                    val = None
-
-                data[key] = val
-    else:
+
+def get_required_fields(config: Subview, map_keys=TARGET_MAP_KEYS):
+    """returns the target fields marked as `required` - items missing any of
+    these are considered unprocessed
+    """
+    required_fields = []
+    for map_key in map_keys:
+        target_map = config[map_key]
+        for field in target_map:
+            if target_map[field]["required"].exists() and target_map[field]["required"].get(bool):
+                required_fields.append(field)
+
+    return required_fields
+
+
+def load_output(output_path):
+    """parses the json file created by the extractor
+    """
+    if not os.path.isfile(output_path):
         raise FileNotFoundError("Output file({}) not found!".format(output_path))
 
+    with open(output_path, "rb") as json_file:
+        return _get_json_backend().loads(json_file.read())
+
+
+def extract_from_output(output_path, targets):
+    """extracts data from the json file as mapped out in the compiled targets
+    """
+    return extract_from_audiodata(load_output(output_path), targets)
+
+
+def extract_from_audiodata(audiodata, targets):
+    """extracts data from the parsed audiodata as mapped out in the compiled
+    targets (see: `compile_targets`)
+    """
+    data = {}
+    for field, path, caster in targets:
+        try:
+            val = extract_value_from_audiodata(audiodata, path, caster)
+        except AttributeError:
+            val = None
+
+        data[field] = val
+
     return data
 
 
-def extract_value_from_audiodata(audiodata, target_map_item: Subview):
-    path: str = target_map_item["path"].as_str()
-    value_type = target_map_item["type"].as_str()
-    path_parts = path.split(".")
-    for part in path_parts:
-        if not part in audiodata:
-            raise AttributeError("No path '{}' found in audiodata".format(path))
+def extract_value_from_audiodata(audiodata, path, caster=_cast_none):
+    for part in path:
+        if part not in audiodata:
+            raise AttributeError("No path '{}' found in audiodata".format(".".join(path)))
         audiodata = audiodata[part]
 
-    if value_type == "string":
-        value = str(audiodata)
-    elif value_type == "float":
-        value = float(audiodata)
-    elif value_type == "integer":
-        value = int(round(float(audiodata)))
-    else:
-        value = audiodata
+    return caster(audiodata)
 
-    return value
+
+CONTENT_KEY_CHUNK_SIZE = 64 * 1024
+
+
+def get_content_key(file_path, full=False):
+    """returns a key identifying the content of the file independently of its
+    name and location. By default only the size and three chunks (head, middle
+    and tail) of the file are hashed, with `full` the entire file is hashed
+    """
+    size = os.path.getsize(file_path)
+    digest = hashlib.sha1()
+    with open(file_path, "rb") as f:
+        if full or size <= 3 * CONTENT_KEY_CHUNK_SIZE:
+            digest.update(b"full")
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                digest.update(chunk)
+        else:
+            digest.update("partial:{}".format(size).encode())
+            for offset in (0, (size - CONTENT_KEY_CHUNK_SIZE) // 2, size - CONTENT_KEY_CHUNK_SIZE):
+                f.seek(offset)
+                digest.update(f.read(CONTENT_KEY_CHUNK_SIZE))
+
+    return digest.hexdigest()
+
+
+def get_extractor_path(config: Subview, extractor_key="essentia_extractor"):
+    if not config[extractor_key].exists():
+        raise KeyError("Key '{}' is not defined".format(extractor_key))
+
+    extractor_path = config[extractor_key].as_filename()
+
+    if not os.path.isfile(extractor_path):
+        raise FileNotFoundError("Extractor({}) is not found!".format(
+            extractor_path))
+
+    return extractor_path
+
+
+def get_file_fingerprint(file_path, content_key=None):
+    """returns the size and the modification time (and the content key if given) of
+    the file as a string
+    """
+    stat = os.stat(file_path)
+    parts = [str(stat.st_size), str(stat.st_mtime_ns)]
+    if content_key:
+        parts.append(content_key)
+
+    return ":".join(parts)
+
+
+def value_changed(field_type, old_value, new_value):
+    """tells whether setting the new value would change the field - floats are compared
+    at the precision they are kept with (`types.Float(6)`: 6 decimal digits)
+    """
+    if old_value is None or new_value is None:
+        return old_value is not new_value
+
+    if isinstance(field_type, types.BaseFloat):
+        try:
+            return abs(float(old_value) - float(new_value)) >= 0.5 * 10 ** -field_type.digits
+        except (TypeError, ValueError):
+            return True
+
+    return field_type.normalize(old_value) != field_type.normalize(new_value)
+
+
+def get_profile_hash(profile_content, extractor_path=None):
+    """returns a hash of the effective extractor profile (and of the extractor
+    binary if given) so that results of different setups are never mixed
+    """
+    digest = hashlib.sha1()
+    digest.update(json.dumps(profile_content, sort_keys=True).encode())
+    if extractor_path and os.path.isfile(extractor_path):
+        stat = os.stat(extractor_path)
+        digest.update("{}:{}:{}".format(extractor_path, stat.st_size, int(stat.st_mtime)).encode())
+
+    return digest.hexdigest()
+
+
+def get_data_path(name):
+    """returns the path of a persistent plugin file in the beets configuration directory
+    """
+    return os.path.join(beets_config.config_dir(), "{}_{}".format(plg_ns['__PLUGIN_NAME__'], name))
+
+
+def get_aggregate_fields(item_types):
+    """returns the numeric and the categorical fields which are aggregated
+    """
+    numeric = ["bpm"] + [f for f, t in item_types.items() if isinstance(t, (types.Float, types.Integer))]
+    categorical = [f for f, t in item_types.items() if isinstance(t, types.String)]
+
+    return numeric, categorical
+
+
+def get_album_types(item_types):
+    numeric, categorical = get_aggregate_fields(item_types)
+    album_types = {"{}_{}".format(field, stat): types.Float(6) for field in numeric for stat in AGGREGATE_STATS}
+    album_types.update({"{}_dominant".format(field): types.STRING for field in categorical})
+
+    return album_types
+
+
+_default_configs = {}
+
+
+def load_default_config(config_file_path):
+    """returns the content of the default configuration file - parsed once and kept (pickled, which
+    is much faster to load than yaml) in the beets configuration directory until the file changes
+    (a copy is returned as the caller may change it)
+    """
+    stat = os.stat(config_file_path)
+    source = "{}:{}:{}".format(config_file_path, stat.st_size, stat.st_mtime_ns)
+    if source not in _default_configs:
+        _default_configs[source] = _load_cached_default_config(config_file_path, source)
+
+    return copy.deepcopy(_default_configs[source])
+
+
+def _load_cached_default_config(config_file_path, source):
+    cache_path = None
+    try:
+        cache_path = get_data_path("config_default.pickle")
+        with open(cache_path, "rb") as f:
+            cached_source, content = pickle.load(f)
+        if cached_source == source:
+            return content
+    except Exception:
+        # Missing, unreadable or written by another version
+        pass
+
+    content = load_yaml(config_file_path) or {}
+    if cache_path:
+        # Written aside and moved into place: a concurrent process reads the old or the new file
+        tmp_path = "{}.{}.tmp".format(cache_path, os.getpid())
+        try:
+            with open(tmp_path, "wb") as f:
+                pickle.dump((source, content), f, pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, cache_path)
+        except OSError:
+            pass
+
+    return content
 
 
 def asciify_file_content(file_path):
@@ -0,0 +1,28 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+from beets.library import Item
+
+
+class XtractorJob(object):
+    """The state of a single library item as it moves through the stages
+    of the extraction pipeline
+    """
+    item: Item = None
+    input_path = None
+    # the local copy of the input file (when prefetched)
+    local_path = None
+    content_key = None
+    output_key = None
+    audiodata = None
+    values = None
+    # the fields whose value has been changed by the analysis (nothing is stored when empty)
+    changed_fields = None
+    # whether a changed field is written to the media file
+    write_tags = False
+    error = None
+
+    def __init__(self, item: Item):
+        self.item = item
+        self.changed_fields = set()
@@ -0,0 +1,103 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import sqlite3
+import threading
+import time
+
+STATE_PENDING = "pending"
+STATE_DONE = "done"
+STATE_FAILED = "failed"
+
+
+class Journal(object):
+    """Persistent per-item state of the extraction runs. Items left pending by
+    an interrupted run can be resumed, failed items are not retried before
+    their (exponentially growing) backoff delay expires.
+    """
+    path = None
+    retry_delay = 3600
+    retry_max_delay = 7 * 24 * 3600
+
+    _connection = None
+    _lock = None
+
+    def __init__(self, path, retry_delay=3600, retry_max_delay=7 * 24 * 3600):
+        self.path = path
+        self.retry_delay = retry_delay
+        self.retry_max_delay = retry_max_delay
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript("""
+                CREATE TABLE IF NOT EXISTS jobs (
+                    item_id INTEGER PRIMARY KEY,
+                    state TEXT,
+                    reason TEXT,
+                    attempts INTEGER DEFAULT 0,
+                    updated REAL,
+                    retry_after REAL);
+                CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state);
+                """)
+
+    def mark_pending(self, item_ids):
+        """registers the items of a new run - failed items keep their attempt count
+        """
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany("""
+                INSERT INTO jobs (item_id, state, updated) VALUES (?, ?, ?)
+                ON CONFLICT (item_id) DO UPDATE SET state = excluded.state, updated = excluded.updated
+                """, ((item_id, STATE_PENDING, now) for item_id in item_ids))
+
+    def mark_done(self, item_ids):
+        now = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany("""
+                INSERT INTO jobs (item_id, state, reason, attempts, updated, retry_after) VALUES (?, ?, NULL, 0, ?, NULL)
+                ON CONFLICT (item_id) DO UPDATE SET
+                    state = excluded.state, reason = NULL, attempts = 0, updated = excluded.updated, retry_after = NULL
+                """, ((item_id, STATE_DONE, now) for item_id in item_ids))
+
+    def mark_failed(self, item_id, reason):
+        now = time.time()
+        with self._lock, self._connection:
+            row = self._connection.execute("SELECT attempts FROM jobs WHERE item_id = ?", (item_id,)).fetchone()
+            attempts = (row[0] or 0) + 1 if row else 1
+            delay = min(self.retry_delay * 2 ** (attempts - 1), self.retry_max_delay)
+            self._connection.execute("""
+                INSERT OR REPLACE INTO jobs (item_id, state, reason, attempts, updated, retry_after)
+                VALUES (?, ?, ?, ?, ?, ?)
+                """, (item_id, STATE_FAILED, reason, attempts, now, now + delay))
+
+    def get_pending_ids(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT item_id FROM jobs WHERE state = ?", (STATE_PENDING,)).fetchall()
+
+        return [row[0] for row in rows]
+
+    def get_blocked_ids(self):
+        """returns the ids of the failed items still waiting for their retry
+        """
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT item_id FROM jobs WHERE state = ? AND retry_after > ?", (STATE_FAILED, time.time())
+            ).fetchall()
+
+        return set(row[0] for row in rows)
+
+    def get(self, item_id):
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT state, reason, attempts, retry_after FROM jobs WHERE item_id = ?", (item_id,)
+            ).fetchone()
+
+        if row is None:
+            return None
+
+        return dict(zip(("state", "reason", "attempts", "retry_after"), row))
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
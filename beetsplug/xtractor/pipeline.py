@@ -0,0 +1,225 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import queue
+import threading
+import time
+
+from beetsplug.xtractor import helper
+
+_STOP = object()
+
+
+class Stage(object):
+    """A step of the pipeline run by `workers` threads reading from a bounded
+    queue. `func` is called with a job and returns the job to be handed over
+    to the next stage (or None to drop it). A batch stage (`batch_size` > 1) is
+    called with a list of jobs, collected until `batch_size` jobs are waiting
+    or `batch_interval` seconds have passed, and returns the list of jobs to
+    hand over.
+    """
+    name = None
+    func = None
+    workers = 1
+    queue_size = 0
+    batch_size = 1
+    batch_interval = 0.0
+
+    def __init__(self, name, func, workers=1, queue_size=0, batch_size=1, batch_interval=0.0):
+        self.name = name
+        self.func = func
+        self.workers = max(1, workers)
+        self.queue_size = queue_size if queue_size > 0 else 2 * self.workers
+        self.batch_size = max(1, batch_size)
+        self.batch_interval = max(0.0, batch_interval)
+
+    @property
+    def is_batch(self):
+        return self.batch_size > 1
+
+
+class Pipeline(object):
+    """Runs jobs through a chain of stages. Every stage has its own worker
+    threads and its own bounded input queue so that the stages overlap while
+    a slow stage holds back the ones feeding it. With `stats` (RunStats) the
+    time spent in each stage (`stage_<name>`) and the time a stage waits for
+    room in the queue of the next one (`blocked_<name>`) are recorded.
+    """
+    stages = None
+    on_done = None
+    on_error = None
+    stats = None
+
+    _queues = None
+    _threads = None
+    _running = None
+    _lock = None
+
+    def __init__(self, stages, on_done=None, on_error=None, stats=None):
+        self.stages = stages
+        self.on_done = on_done
+        self.on_error = on_error
+        self.stats = stats
+        self._lock = threading.Lock()
+
+    def run(self, jobs):
+        """feeds the jobs to the first stage and waits until every job left the
+        pipeline. `on_done` is called with each job (in completion order) as it
+        passes the last stage or is dropped by one of them, `on_error` with the
+        job (or batch) and the exception raised by a stage
+        """
+        self._queues = [queue.Queue(maxsize=stage.queue_size) for stage in self.stages]
+        self._running = [stage.workers for stage in self.stages]
+        self._threads = []
+        for index, stage in enumerate(self.stages):
+            target = self._run_batch_worker if stage.is_batch else self._run_worker
+            for n in range(stage.workers):
+                thread = threading.Thread(target=target, args=(index,),
+                                          name="xtractor-{}-{}".format(stage.name, n), daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+        try:
+            for job in jobs:
+                self._queues[0].put(job)
+        finally:
+            for _ in range(self.stages[0].workers):
+                self._queues[0].put(_STOP)
+            for thread in self._threads:
+                thread.join()
+
+    def _run_worker(self, index):
+        stage = self.stages[index]
+        try:
+            while True:
+                job = self._queues[index].get()
+                if job is _STOP:
+                    break
+                result = self._call(stage, job)
+                if result is None:
+                    self._done(job)
+                else:
+                    self._forward(index, result)
+        finally:
+            self._stop_worker(index)
+
+    def _run_batch_worker(self, index):
+        stage = self.stages[index]
+        batch = []
+        deadline = None
+        try:
+            while True:
+                timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+                try:
+                    job = self._queues[index].get(timeout=timeout)
+                except queue.Empty:
+                    job = None
+
+                if job is _STOP:
+                    if batch:
+                        self._forward_all(index, batch, self._call(stage, batch))
+                    break
+
+                if job is not None:
+                    batch.append(job)
+                    if deadline is None:
+                        deadline = time.monotonic() + stage.batch_interval
+
+                if batch and (len(batch) >= stage.batch_size or time.monotonic() >= deadline):
+                    self._forward_all(index, batch, self._call(stage, batch))
+                    batch = []
+                    deadline = None
+        finally:
+            self._stop_worker(index)
+
+    def _call(self, stage, job):
+        started = time.perf_counter()
+        try:
+            return stage.func(job)
+        except Exception as e:
+            helper.say("Stage '{0}' failed: {1}".format(stage.name, e), is_error=True)
+            if self.on_error:
+                self._callback(self.on_error, job, e)
+            return [] if isinstance(job, list) else None
+        finally:
+            if self.stats:
+                self.stats.add_time("stage_" + stage.name, time.perf_counter() - started)
+
+    def _forward_all(self, index, batch, jobs):
+        jobs = jobs or []
+        forwarded = set(id(job) for job in jobs)
+        for job in jobs:
+            self._forward(index, job)
+        for job in batch:
+            if id(job) not in forwarded:
+                self._done(job)
+
+    def _forward(self, index, job):
+        if index + 1 < len(self.stages):
+            if self.stats and self._queues[index + 1].full():
+                started = time.perf_counter()
+                self._queues[index + 1].put(job)
+                self.stats.add_time("blocked_" + self.stages[index].name, time.perf_counter() - started)
+            else:
+                self._queues[index + 1].put(job)
+        else:
+            self._done(job)
+
+    def _done(self, job):
+        if self.on_done:
+            with self._lock:
+                self._callback(self.on_done, job)
+
+    def _callback(self, func, *args):
+        """calls on_done/on_error - a failing callback is reported but never stops a worker (which
+        would leave the next stage waiting forever)
+        """
+        try:
+            func(*args)
+        except Exception as e:
+            helper.say("Pipeline callback failed: {0}".format(e), is_error=True)
+            if self.stats:
+                self.stats.incr("callback_errors")
+
+    def _stop_worker(self, index):
+        """the last worker of a stage to stop shuts down the next stage
+        """
+        with self._lock:
+            self._running[index] -= 1
+            last = self._running[index] == 0
+
+        if last and index + 1 < len(self.stages):
+            for _ in range(self.stages[index + 1].workers):
+                self._queues[index + 1].put(_STOP)
+
+
+class RateLimiter(object):
+    """Spaces the calls of `wait` (from any number of threads) so that at most
+    `rate` of them return per second (0: no limit).
+    """
+    rate = 0.0
+
+    _next = 0.0
+    _lock = None
+
+    def __init__(self, rate=0.0):
+        self.rate = max(0.0, rate or 0.0)
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def wait(self):
+        """blocks until the next call is allowed and returns the time waited
+        """
+        if not self.rate:
+            return 0.0
+
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + 1.0 / self.rate
+
+        if start > now:
+            time.sleep(start - now)
+
+        return start - now
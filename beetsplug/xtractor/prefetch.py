@@ -0,0 +1,87 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import os
+import shutil
+import tempfile
+import threading
+
+
+class Prefetcher(object):
+    """Copies the input files to a local scratch directory (tmpfs or SSD) ahead
+    of their extraction so that the extractor never reads over the network.
+    The copies held at any time never exceed `budget` bytes (a single larger
+    file is still copied when nothing else is held).
+    """
+    path = None
+    budget = 0
+    used = 0
+
+    _sizes = None
+    _condition = None
+    _closed = False
+
+    def __init__(self, path, budget):
+        if not os.path.isdir(path):
+            raise FileNotFoundError("Prefetch path({}) does not exist!".format(path))
+        self.path = path
+        self.budget = budget
+        self.used = 0
+        self._sizes = {}
+        self._condition = threading.Condition()
+        self._closed = False
+
+    def fetch(self, input_path):
+        """copies the file to the scratch directory (waiting for room in the budget)
+        and returns the path of the copy
+        """
+        size = os.path.getsize(input_path)
+        with self._condition:
+            while self.used and self.used + size > self.budget and not self._closed:
+                self._condition.wait()
+            self.used += size
+
+        extension = os.path.splitext(input_path)[1]
+        fd, local_path = tempfile.mkstemp(prefix="xtractor-", suffix=extension, dir=self.path)
+        try:
+            with os.fdopen(fd, "wb") as dst, open(input_path, "rb") as src:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+        except OSError:
+            os.unlink(local_path)
+            self._free(size)
+            raise
+
+        with self._condition:
+            self._sizes[local_path] = size
+
+        return local_path
+
+    def release(self, local_path):
+        """deletes the copy and gives its room back (calling it twice is harmless)
+        """
+        with self._condition:
+            size = self._sizes.pop(local_path, None)
+        if size is None:
+            return
+
+        try:
+            os.unlink(local_path)
+        except FileNotFoundError:
+            pass
+        self._free(size)
+
+    def close(self):
+        """deletes the copies left behind (of the jobs dropped on errors)
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+            local_paths = list(self._sizes)
+        for local_path in local_paths:
+            self.release(local_path)
+
+    def _free(self, size):
+        with self._condition:
+            self.used -= size
+            self._condition.notify_all()
@@ -0,0 +1,211 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import os
+import queue
+import shutil
+import signal
+import tempfile
+import time
+from contextlib import contextmanager
+from subprocess import Popen, TimeoutExpired
+
+from beetsplug.xtractor import helper
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+IONICE_CLASSES = {
+    "none": None,
+    "realtime": 1,
+    "best-effort": 2,
+    "idle": 3,
+}
+
+
+class ProcessResult(object):
+    returncode = None
+    stdout = b""
+    stderr = b""
+    timed_out = False
+    wall_time = 0.0
+    # user + system time of the process (None when not available)
+    cpu_time = None
+
+    @property
+    def failed(self):
+        return self.timed_out or self.returncode != 0
+
+
+class ProcessLimits(object):
+    """Resource controls applied to each extractor process: priority (nice and
+    ionice), the cpu set of the worker slot running it, and optional wall-time
+    and memory limits.
+    """
+    nice = 0
+    ionice_class = None
+    ionice_level = None
+    timeout = None
+    memory_limit = None
+    cpu_sets = None
+
+    _slots = None
+
+    def __init__(self, nice=0, ionice="none", ionice_level=None, timeout=0, memory_limit=0,
+                 cpu_affinity=False, slots=1):
+        self.nice = nice or 0
+        if ionice not in IONICE_CLASSES:
+            raise ValueError("Invalid ionice class '{}' (valid: {})".format(ionice, ", ".join(IONICE_CLASSES)))
+        self.ionice_class = IONICE_CLASSES[ionice]
+        self.ionice_level = ionice_level
+        self.timeout = timeout if timeout and timeout > 0 else None
+        self.memory_limit = memory_limit * 1024 * 1024 if memory_limit and memory_limit > 0 else None
+        self.cpu_sets = self._get_cpu_sets(cpu_affinity, max(1, slots))
+
+        self._slots = queue.Queue()
+        for slot in range(max(1, slots)):
+            self._slots.put(slot)
+
+    @staticmethod
+    def _get_cpu_sets(cpu_affinity, slots):
+        """returns one cpu set per worker slot. With `cpu_affinity: yes` the
+        available cpus are split evenly between the slots, a list (ex.: ["0-1", "2,3"])
+        gives the cpu set of each slot explicitly
+        """
+        if not cpu_affinity or not hasattr(os, "sched_getaffinity"):
+            return None
+
+        if isinstance(cpu_affinity, (list, tuple)):
+            return [parse_cpu_set(cpu_set) for cpu_set in cpu_affinity]
+
+        cpus = sorted(os.sched_getaffinity(0))
+        if slots >= len(cpus):
+            return [{cpus[slot % len(cpus)]} for slot in range(slots)]
+
+        size = len(cpus) // slots
+        return [set(cpus[slot * size:(slot + 1) * size]) for slot in range(slots)]
+
+    @contextmanager
+    def slot(self):
+        """reserves a worker slot for the duration of an extraction
+        """
+        slot = self._slots.get()
+        try:
+            yield slot
+        finally:
+            self._slots.put(slot)
+
+    def wrap_command(self, cmd_and_args):
+        if self.ionice_class is None:
+            return cmd_and_args
+
+        ionice_path = shutil.which("ionice")
+        if not ionice_path:
+            helper.say("The 'ionice' command is not available - ignoring io priority")
+            return cmd_and_args
+
+        wrapper = [ionice_path, "-c", str(self.ionice_class)]
+        if self.ionice_level is not None and self.ionice_class != 3:
+            wrapper += ["-n", str(self.ionice_level)]
+
+        return wrapper + cmd_and_args
+
+    def apply(self, pid, slot):
+        """applies the limits to the (just started) process from the parent so
+        that no code runs in the forked child of a threaded parent
+        """
+        if self.nice and hasattr(os, "setpriority"):
+            os.setpriority(os.PRIO_PROCESS, pid, min(19, os.getpriority(os.PRIO_PROCESS, pid) + self.nice))
+
+        if self.cpu_sets:
+            os.sched_setaffinity(pid, self.cpu_sets[slot % len(self.cpu_sets)])
+
+        if self.memory_limit and resource and hasattr(resource, "prlimit"):
+            resource.prlimit(pid, resource.RLIMIT_AS, (self.memory_limit, self.memory_limit))
+
+    def run(self, cmd_and_args):
+        """runs the command in a worker slot and kills it if it exceeds the
+        wall-time limit
+        """
+        result = ProcessResult()
+        with self.slot() as slot, tempfile.TemporaryFile() as stdout, tempfile.TemporaryFile() as stderr:
+            started = time.monotonic()
+            proc = Popen(self.wrap_command(cmd_and_args), stdout=stdout, stderr=stderr)
+            try:
+                self.apply(proc.pid, slot)
+            except OSError as e:
+                helper.say("Unable to apply process limits: {0}".format(e))
+
+            if hasattr(os, "wait4"):
+                # Reaped here to get the resource usage of the process
+                proc.returncode, rusage, result.timed_out = self._wait4(proc.pid)
+                result.cpu_time = rusage.ru_utime + rusage.ru_stime
+            else:
+                try:
+                    proc.wait(timeout=self.timeout)
+                except TimeoutExpired:
+                    proc.kill()
+                    proc.wait()
+                    result.timed_out = True
+            result.wall_time = time.monotonic() - started
+
+            stdout.seek(0)
+            result.stdout = stdout.read()
+            stderr.seek(0)
+            result.stderr = stderr.read()
+
+        result.returncode = proc.returncode
+        return result
+
+    def _wait4(self, pid):
+        """waits for the process to exit (killing it when it exceeds the wall-time limit) and
+        returns its exit code, its resource usage and whether it was killed
+        """
+        if self.timeout:
+            deadline = time.monotonic() + self.timeout
+            delay = 0.001
+            while True:
+                done, status, rusage = os.wait4(pid, os.WNOHANG)
+                if done:
+                    return _get_exit_code(status), rusage, False
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                time.sleep(min(delay, remaining, 0.05))
+                delay *= 2
+
+            # Not reaped yet: the pid can not have been reused
+            os.kill(pid, signal.SIGKILL)
+            _, status, rusage = os.wait4(pid, 0)
+            return _get_exit_code(status), rusage, True
+
+        _, status, rusage = os.wait4(pid, 0)
+        return _get_exit_code(status), rusage, False
+
+
+def _get_exit_code(status):
+    """the return code of a wait status, as set by Popen (negative signal number when killed)
+    """
+    if os.WIFSIGNALED(status):
+        return -os.WTERMSIG(status)
+    return os.WEXITSTATUS(status)
+
+
+def parse_cpu_set(cpu_set):
+    """parses a cpu set definition like "0-3,6" into a set of cpu numbers
+    """
+    cpus = set()
+    for part in str(cpu_set).split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            start, end = part.split("-", 1)
+            cpus.update(range(int(start), int(end) + 1))
+        else:
+            cpus.add(int(part))
+
+    return cpus
@@ -0,0 +1,232 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import json
+from array import array
+from typing import Optional, Sequence, Tuple
+
+from beets.dbcore import Query
+from beets.dbcore.query import InQuery, AndQuery
+from beets.library import Library, Item
+
+
+class MissingFieldsQuery(Query):
+    """Matches the items on which any of the given fields is not set. Unlike an
+    `OrQuery` of `MatchQuery(field, None)` on flexible attributes (which is
+    evaluated in python on every item of the library) this query runs entirely
+    in SQLite: the flexible attributes are counted with a single lookup on the
+    (entity_id, key) index of the attribute table.
+    """
+    fields = None
+
+    def __init__(self, fields: Sequence[str]):
+        self.fields = list(fields)
+
+    def clause(self) -> Tuple[Optional[str], Sequence]:
+        if not self.fields:
+            return "0", ()
+
+        clauses = []
+        subvals = []
+        fixed_fields = [f for f in self.fields if f in Item._fields]
+        flex_fields = [f for f in self.fields if f not in Item._fields]
+
+        for field in fixed_fields:
+            clauses.append("{}.{} IS NULL".format(Item._table, field))
+
+        if flex_fields:
+            clauses.append(
+                "(SELECT COUNT(*) FROM {flex} WHERE {flex}.entity_id = {table}.id "
+                "AND {flex}.key IN ({keys}) AND {flex}.value IS NOT NULL) < ?".format(
+                    flex=Item._flex_table, table=Item._table, keys=", ".join("?" * len(flex_fields))))
+            subvals.extend(flex_fields)
+            subvals.append(len(flex_fields))
+
+        return "({})".format(" OR ".join(clauses)), subvals
+
+    def match(self, obj) -> bool:
+        return any(obj.get(field) is None for field in self.fields)
+
+    def __repr__(self) -> str:
+        return "{}({!r})".format(self.__class__.__name__, self.fields)
+
+    def __eq__(self, other) -> bool:
+        return super().__eq__(other) and self.fields == other.fields
+
+    def __hash__(self) -> int:
+        return hash((self.__class__.__name__, tuple(self.fields)))
+
+
+class FieldChangedQuery(Query):
+    """Matches the items on which the flexible attribute is set to another value
+    than the given one (in SQLite).
+    """
+    field = None
+    value = None
+
+    def __init__(self, field, value):
+        self.field = field
+        self.value = value
+
+    def clause(self) -> Tuple[Optional[str], Sequence]:
+        return "EXISTS (SELECT 1 FROM {flex} WHERE {flex}.entity_id = {table}.id AND {flex}.key = ? " \
+               "AND {flex}.value != ?)".format(flex=Item._flex_table, table=Item._table), (self.field, self.value)
+
+    def match(self, obj) -> bool:
+        value = obj.get(self.field)
+        return value is not None and value != self.value
+
+    def __repr__(self) -> str:
+        return "{}({!r}, {!r})".format(self.__class__.__name__, self.field, self.value)
+
+    def __eq__(self, other) -> bool:
+        return super().__eq__(other) and (self.field, self.value) == (other.field, other.value)
+
+    def __hash__(self) -> int:
+        return hash((self.__class__.__name__, self.field, self.value))
+
+
+class IdSetQuery(Query):
+    """Matches the items of a set of ids of any size: the ids are passed to SQLite
+    as a single json array.
+    """
+    ids = None
+
+    def __init__(self, ids):
+        self.ids = set(ids)
+
+    def clause(self) -> Tuple[Optional[str], Sequence]:
+        return "{}.id IN (SELECT value FROM json_each(?))".format(Item._table), (json.dumps(sorted(self.ids)),)
+
+    def match(self, obj) -> bool:
+        return obj.id in self.ids
+
+    def __repr__(self) -> str:
+        return "{}({} ids)".format(self.__class__.__name__, len(self.ids))
+
+    def __eq__(self, other) -> bool:
+        return super().__eq__(other) and self.ids == other.ids
+
+    def __hash__(self) -> int:
+        return hash((self.__class__.__name__, len(self.ids)))
+
+
+class ItemStream(object):
+    """Streams the items matching a query from the database one page at a time
+    so that only `page_size` items are in memory however many match. In id
+    order the pages are read with keyset pagination (each page starts after
+    the last id of the previous one). In the order of an SQL expression
+    (`order_by`) or of a beets `sort` only the ids are selected up front, in a
+    compact array. The ids of a given list (`item_ids`) can be streamed instead
+    of the whole library.
+    """
+    lib: Library = None
+    query: Query = None
+    order_by = None
+    order_subvals = ()
+    descending = False
+    sort = None
+    item_ids = None
+    exclude_ids = None
+    page_size = 500
+
+    def __init__(self, lib: Library, query: Query, order_by=None, order_subvals=(), descending=False, sort=None,
+                 item_ids=None, exclude_ids=None, page_size=500):
+        self.lib = lib
+        self.query = query
+        self.order_by = order_by
+        self.order_subvals = tuple(order_subvals)
+        self.descending = descending
+        self.sort = sort
+        self.item_ids = item_ids
+        self.exclude_ids = exclude_ids or set()
+        self.page_size = page_size
+
+    def __iter__(self):
+        for page in self._get_id_pages():
+            yield from self._load_page(page)
+
+    def ids(self):
+        """yields the ids of the items (without loading them when SQLite can evaluate the query)
+        """
+        filtered = self.item_ids is None and self.query.clause()[0] is not None
+        for page in self._get_id_pages():
+            if filtered:
+                yield from (item_id for item_id in page if item_id not in self.exclude_ids)
+            else:
+                yield from (item.id for item in self._load_page(page))
+
+    def _get_id_pages(self):
+        if self.item_ids is not None:
+            ids = self.item_ids
+        elif self.order_by or self.sort:
+            ids = self._select_sorted_ids()
+        else:
+            yield from self._select_id_pages()
+            return
+
+        for i in range(0, len(ids), self.page_size):
+            yield ids[i:i + self.page_size]
+
+    def _select_id_pages(self):
+        where, subvals = self._get_where()
+        last_id = 0
+        while True:
+            with self.lib.transaction() as tx:
+                rows = tx.query("SELECT id FROM {table} WHERE ({where}) AND id > ? ORDER BY id LIMIT ?".format(
+                    table=Item._table, where=where), list(subvals) + [last_id, self.page_size])
+            if not rows:
+                return
+
+            yield [row[0] for row in rows]
+            last_id = rows[-1][0]
+
+    def _select_sorted_ids(self):
+        if self.order_by:
+            order = "{0} {1}, id".format(self.order_by, "DESC" if self.descending else "ASC")
+        else:
+            order = self.sort.order_clause()
+        if not order:
+            # Sorted in python by beets
+            return array("q", (item.id for item in self.lib.items(self.query, self.sort)))
+
+        where, subvals = self._get_where()
+        with self.lib.transaction():
+            cursor = self.lib._connection().execute(
+                "SELECT id FROM {table} WHERE {where} ORDER BY {order}".format(
+                    table=Item._table, where=where, order=order), list(subvals) + list(self.order_subvals))
+            return array("q", (row[0] for row in cursor))
+
+    def _get_where(self):
+        """the SQL part of the query (the rest is matched on the loaded items)
+        """
+        where, subvals = self.query.clause()
+        if where is None:
+            return "1", ()
+
+        return where, subvals
+
+    def _load_page(self, page):
+        page = [item_id for item_id in page if item_id not in self.exclude_ids]
+        if not page:
+            return []
+
+        positions = {item_id: position for position, item_id in enumerate(page)}
+        items = list(self.lib.items(AndQuery([self.query, InQuery("id", page)])))
+
+        return sorted(items, key=lambda item: positions[item.id])
+
+
+def count_items(lib: Library, query: Query):
+    """counts the matching items with an SQL COUNT (without loading them)
+    when the query can be evaluated by SQLite
+    """
+    where, subvals = query.clause()
+    if where is None:
+        return sum(1 for _ in ItemStream(lib, query))
+
+    with lib.transaction() as tx:
+        rows = tx.query("SELECT COUNT(*) FROM {} WHERE {}".format(Item._table, where), subvals)
+
+    return rows[0][0]
@@ -0,0 +1,112 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import json
+import os
+import threading
+
+from beets.library import Item
+
+from beetsplug.xtractor import helper
+
+# Seconds of extraction per second of audio assumed until measured
+DEFAULT_RATE = 0.25
+# Bytes per second of audio assumed when the length of an item is unknown (128kbps)
+DEFAULT_BYTE_RATE = 16000
+# Seconds of audio assumed for an item without a length which was never extracted (no file size recorded)
+DEFAULT_AUDIO_SECONDS = 240
+# Weight of a new measurement in the moving average
+RATE_SMOOTHING = 0.2
+
+
+class ExtractionRates(object):
+    """Measured extraction rates (seconds of extraction per second of audio)
+    per file format, kept between runs in a json file.
+    """
+    path = None
+    rates = None
+
+    _lock = None
+
+    def __init__(self, path=None):
+        self.path = path
+        self.rates = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if self.path and os.path.isfile(self.path):
+            try:
+                with open(self.path, "r") as f:
+                    self.rates = json.load(f)
+            except ValueError as e:
+                helper.say("Invalid rates file({0}): {1}".format(self.path, e), is_error=True)
+                self.rates = {}
+
+    def save(self):
+        if not self.path:
+            return
+
+        with self._lock:
+            content = json.dumps(self.rates, indent=2, sort_keys=True)
+
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+    def get(self, fmt):
+        with self._lock:
+            rate = self.rates.get(fmt or "") or self.rates.get("*")
+
+        return rate if rate else DEFAULT_RATE
+
+    def get_cost_clause(self):
+        """returns the SQL expression (and its values) of the expected extraction time
+        of an item: its length times the rate of its format. Without a length, the audio
+        seconds are estimated (as by `estimate_audio_seconds`) from the file size recorded
+        by the last extraction (the `xtractor_file` attribute: "size:mtime..."), and
+        without either a track of DEFAULT_AUDIO_SECONDS is assumed
+        """
+        with self._lock:
+            rates = {fmt: rate for fmt, rate in self.rates.items() if fmt != "*" and rate}
+
+        size = "(SELECT CAST(substr(value, 1, instr(value, ':') - 1) AS REAL) FROM {0} " \
+               "WHERE entity_id = items.id AND key = ?)".format(Item._flex_table)
+        subvals = [helper.FILE_FINGERPRINT_FIELD, DEFAULT_BYTE_RATE, DEFAULT_AUDIO_SECONDS]
+        for fmt, rate in sorted(rates.items()):
+            subvals += [fmt, rate]
+        cases = "CASE format {0} ELSE ? END".format(" ".join(["WHEN ? THEN ?"] * len(rates))) if rates else "?"
+        subvals.append(self.get("*"))
+
+        return "COALESCE(NULLIF(length, 0), {0} / COALESCE(NULLIF(bitrate, 0) / 8.0, ?), ?) * {1}".format(
+            size, cases), subvals
+
+    def record(self, fmt, audio_seconds, elapsed):
+        if not audio_seconds or audio_seconds <= 0 or elapsed <= 0:
+            return
+
+        measured = elapsed / audio_seconds
+        with self._lock:
+            for key in (fmt or "", "*"):
+                rate = self.rates.get(key)
+                self.rates[key] = measured if not rate else rate + RATE_SMOOTHING * (measured - rate)
+
+
+def estimate_audio_seconds(item: Item):
+    """returns the length of the item, or an estimation based on the file size
+    """
+    length = item.get("length")
+    if length:
+        return length
+
+    try:
+        size = os.path.getsize(item.get("path"))
+    except OSError:
+        return 0.0
+
+    bitrate = item.get("bitrate")
+    byte_rate = bitrate / 8 if bitrate else DEFAULT_BYTE_RATE
+
+    return size / byte_rate
@@ -0,0 +1,272 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import json
+import os
+import time
+from optparse import OptionParser
+
+from beets import config as beets_config
+from beets.library import Library, parse_query_string, Item
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.aggregate import load_arrays
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class SimilarityIndex(object):
+    """The feature vectors of the analysed items, normalized (z-score) so that
+    every field weighs the same, in memory-mapped .npy files:
+    `<path>.npy` (float32 matrix), `<path>_ids.npy` (item ids, sorted) and
+    `<path>.json` (fields, means and standard deviations). Neighbours are
+    found by batched brute-force dot products.
+    """
+    path = None
+    fields = None
+    mean = None
+    std = None
+    ids = None
+    matrix = None
+
+    def __init__(self, path):
+        self.path = path
+
+    @property
+    def matrix_path(self):
+        return self.path + ".npy"
+
+    @property
+    def ids_path(self):
+        return self.path + "_ids.npy"
+
+    @property
+    def meta_path(self):
+        return self.path + ".json"
+
+    def exists(self):
+        return all(os.path.isfile(p) for p in (self.matrix_path, self.ids_path, self.meta_path))
+
+    def load(self):
+        with open(self.meta_path) as f:
+            meta = json.load(f)
+        self.fields = meta["fields"]
+        self.mean = numpy.array(meta["mean"])
+        self.std = numpy.array(meta["std"])
+        self.ids = numpy.load(self.ids_path, mmap_mode="r")
+        self.matrix = numpy.load(self.matrix_path, mmap_mode="r")
+
+    def build(self, fields, ids, values):
+        """creates the index from the (raw) feature values of the items
+        """
+        self.fields = list(fields)
+        with numpy.errstate(invalid="ignore"):
+            self.mean = numpy.nan_to_num(numpy.nanmean(values, axis=0)) if len(values) else numpy.zeros(len(fields))
+            self.std = numpy.nan_to_num(numpy.nanstd(values, axis=0)) if len(values) else numpy.ones(len(fields))
+        self.std[self.std == 0] = 1.0
+        self._save(ids, self.normalize(values))
+
+    def update(self, ids, values):
+        """adds (or replaces) the vectors of the items - normalized with the statistics of the last build
+        """
+        ids = numpy.asarray(ids, dtype=numpy.int64)
+        vectors = self.normalize(values)
+        positions = numpy.minimum(numpy.searchsorted(self.ids, ids), max(0, len(self.ids) - 1))
+        found = self.ids[positions] == ids if len(self.ids) else numpy.zeros(len(ids), dtype=bool)
+
+        if found.all():
+            # In place
+            matrix = numpy.load(self.matrix_path, mmap_mode="r+")
+            matrix[positions] = vectors
+            matrix.flush()
+            del matrix
+            self.load()
+            return
+
+        all_ids = numpy.concatenate([numpy.asarray(self.ids), ids[~found]])
+        matrix = numpy.concatenate([numpy.asarray(self.matrix), vectors[~found]])
+        matrix[positions[found]] = vectors[found]
+        self._save(all_ids, matrix)
+
+    def remove(self, ids):
+        keep = ~numpy.isin(self.ids, numpy.asarray(list(ids), dtype=numpy.int64))
+        self._save(numpy.asarray(self.ids)[keep], numpy.asarray(self.matrix)[keep])
+
+    def normalize(self, values):
+        """z-scores of the values (missing values are set to the mean)
+        """
+        vectors = (numpy.asarray(values, dtype=float) - self.mean) / self.std
+        return numpy.nan_to_num(vectors).astype(numpy.float32)
+
+    def get_vectors(self, ids):
+        """returns the vectors of the given items which are in the index
+        """
+        ids = numpy.asarray(list(ids), dtype=numpy.int64)
+        if not len(self.ids) or not len(ids):
+            return numpy.zeros((0, len(self.fields)), dtype=numpy.float32)
+        positions = numpy.minimum(numpy.searchsorted(self.ids, ids), len(self.ids) - 1)
+        return numpy.asarray(self.matrix[positions[self.ids[positions] == ids]])
+
+    def search(self, vector, k=10, exclude=(), chunk_size=65536):
+        """returns the ids and the (euclidean) distances of the `k` nearest items
+        """
+        vector = numpy.asarray(vector, dtype=numpy.float32)
+        exclude = numpy.asarray(list(exclude), dtype=numpy.int64)
+        best_ids = numpy.zeros(0, dtype=numpy.int64)
+        best_distances = numpy.zeros(0, dtype=numpy.float32)
+
+        for start in range(0, len(self.ids), chunk_size):
+            rows = numpy.asarray(self.matrix[start:start + chunk_size])
+            ids = numpy.asarray(self.ids[start:start + chunk_size])
+            # |a - b|^2 = |a|^2 - 2 a.b + |b|^2
+            distances = numpy.einsum("ij,ij->i", rows, rows) - 2.0 * rows.dot(vector) + vector.dot(vector)
+            if len(exclude):
+                distances[numpy.isin(ids, exclude)] = numpy.inf
+
+            count = min(k, len(distances))
+            nearest = numpy.argpartition(distances, count - 1)[:count]
+            best_ids = numpy.concatenate([best_ids, ids[nearest]])
+            best_distances = numpy.concatenate([best_distances, distances[nearest]])
+
+        order = numpy.argsort(best_distances, kind="stable")[:k]
+        order = order[numpy.isfinite(best_distances[order])]
+
+        return best_ids[order], numpy.sqrt(numpy.maximum(best_distances[order], 0.0))
+
+    def _save(self, ids, matrix):
+        order = numpy.argsort(ids, kind="stable")
+        _save_npy_atomic(self.matrix_path, numpy.asarray(matrix, dtype=numpy.float32)[order])
+        _save_npy_atomic(self.ids_path, numpy.asarray(ids, dtype=numpy.int64)[order])
+        with open(self.meta_path + ".tmp", "w") as f:
+            json.dump({"fields": self.fields, "mean": self.mean.tolist(), "std": self.std.tolist()}, f)
+        os.replace(self.meta_path + ".tmp", self.meta_path)
+        self.load()
+
+
+def _save_npy_atomic(path, array):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        numpy.save(f, array)
+    os.replace(tmp_path, path)
+
+
+def load_features(lib: Library, fields, item_ids=None):
+    """returns the ids and the feature values of the (given) items which have been analysed
+    """
+    arrays = load_arrays(lib, fields, [], albums_only=False, item_ids=item_ids)
+    values = numpy.column_stack([arrays.numeric[field] for field in fields]) if len(fields) \
+        else numpy.zeros((len(arrays.item_ids), 0))
+    analysed = ~numpy.isnan(values).all(axis=1) if len(values) else numpy.zeros(0, dtype=bool)
+
+    return arrays.item_ids[analysed], values[analysed]
+
+
+def get_similarity_index(config):
+    """returns the index (loaded) - None if it was not built or it was built on other fields
+    """
+    index = SimilarityIndex(helper.get_data_path("similarity"))
+    if not index.exists():
+        return None
+
+    index.load()
+    if index.fields != config["similarity_fields"].as_str_seq():
+        return None
+
+    return index
+
+
+def build_similarity_index(lib: Library, config):
+    fields = config["similarity_fields"].as_str_seq()
+    index = SimilarityIndex(helper.get_data_path("similarity"))
+    ids, values = load_features(lib, fields)
+    index.build(fields, ids, values)
+
+    return index
+
+
+def update_similarity_index(lib: Library, config, item_ids):
+    """updates the vectors of the items in the index (if there is one)
+    """
+    if numpy is None:
+        return
+    index = get_similarity_index(config)
+    if index is None:
+        return
+
+    ids, values = load_features(lib, index.fields, item_ids)
+    if len(ids):
+        index.update(ids, values)
+        helper.say("Similarity index updated with {} items".format(len(ids)))
+
+
+class SimilarCommand(object):
+    """`beet xtractor similar [options] QUERY...`: lists the items sounding
+    most like the items matching the query (like their average if there are
+    more of them).
+    """
+    config = None
+    parser = None
+
+    def __init__(self, config):
+        self.config = config
+        self.parser = OptionParser(usage='beet {plg} similar [options] QUERY...'.format(
+            plg=helper.plg_ns['__PLUGIN_NAME__']))
+        self.parser.add_option('-k', '--count', action='store', dest='count', type='int', default=10,
+                               help=u'[default: 10] the number of similar items to list')
+        self.parser.add_option('-f', '--format', action='store', dest='format', default=None,
+                               help=u'print the items with this format')
+        self.parser.add_option('-u', '--update', action='store_true', dest='update', default=False,
+                               help=u'add the analysed items missing from the index (and drop the removed ones)')
+        self.parser.add_option('--rebuild', action='store_true', dest='rebuild', default=False,
+                               help=u'build the index again (the normalization follows the current library)')
+
+    def func(self, lib: Library, options, arguments):
+        if numpy is None:
+            helper.say("The similarity search requires NumPy: pip install beets-xtractor[numpy]", log_only=False,
+                       is_error=True)
+            return
+
+        index = None if options.rebuild else get_similarity_index(self.config)
+        if index is None:
+            helper.say("Building the similarity index...", log_only=False)
+            index = build_similarity_index(lib, self.config)
+        elif options.update:
+            self.sync_index(lib, index)
+
+        query, _ = parse_query_string(" ".join(arguments), Item)
+        seed_ids = [item.id for item in lib.items(query)]
+        if not seed_ids:
+            helper.say("No items matching the query", log_only=False)
+            return
+
+        vectors = index.get_vectors(seed_ids)
+        if not len(vectors):
+            _, values = load_features(lib, index.fields, seed_ids)
+            vectors = index.normalize(values)
+        if not len(vectors):
+            helper.say("The items matching the query have not been analysed yet", log_only=False)
+            return
+
+        started = time.perf_counter()
+        ids, distances = index.search(vectors.mean(axis=0), k=options.count, exclude=seed_ids)
+        helper.say("Searched {0} items in {1:.1f}ms".format(len(index.ids), (time.perf_counter() - started) * 1000))
+
+        fmt = options.format or beets_config["format_item"].as_str()
+        for item_id, distance in zip(ids.tolist(), distances.tolist()):
+            item = lib.get_item(item_id)
+            if item:
+                helper.say("{0:.3f} {1}".format(distance, item.evaluate_template(fmt)), log_only=False)
+
+    @staticmethod
+    def sync_index(lib: Library, index: SimilarityIndex):
+        ids, values = load_features(lib, index.fields)
+        removed = numpy.setdiff1d(numpy.asarray(index.ids), ids)
+        if len(removed):
+            index.remove(removed)
+        added = ~numpy.isin(ids, numpy.asarray(index.ids))
+        if added.any():
+            index.update(ids[added], values[added])
+        helper.say("Similarity index: {} added, {} removed".format(int(added.sum()), len(removed)), log_only=False)
@@ -0,0 +1,151 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import json
+import os
+import socket
+import time
+import uuid
+
+JOBS_DIR = "jobs"
+LEASES_DIR = "leases"
+RESULTS_DIR = "results"
+
+STATUS_DONE = "done"
+STATUS_FAILED = "failed"
+
+
+class Spool(object):
+    """A job queue living on a (shared) filesystem. The coordinator drops job
+    descriptors in `jobs/`, a worker claims a job by renaming it into `leases/`
+    (atomic on the same filesystem) and keeps the lease alive by touching it.
+    The results are written to `results/`: first the extractor output, then
+    the status file which marks the result as complete. Leases which have not
+    been renewed for `lease_timeout` seconds are put back in `jobs/`.
+    """
+    path = None
+    lease_timeout = 300
+
+    def __init__(self, path, lease_timeout=300):
+        self.path = path
+        self.lease_timeout = lease_timeout
+        for name in (JOBS_DIR, LEASES_DIR, RESULTS_DIR):
+            os.makedirs(os.path.join(path, name), exist_ok=True)
+
+    # Coordinator side
+
+    def submit(self, job_id, descriptor):
+        """adds a job unless it is already queued, running or done
+        """
+        if self.get_status(job_id) or os.path.isfile(self._lease_path(job_id)):
+            return
+        _write_json_atomic(self._job_path(job_id), dict(descriptor, job_id=job_id))
+
+    def get_status(self, job_id):
+        """returns the status (dict) of a finished job or None
+        """
+        status_path = self._status_path(job_id)
+        if not os.path.isfile(status_path):
+            return None
+
+        with open(status_path, "r") as f:
+            return json.load(f)
+
+    def get_output_path(self, job_id):
+        return os.path.join(self.path, RESULTS_DIR, "{}.output.json".format(job_id))
+
+    def wait(self, job_id, poll_interval=1.0, timeout=None):
+        """waits for the job to finish while putting back its lease if it expires
+        """
+        started = time.monotonic()
+        while True:
+            status = self.get_status(job_id)
+            if status:
+                return status
+
+            self.requeue_expired(job_id)
+            if timeout and time.monotonic() - started > timeout:
+                return None
+            time.sleep(poll_interval)
+
+    def requeue_expired(self, job_id):
+        lease_path = self._lease_path(job_id)
+        try:
+            expired = time.time() - os.path.getmtime(lease_path) > self.lease_timeout
+        except OSError:
+            return False
+
+        if expired:
+            try:
+                os.rename(lease_path, self._job_path(job_id))
+            except OSError:
+                return False
+
+        return expired
+
+    def remove(self, job_id):
+        for path in (self._status_path(job_id), self.get_output_path(job_id), self._job_path(job_id)):
+            if os.path.isfile(path):
+                os.unlink(path)
+
+    # Worker side
+
+    def claim(self):
+        """claims the next available job and returns its descriptor (or None)
+        """
+        jobs_path = os.path.join(self.path, JOBS_DIR)
+        for name in sorted(os.listdir(jobs_path)):
+            if not name.endswith(".json"):
+                continue
+            job_id = name[:-len(".json")]
+            try:
+                os.rename(os.path.join(jobs_path, name), self._lease_path(job_id))
+            except OSError:
+                # Claimed by someone else
+                continue
+
+            os.utime(self._lease_path(job_id))
+            with open(self._lease_path(job_id), "r") as f:
+                return json.load(f)
+
+        return None
+
+    def renew(self, job_id):
+        try:
+            os.utime(self._lease_path(job_id))
+        except OSError:
+            pass
+
+    def complete(self, job_id, status, reason=None, worker=None):
+        """records the result of the job (its output must already be in place)
+        """
+        _write_json_atomic(self._status_path(job_id), {
+            "job_id": job_id,
+            "status": status,
+            "reason": reason,
+            "worker": worker or get_worker_name(),
+            "finished": time.time(),
+        })
+        if os.path.isfile(self._lease_path(job_id)):
+            os.unlink(self._lease_path(job_id))
+
+    def _job_path(self, job_id):
+        return os.path.join(self.path, JOBS_DIR, "{}.json".format(job_id))
+
+    def _lease_path(self, job_id):
+        return os.path.join(self.path, LEASES_DIR, "{}.json".format(job_id))
+
+    def _status_path(self, job_id):
+        return os.path.join(self.path, RESULTS_DIR, "{}.json".format(job_id))
+
+
+def get_worker_name():
+    return "{}:{}".format(socket.gethostname(), os.getpid())
+
+
+def _write_json_atomic(path, content):
+    tmp_path = "{}.{}.tmp".format(path, uuid.uuid4().hex)
+    with open(tmp_path, "w") as f:
+        json.dump(content, f)
+    os.replace(tmp_path, path)
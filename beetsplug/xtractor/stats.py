@@ -0,0 +1,158 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import json
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+PERCENTILES = (50, 90, 95, 99)
+
+
+class Timer(object):
+    """Durations of one kind of operation: the count, total and maximum are
+    exact, the percentiles are computed on a bounded random sample.
+    """
+    count = 0
+    total = 0.0
+    max = 0.0
+    samples = None
+    sample_size = 10000
+
+    def __init__(self, sample_size=10000):
+        self.samples = []
+        self.sample_size = sample_size
+        self._random = random.Random(0)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        if len(self.samples) < self.sample_size:
+            self.samples.append(seconds)
+        else:
+            # Reservoir sampling
+            i = self._random.randrange(self.count)
+            if i < self.sample_size:
+                self.samples[i] = seconds
+
+    def percentile(self, percent):
+        if not self.samples:
+            return 0.0
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))]
+
+    def summary(self):
+        summary = {
+            "count": self.count,
+            "total": self.total,
+            "mean": self.total / self.count if self.count else 0.0,
+            "max": self.max,
+        }
+        for percent in PERCENTILES:
+            summary["p{}".format(percent)] = self.percentile(percent)
+
+        return summary
+
+
+class RunStats(object):
+    """Timers and counters of an extraction run, shared by the worker threads.
+    """
+    started = None
+    timers = None
+    counters = None
+
+    _lock = None
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.timers = {}
+        self.counters = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def timer(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(name, time.perf_counter() - started)
+
+    def add_time(self, name, seconds):
+        with self._lock:
+            if name not in self.timers:
+                self.timers[name] = Timer()
+            self.timers[name].add(seconds)
+
+    def incr(self, name, count=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + count
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        with self._lock:
+            items = self.counters.get("items", 0)
+            return {
+                "elapsed": elapsed,
+                "items": items,
+                "items_per_sec": items / elapsed if elapsed else 0.0,
+                "counters": dict(self.counters),
+                "timers": {name: timer.summary() for name, timer in sorted(self.timers.items())},
+            }
+
+    def format(self):
+        """returns the summary as human readable lines
+        """
+        summary = self.summary()
+        lines = ["Items: {items} in {elapsed:.1f}s ({items_per_sec:.2f} items/s)".format(**summary),
+                 "Counters: {}".format(", ".join("{}={}".format(k, v) for k, v in sorted(summary["counters"].items())))]
+        for name, timer in summary["timers"].items():
+            lines.append("{:<16} count={:<8} total={:.2f}s mean={:.1f}ms p50={:.1f}ms p95={:.1f}ms "
+                         "p99={:.1f}ms max={:.1f}ms".format(name, timer["count"], timer["total"],
+                                                            timer["mean"] * 1000, timer["p50"] * 1000,
+                                                            timer["p95"] * 1000, timer["p99"] * 1000,
+                                                            timer["max"] * 1000))
+
+        return lines
+
+    def to_prometheus(self, prefix="xtractor"):
+        """returns the summary in the Prometheus text exposition format (for the
+        textfile collector of the node exporter)
+        """
+        summary = self.summary()
+        lines = [
+            "# TYPE {}_run_seconds gauge".format(prefix),
+            "{}_run_seconds {}".format(prefix, summary["elapsed"]),
+            "# TYPE {}_items_per_second gauge".format(prefix),
+            "{}_items_per_second {}".format(prefix, summary["items_per_sec"]),
+            "# TYPE {}_events_total counter".format(prefix),
+        ]
+        for name, value in sorted(summary["counters"].items()):
+            lines.append('{}_events_total{{event="{}"}} {}'.format(prefix, name, value))
+
+        lines.append("# TYPE {}_timer_seconds summary".format(prefix))
+        for name, timer in summary["timers"].items():
+            for percent in PERCENTILES:
+                lines.append('{}_timer_seconds{{timer="{}",quantile="{}"}} {}'.format(
+                    prefix, name, percent / 100.0, timer["p{}".format(percent)]))
+            lines.append('{}_timer_seconds_sum{{timer="{}"}} {}'.format(prefix, name, timer["total"]))
+            lines.append('{}_timer_seconds_count{{timer="{}"}} {}'.format(prefix, name, timer["count"]))
+
+        return "\n".join(lines) + "\n"
+
+    def write(self, path):
+        """writes the summary as json or, for a `.prom` file, in the Prometheus format
+        """
+        if path.endswith(".prom"):
+            content = self.to_prometheus()
+        else:
+            content = json.dumps(self.summary(), indent=2)
+
+        # Atomic: the textfile collector must never read a partial file
+        tmp_path = "{}.{}.tmp".format(path, os.getpid())
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, path)
@@ -0,0 +1,206 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+import os
+import shutil
+import sqlite3
+import threading
+import zlib
+
+from beetsplug.xtractor import helper
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+OUTPUT_EXT = ".json"
+
+
+class OutputStore(object):
+    """Keeps the outputs of the extractor by key. The extractor always writes
+    its output to a plain file which is then handed over with `put_file`.
+    """
+
+    def exists(self, key):
+        raise NotImplementedError()
+
+    def get_bytes(self, key):
+        """returns the raw (json) output or raises FileNotFoundError
+        """
+        raise NotImplementedError()
+
+    def get(self, key):
+        """returns the parsed output or raises FileNotFoundError
+        """
+        return helper.json_backend.loads(self.get_bytes(key))
+
+    def put_file(self, key, file_path):
+        """moves the output file into the store
+        """
+        raise NotImplementedError()
+
+    def delete(self, key):
+        raise NotImplementedError()
+
+    def keys(self):
+        raise NotImplementedError()
+
+    def close(self):
+        pass
+
+
+class FlatOutputStore(OutputStore):
+    """One json file per output in a single directory.
+    """
+    directory = None
+
+    def __init__(self, directory):
+        self.directory = directory
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key + OUTPUT_EXT)
+
+    def exists(self, key):
+        return os.path.isfile(self.get_path(key))
+
+    def get_bytes(self, key):
+        path = self.get_path(key)
+        if not os.path.isfile(path):
+            raise FileNotFoundError("Output file({}) not found!".format(path))
+
+        with open(path, "rb") as f:
+            return f.read()
+
+    def put_file(self, key, file_path):
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        try:
+            os.replace(file_path, path)
+        except OSError:
+            # Different filesystem
+            shutil.move(file_path, path)
+
+    def delete(self, key):
+        path = self.get_path(key)
+        if os.path.isfile(path):
+            os.unlink(path)
+
+    def keys(self):
+        for name in os.listdir(self.directory):
+            if name.endswith(OUTPUT_EXT) and ".part-" not in name:
+                yield name[:-len(OUTPUT_EXT)]
+
+
+class ShardedOutputStore(FlatOutputStore):
+    """One json file per output in a two level directory tree named after the
+    first characters of the key (ab/cd/abcd...json) so that no directory grows
+    beyond a few thousand entries.
+    """
+
+    def get_path(self, key):
+        return os.path.join(self.directory, key[0:2], key[2:4], key + OUTPUT_EXT)
+
+    def keys(self):
+        for root, dirs, files in os.walk(self.directory):
+            # Only the leaves of the tree hold outputs
+            if os.path.relpath(root, self.directory).count(os.sep) != 1:
+                continue
+            for name in files:
+                if name.endswith(OUTPUT_EXT) and ".part-" not in name:
+                    yield name[:-len(OUTPUT_EXT)]
+
+
+class SqliteOutputStore(OutputStore):
+    """All outputs compressed (zlib or zstd) in a single SQLite database.
+    """
+    path = None
+    compression = "zlib"
+
+    _connection = None
+    _lock = None
+    _compressor = None
+    _decompressors = None
+
+    def __init__(self, path, compression="zlib"):
+        if compression == "zstd" and not zstandard:
+            raise ValueError("The 'zstandard' package is required for zstd compression")
+        if compression not in ("zlib", "zstd"):
+            raise ValueError("Invalid compression '{}' (valid: zlib, zstd)".format(compression))
+
+        self.path = path
+        self.compression = compression
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, timeout=30.0, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.execute("""
+                CREATE TABLE IF NOT EXISTS outputs (
+                    key TEXT PRIMARY KEY,
+                    codec TEXT,
+                    data BLOB);
+                """)
+
+    def _compress(self, data):
+        if self.compression == "zstd":
+            return zstandard.ZstdCompressor(level=10).compress(data)
+        return zlib.compress(data, 6)
+
+    @staticmethod
+    def _decompress(codec, blob):
+        if codec == "zstd":
+            if not zstandard:
+                raise ValueError("The 'zstandard' package is required for zstd compressed outputs")
+            return zstandard.ZstdDecompressor().decompress(blob)
+        return zlib.decompress(blob)
+
+    def exists(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT 1 FROM outputs WHERE key = ?", (key,)).fetchone()
+
+        return row is not None
+
+    def get_bytes(self, key):
+        with self._lock:
+            row = self._connection.execute("SELECT codec, data FROM outputs WHERE key = ?", (key,)).fetchone()
+
+        if row is None:
+            raise FileNotFoundError("Output({}) not found in {}!".format(key, self.path))
+
+        return self._decompress(row[0], row[1])
+
+    def put_file(self, key, file_path):
+        with open(file_path, "rb") as f:
+            blob = self._compress(f.read())
+
+        with self._lock, self._connection:
+            self._connection.execute("INSERT OR REPLACE INTO outputs (key, codec, data) VALUES (?, ?, ?)",
+                                     (key, self.compression, blob))
+        os.unlink(file_path)
+
+    def delete(self, key):
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM outputs WHERE key = ?", (key,))
+
+    def keys(self):
+        with self._lock:
+            rows = self._connection.execute("SELECT key FROM outputs").fetchall()
+
+        return (row[0] for row in rows)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+
+def open_output_store(backend, directory, compression="zlib"):
+    """returns the output store for the `output_store` configuration option
+    """
+    if backend == "flat":
+        return FlatOutputStore(directory)
+    if backend == "sharded":
+        return ShardedOutputStore(directory)
+    if backend == "sqlite":
+        return SqliteOutputStore(os.path.join(directory, "outputs.db"), compression=compression)
+
+    raise ValueError("Invalid output store '{}' (valid: flat, sharded, sqlite)".format(backend))
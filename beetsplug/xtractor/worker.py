@@ -0,0 +1,159 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+"""Standalone worker claiming extraction jobs from a spool directory written
+by `beet xtractor --spool DIR`. Usage:
+
+    xtractor-worker [options] SPOOL_DIR
+"""
+
+import logging
+import os
+import sys
+import threading
+from optparse import OptionParser
+
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.process import ProcessLimits
+from beetsplug.xtractor.spool import Spool, STATUS_DONE, STATUS_FAILED, get_worker_name
+
+
+class SpoolWorker(object):
+    """Runs the extractor on the jobs claimed from the spool.
+    """
+    spool: Spool = None
+    extractor_path = None
+    path_map = None
+    limits: ProcessLimits = None
+    name = None
+
+    def __init__(self, spool: Spool, extractor_path=None, path_map=None, limits=None):
+        self.spool = spool
+        self.extractor_path = extractor_path
+        self.path_map = path_map or []
+        self.limits = limits or ProcessLimits()
+        self.name = get_worker_name()
+
+    def run(self, once=False, poll_interval=5.0, stop: threading.Event = None):
+        """processes jobs until the spool is empty (with `once`), until `stop` is set or forever
+        """
+        stop = stop or threading.Event()
+        processed = 0
+        while not stop.is_set():
+            job = self.spool.claim()
+            if job is None:
+                if once:
+                    break
+                stop.wait(poll_interval)
+                continue
+
+            self.process(job)
+            processed += 1
+
+        return processed
+
+    def process(self, job):
+        job_id = job["job_id"]
+        stop = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job_id, stop), daemon=True)
+        heartbeat.start()
+        try:
+            reason = self._extract(job)
+        except Exception as e:
+            reason = str(e)
+        finally:
+            stop.set()
+            heartbeat.join()
+
+        status = STATUS_FAILED if reason else STATUS_DONE
+        self.spool.complete(job_id, status, reason=reason, worker=self.name)
+        helper.say("Job {0}: {1}{2}".format(job_id, status, " ({})".format(reason) if reason else ""), log_only=False)
+
+    def _extract(self, job):
+        """returns the reason of the failure (None on success)
+        """
+        job_id = job["job_id"]
+        input_path = self.map_path(job["input_path"])
+        if not os.path.isfile(input_path):
+            return "Input file({}) not found!".format(input_path)
+
+        profile_path = os.path.join(self.spool.path, job["profile"])
+        extractor_path = self.extractor_path or job["extractor"]
+        output_path = self.spool.get_output_path(job_id)
+        tmp_output_path = "{}.part-{}".format(output_path, os.getpid())
+
+        result = self.limits.run([extractor_path, input_path, tmp_output_path, profile_path])
+        if result.failed or not os.path.isfile(tmp_output_path):
+            if os.path.isfile(tmp_output_path):
+                os.unlink(tmp_output_path)
+            if result.timed_out:
+                return "killed after {0}s".format(self.limits.timeout)
+            return "exit code {0}: {1}".format(result.returncode, result.stderr.decode(errors="replace").strip())
+
+        helper.asciify_file_content(tmp_output_path)
+        os.replace(tmp_output_path, output_path)
+
+    def map_path(self, path):
+        for source, target in self.path_map:
+            if path.startswith(source):
+                return target + path[len(source):]
+        return path
+
+    def _heartbeat(self, job_id, stop: threading.Event):
+        interval = max(1.0, self.spool.lease_timeout / 3.0)
+        while not stop.wait(interval):
+            self.spool.renew(job_id)
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] SPOOL_DIR')
+    parser.add_option('-e', '--extractor', dest='extractor', default=None,
+                      help=u'path of the extractor on this host (default: the one in the job)')
+    parser.add_option('-m', '--path-map', dest='path_map', action='append', default=[],
+                      help=u'map a path prefix of the coordinator to the local one: FROM=TO (repeatable)')
+    parser.add_option('-t', '--threads', dest='threads', type='int', default=1,
+                      help=u'[default: 1] the number of jobs to run in parallel')
+    parser.add_option('-l', '--lease', dest='lease', type='float', default=300,
+                      help=u'[default: 300] seconds after which the lease of a silent worker expires')
+    parser.add_option('-p', '--poll', dest='poll', type='float', default=5,
+                      help=u'[default: 5] seconds to wait between polls of an empty spool')
+    parser.add_option('--timeout', dest='timeout', type='float', default=0,
+                      help=u'[default: 0] seconds after which an extraction is killed (0 = no limit)')
+    parser.add_option('--nice', dest='nice', type='int', default=0,
+                      help=u'[default: 0] the niceness added to the extractor processes')
+    parser.add_option('-1', '--once', dest='once', action='store_true', default=False,
+                      help=u'exit when the spool is empty')
+    options, arguments = parser.parse_args(argv)
+
+    if len(arguments) != 1:
+        parser.error("The spool directory is required")
+
+    path_map = []
+    for mapping in options.path_map:
+        if "=" not in mapping:
+            parser.error("Invalid path map: {}".format(mapping))
+        path_map.append(tuple(mapping.split("=", 1)))
+
+    logging.basicConfig(level=logging.INFO, format="%(message)s")
+
+    spool = Spool(arguments[0], lease_timeout=options.lease)
+    limits = ProcessLimits(nice=options.nice, timeout=options.timeout, slots=options.threads)
+
+    def run():
+        SpoolWorker(spool, options.extractor, path_map, limits).run(once=options.once, poll_interval=options.poll)
+
+    threads = [threading.Thread(target=run, daemon=True) for _ in range(max(1, options.threads))]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
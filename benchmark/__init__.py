@@ -0,0 +1,9 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+"""Offline benchmarks of the plugin running on synthetic libraries with the
+stub extractor of the tests. Usage:
+
+    python -m benchmark.run --help
+"""
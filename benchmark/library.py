@@ -0,0 +1,78 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+"""Generator of synthetic beets libraries. Usage:
+
+    python -m benchmark.library [options] LIBRARY_DB COUNT
+"""
+
+import os
+import random
+import sys
+from optparse import OptionParser
+
+from beets.library import Library, Item
+from beets.util import bytestring_path
+
+FORMATS = (("MP3", 320000), ("MP3", 192000), ("FLAC", 900000), ("AAC", 256000), ("OGG", 160000))
+
+
+def generate_library(lib_path, count, audio_dir=None, processed=0.0, fields=(), file_size=16 * 1024,
+                     chunk_size=10000, seed=0):
+    """creates a library of `count` synthetic items. With `audio_dir` a (unique)
+    dummy audio file is written for each item, otherwise the paths point to
+    nowhere. A `processed` share (0-1) of the items has the given `fields` set
+    as if they had been analysed already.
+    """
+    rnd = random.Random(seed)
+    directory = audio_dir or os.path.dirname(os.path.abspath(lib_path))
+    lib = Library(lib_path, directory)
+
+    for start in range(0, count, chunk_size):
+        with lib.transaction():
+            for i in range(start, min(start + chunk_size, count)):
+                lib.add(_make_item(i, rnd, directory, audio_dir, processed, fields, file_size))
+
+    return lib
+
+
+def _make_item(i, rnd: random.Random, directory, audio_dir, processed, fields, file_size):
+    fmt, bitrate = rnd.choice(FORMATS)
+    path = os.path.join(directory, "artist{:04d}".format(i // 100 % 10000), "album{:03d}".format(i // 10 % 1000),
+                        "track{:07d}.{}".format(i, fmt.lower()))
+    if audio_dir:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write("{:07d}".format(i).encode() * (file_size // 7))
+
+    item = Item(path=bytestring_path(path), title="Track {}".format(i), artist="Artist {}".format(i // 100),
+                album="Album {}".format(i // 10), track=i % 10 + 1, format=fmt, bitrate=bitrate,
+                length=rnd.uniform(60.0, 600.0) if rnd.random() > 0.01 else rnd.uniform(1800.0, 7200.0))
+    if rnd.random() < processed:
+        for field in fields:
+            item[field] = rnd.random()
+
+    return item
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options] LIBRARY_DB COUNT')
+    parser.add_option('-a', '--audio-dir', dest='audio_dir', default=None,
+                      help=u'write a dummy audio file for each item in this folder')
+    parser.add_option('-p', '--processed', dest='processed', type='float', default=0.0,
+                      help=u'[default: 0] the share (0-1) of the items already analysed')
+    options, arguments = parser.parse_args(argv)
+
+    if len(arguments) != 2:
+        parser.error("The library path and the number of items are required")
+
+    from benchmark.run import get_required_fields
+    generate_library(arguments[0], int(arguments[1]), audio_dir=options.audio_dir, processed=options.processed,
+                     fields=get_required_fields())
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
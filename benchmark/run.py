@@ -0,0 +1,347 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+"""Runs the benchmark scenarios and reports their figures. Usage:
+
+    python -m benchmark.run [options]
+
+Scenarios:
+    select:   selection of the unprocessed items (`find_items_to_analyse`) on
+              libraries of `--library-sizes` items, half of them processed
+    parse:    target extraction from an extractor output (`extract_from_output`)
+    pipeline: complete runs (`_execute_on_each_items`) on `--items` items with
+              the stub extractor for each of the `--threads` counts
+    startup:  loading of the plugin in a fresh interpreter, as beets does on
+              every invocation (`beet ls` included), with and without `auto`
+
+With `--save FILE` the results are written as json, with `--baseline FILE`
+they are compared to saved results: the exit code is 1 when the throughput
+of any scenario dropped by more than `--tolerance`.
+"""
+
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+from optparse import OptionParser
+
+import beets
+from beets.library import Library
+
+from benchmark.library import generate_library
+from beetsplug.xtractor import XtractorPlugin, helper
+
+ROOT_PATH = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STUB_PATH = os.path.join(ROOT_PATH, "test", "fixtures", "essentia_extractor_stub.py")
+
+# Seconds the plugin may take to load (beets is already imported)
+STARTUP_BUDGET = 0.05
+# Modules which are only needed when the xtractor command runs
+STARTUP_UNWANTED_MODULES = ("beetsplug.xtractor.command", "beetsplug.xtractor.pipeline", "concurrent.futures", "numpy")
+
+STARTUP_SCRIPT = """
+import json, sys, time
+import beets.ui, beets.library
+started = time.perf_counter()
+from beetsplug.xtractor import XtractorPlugin
+XtractorPlugin().commands()
+print(json.dumps({"load_time": time.perf_counter() - started, "modules": list(sys.modules)}))
+"""
+
+
+def get_required_fields():
+    return helper.get_required_fields(XtractorPlugin().config)
+
+
+def run_select_scenario(size, workdir):
+    run_dir = tempfile.mkdtemp(prefix="select-", dir=workdir)
+    lib = generate_library(os.path.join(run_dir, "library.db"), size, processed=0.5, fields=get_required_fields())
+    command = _get_command(run_dir)
+    command.lib = lib
+    command.query = []
+    command.open_run()
+    try:
+        command.cfg_count_only = True
+        started = time.perf_counter()
+        command.find_items_to_analyse()
+        count_time = time.perf_counter() - started
+
+        command.cfg_count_only = False
+        started = time.perf_counter()
+        command.find_items_to_analyse()
+        # The items are streamed: read all of them as the pipeline would
+        selected = sum(1 for _ in command.items_to_analyse)
+        select_time = time.perf_counter() - started
+    finally:
+        command.close_run()
+
+    return {
+        "scenario": "select",
+        "items": size,
+        "threads": 1,
+        "selected": selected,
+        "count_time": count_time,
+        "select_time": select_time,
+        "items_per_sec": size / select_time,
+        "peak_rss": _get_peak_rss(),
+    }
+
+
+def run_parse_scenario(frames, workdir, repeat=200):
+    output_path = os.path.join(workdir, "parse-{}.json".format(frames))
+    input_path = os.path.join(workdir, "parse.mp3")
+    with open(input_path, "wb") as f:
+        f.write(b"parse" * 4096)
+
+    profile_path = os.path.join(workdir, "profile.yml")
+    with open(profile_path, "w") as f:
+        f.write("highlevel:\n  compute: 1\n")
+    subprocess.run([sys.executable, STUB_PATH, input_path, output_path, profile_path], check=True,
+                   env=dict(os.environ, XTRACTOR_STUB_FRAMES=str(frames)))
+
+    targets = helper.compile_targets(XtractorPlugin().config)
+
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        helper.extract_from_output(output_path, targets)
+        samples.append(time.perf_counter() - started)
+
+    return {
+        "scenario": "parse",
+        "items": frames,
+        "threads": 1,
+        "output_size": os.path.getsize(output_path),
+        "parse_time": _mean(samples),
+        "parse_time_p95": _percentile(samples, 95),
+        "items_per_sec": len(samples) / sum(samples),
+        "peak_rss": _get_peak_rss(),
+    }
+
+
+def run_startup_scenario(workdir, repeat=5, auto=False):
+    """with `auto` the plugin is configured to extract the imported items
+    """
+    beets_dir = tempfile.mkdtemp(prefix="startup-", dir=workdir)
+    with open(os.path.join(beets_dir, "config.yaml"), "w") as f:
+        f.write("xtractor:\n  auto: {}\n".format("yes" if auto else "no"))
+
+    samples = []
+    modules = set()
+    for _ in range(repeat):
+        process = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT], check=True, stdout=subprocess.PIPE,
+                                 cwd=ROOT_PATH, env=dict(os.environ, BEETSDIR=beets_dir))
+        result = json.loads(process.stdout)
+        samples.append(result["load_time"])
+        modules.update(result["modules"])
+
+    load_time = _percentile(samples, 50)
+
+    return {
+        "scenario": "startup_auto" if auto else "startup",
+        "items": 1,
+        "threads": 1,
+        "load_time": load_time,
+        "load_time_p95": _percentile(samples, 95),
+        "items_per_sec": 1 / load_time,
+        "unwanted_modules": [module for module in STARTUP_UNWANTED_MODULES if module in modules],
+        "peak_rss": _get_peak_rss(),
+    }
+
+
+def run_pipeline_scenario(count, threads, workdir, latency=0.0, frames=0, fail_rate=0.0):
+    os.environ["XTRACTOR_STUB_LATENCY"] = str(latency)
+    os.environ["XTRACTOR_STUB_FRAMES"] = str(frames)
+    os.environ["XTRACTOR_STUB_FAIL_RATE"] = str(fail_rate)
+
+    run_dir = tempfile.mkdtemp(prefix="pipeline-", dir=workdir)
+    generate_library(os.path.join(run_dir, "library.db"), count, audio_dir=os.path.join(run_dir, "audio"))
+    # Worker threads need their own connections: reopen the library as the plugin would get it
+    lib = Library(os.path.join(run_dir, "library.db"), os.path.join(run_dir, "audio"))
+
+    command = _get_command(run_dir)
+    store_samples = []
+    parse_samples = []
+    command._stage_store = _timed(command._stage_store, store_samples)
+    command._stage_parse = _timed(command._stage_parse, parse_samples)
+
+    options, arguments = command.parse_args(["--threads", str(threads), "--quiet"])
+    started = time.perf_counter()
+    command.func(lib, options, arguments)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "scenario": "pipeline",
+        "items": count,
+        "threads": threads,
+        "elapsed": elapsed,
+        "items_per_sec": count / elapsed,
+        "store_batches": len(store_samples),
+        "store_time": _mean(store_samples),
+        "store_time_p95": _percentile(store_samples, 95),
+        "parse_time": _mean(parse_samples),
+        "parse_time_p95": _percentile(parse_samples, 95),
+        "peak_rss": _get_peak_rss(),
+    }
+
+
+def _get_command(run_dir):
+    """returns the command configured for the stub extractor and keeping its files in `run_dir`
+    """
+    os.environ["BEETSDIR"] = run_dir
+    beets.config.read(user=False, defaults=True)
+    plugin = XtractorPlugin()
+    plugin.config["essentia_extractor"] = STUB_PATH
+    plugin.config["output_path"] = os.path.join(run_dir, "output")
+    os.makedirs(os.path.join(run_dir, "output"), exist_ok=True)
+    plugin.config["write"] = False
+    plugin.config["quiet"] = True
+
+    return plugin.commands()[0].command
+
+
+def _timed(func, samples):
+    def wrapper(*args):
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            samples.append(time.perf_counter() - started)
+
+    return wrapper
+
+
+def _mean(samples):
+    return sum(samples) / len(samples) if samples else 0.0
+
+
+def _percentile(samples, percent):
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(round(percent / 100.0 * (len(ordered) - 1))))]
+
+
+def _get_peak_rss():
+    """peak resident set size (in bytes) of this process and of the largest extractor process
+    """
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            + resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+
+
+def run_isolated(func, *args, **kwargs):
+    """runs the scenario in a fresh process so that the peak RSS figures are its own
+    """
+    with ProcessPoolExecutor(max_workers=1, mp_context=get_context("fork")) as executor:
+        return executor.submit(func, *args, **kwargs).result()
+
+
+def format_result(result):
+    line = "{scenario:<9} items={items:<7} threads={threads:<3} {items_per_sec:>10.1f} items/s".format(**result)
+    for key in ("store_time", "parse_time", "count_time", "select_time", "load_time"):
+        if key in result:
+            line += "  {}={:.2f}ms".format(key, result[key] * 1000)
+            if key + "_p95" in result:
+                line += " (p95 {:.2f}ms)".format(result[key + "_p95"] * 1000)
+    return line + "  rss={:.1f}MB".format(result["peak_rss"] / 1024.0 / 1024.0)
+
+
+def compare_results(results, baseline, tolerance):
+    """returns the descriptions of the scenarios slower than the baseline
+    """
+    def key(result):
+        return result["scenario"], result["items"], result["threads"]
+
+    reference = {key(result): result for result in baseline}
+    regressions = []
+    for result in results:
+        base = reference.get(key(result))
+        if base and result["items_per_sec"] < base["items_per_sec"] * (1 - tolerance):
+            regressions.append("{}: {:.1f} items/s (baseline: {:.1f} items/s)".format(
+                " ".join(str(k) for k in key(result)), result["items_per_sec"], base["items_per_sec"]))
+
+    return regressions
+
+
+def _parse_list(value, cast=int):
+    return [cast(v) for v in value.split(",") if v]
+
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('-s', '--scenarios', dest='scenarios', default="select,parse,pipeline,startup",
+                      help=u'[default: select,parse,pipeline,startup] the scenarios to run')
+    parser.add_option('-n', '--items', dest='items', type='int', default=200,
+                      help=u'[default: 200] the number of items of the pipeline runs')
+    parser.add_option('-t', '--threads', dest='threads', default="1,2,4,8",
+                      help=u'[default: 1,2,4,8] the thread counts of the pipeline runs')
+    parser.add_option('-l', '--library-sizes', dest='library_sizes', default="10000,100000",
+                      help=u'[default: 10000,100000] the library sizes of the selection runs')
+    parser.add_option('--latency', dest='latency', type='float', default=0.05,
+                      help=u'[default: 0.05] seconds spent by the stub extractor on each item')
+    parser.add_option('--frames', dest='frames', type='int', default=20000,
+                      help=u'[default: 20000] frame values written by the stub extractor (output size)')
+    parser.add_option('--fail-rate', dest='fail_rate', type='float', default=0.01,
+                      help=u'[default: 0.01] share of the items failing in the stub extractor')
+    parser.add_option('--save', dest='save', default=None,
+                      help=u'write the results to this json file')
+    parser.add_option('--baseline', dest='baseline', default=None,
+                      help=u'compare the results to the ones saved in this json file')
+    parser.add_option('--tolerance', dest='tolerance', type='float', default=0.25,
+                      help=u'[default: 0.25] accepted throughput drop compared to the baseline')
+    options, arguments = parser.parse_args(argv)
+
+    scenarios = _parse_list(options.scenarios, str)
+    workdir = tempfile.mkdtemp(prefix="xtractor-benchmark-")
+    results = []
+    over_budget = False
+    try:
+        if "select" in scenarios:
+            for size in _parse_list(options.library_sizes):
+                results.append(run_isolated(run_select_scenario, size, workdir))
+                print(format_result(results[-1]))
+        if "parse" in scenarios:
+            results.append(run_isolated(run_parse_scenario, options.frames, workdir))
+            print(format_result(results[-1]))
+        if "pipeline" in scenarios:
+            for threads in _parse_list(options.threads):
+                results.append(run_isolated(run_pipeline_scenario, options.items, threads, workdir,
+                                            latency=options.latency, frames=options.frames,
+                                            fail_rate=options.fail_rate))
+                print(format_result(results[-1]))
+        if "startup" in scenarios:
+            for auto in (False, True):
+                results.append(run_startup_scenario(workdir, auto=auto))
+                print(format_result(results[-1]))
+                if results[-1]["load_time"] > STARTUP_BUDGET or results[-1]["unwanted_modules"]:
+                    over_budget = True
+                    print("Startup over budget ({:.1f}ms, {:.0f}ms allowed), loaded: {}".format(
+                        results[-1]["load_time"] * 1000, STARTUP_BUDGET * 1000,
+                        ", ".join(results[-1]["unwanted_modules"]) or "-"))
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if options.save:
+        with open(options.save, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            regressions = compare_results(results, json.load(f), options.tolerance)
+        for regression in regressions:
+            print("Regression: {}".format(regression))
+        if regressions:
+            return 1
+
+    return 1 if over_budget else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
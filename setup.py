@@ -39,6 +39,12 @@ setup(
 
     python_requires='>=3.8',
 
+    entry_points={
+        'console_scripts': [
+            'xtractor-worker=beetsplug.xtractor.worker:main',
+        ],
+    },
+
     install_requires=[
         'beets>=1.4.9',
         'pyyaml'
@@ -52,6 +58,10 @@ setup(
     # Extras needed during testing
     extras_require={
         'tests': [],
+        'fast-json': ['orjson'],
+        'zstd': ['zstandard'],
+        'numpy': ['numpy'],
+        'parquet': ['pyarrow'],
     },
 
     classifiers=[
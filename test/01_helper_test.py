@@ -0,0 +1,168 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+import json
+import os
+
+from beets.dbcore import types
+from beets.dbcore.query import TrueQuery
+from beets.library import Item
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.query import ItemStream
+from beetsplug.xtractor.scheduler import ExtractionRates
+from beetsplug.xtractor.stats import RunStats, Timer
+
+from test.helper import TestHelper, PLUGIN_NAME
+
+
+class HelperTest(TestHelper):
+    """Test the extraction helpers.
+    """
+
+    audiodata = {
+        "rhythm": {"bpm": 127.6, "danceability": 1.2, "beats_count": 512.0},
+        "lowlevel": {"average_loudness": 0.91},
+        "highlevel": {
+            "gender": {"value": "female", "all": {"male": 0.2, "female": 0.8}},
+        },
+    }
+
+    def test_compile_targets(self):
+        targets = helper.compile_targets(self.config[PLUGIN_NAME])
+        fields = [t[0] for t in targets]
+        self.assertIn("bpm", fields)
+        self.assertIn("mood_mirex_cluster_5", fields)
+
+        bpm = targets[fields.index("bpm")]
+        self.assertEqual(("rhythm", "bpm"), bpm[1])
+
+    def test_extract_from_audiodata(self):
+        targets = helper.compile_targets(self.config[PLUGIN_NAME])
+        data = helper.extract_from_audiodata(self.audiodata, targets)
+        self.assertEqual(128, data["bpm"])
+        self.assertEqual(512, data["beats_count"])
+        self.assertEqual(0.91, data["average_loudness"])
+        self.assertEqual("female", data["gender"])
+        self.assertEqual(0.8, data["is_female"])
+        self.assertIsNone(data["mood_happy"])
+
+    def test_extract_from_output(self):
+        targets = helper.compile_targets(self.config[PLUGIN_NAME])
+        output_path = os.path.join(self.mkdtemp(), "output.json")
+        with open(output_path, "w") as f:
+            json.dump(self.audiodata, f)
+
+        data = helper.extract_from_output(output_path, targets)
+        self.assertEqual("female", data["gender"])
+
+        with self.assertRaises(FileNotFoundError):
+            helper.extract_from_output(output_path + ".missing", targets)
+
+    def test_load_default_config(self):
+        config_file_path = os.path.join(self.mkdtemp(), "config_default.yml")
+        with open(config_file_path, "w") as f:
+            f.write("auto: no\nthreads: 2\n")
+
+        content = helper.load_default_config(config_file_path)
+        self.assertEqual({"auto": False, "threads": 2}, dict(content))
+        self.assertTrue(os.path.isfile(helper.get_data_path("config_default.pickle")))
+
+        # Read back from the cache in a new process, the copy can be changed
+        helper._default_configs.clear()
+        content = helper.load_default_config(config_file_path)
+        content["threads"] = 4
+        self.assertEqual(2, helper.load_default_config(config_file_path)["threads"])
+
+        # Parsed again when the file changes
+        with open(config_file_path, "w") as f:
+            f.write("auto: yes\nthreads: 8\n")
+        helper._default_configs.clear()
+        self.assertEqual({"auto": True, "threads": 8}, dict(helper.load_default_config(config_file_path)))
+
+    def test_value_changed(self):
+        self.assertFalse(helper.value_changed(types.Float(6), 0.1234564, 0.1234561))
+        self.assertTrue(helper.value_changed(types.Float(6), 0.123456, 0.123458))
+        self.assertFalse(helper.value_changed(types.Float(6), "0.5", 0.5))
+        self.assertTrue(helper.value_changed(types.Float(6), None, 0.5))
+        self.assertFalse(helper.value_changed(types.INTEGER, "120", 120))
+        self.assertTrue(helper.value_changed(types.STRING, "male", "female"))
+
+
+class SchedulerTest(TestHelper):
+    """Test the cost based scheduling.
+    """
+
+    def test_longest_first(self):
+        rates = ExtractionRates()
+        rates.record("FLAC", 100, 50)
+        rates.record("MP3", 100, 10)
+        for item in [
+            Item(title="short", length=60, format="MP3"),
+            Item(title="mix", length=7200, format="MP3"),
+            Item(title="flac", length=600, format="FLAC"),
+            Item(title="unknown", length=400, format="OGG"),
+            # 3MB at 128kbps: 187.5s
+            Item(title="no length", length=0, bitrate=128000, format="MP3",
+                 **{helper.FILE_FINGERPRINT_FIELD: "3000000:1600000000000000000"}),
+            # Never extracted: DEFAULT_AUDIO_SECONDS
+            Item(title="new", length=0, format="MP3"),
+        ]:
+            self.lib.add(item)
+
+        order_by, order_subvals = rates.get_cost_clause()
+        stream = ItemStream(self.lib, TrueQuery(), order_by=order_by, order_subvals=order_subvals, descending=True,
+                            page_size=2)
+        self.assertEqual(["mix", "flac", "unknown", "new", "no length", "short"], [i.title for i in stream])
+
+    def test_by_directory(self):
+        for title, path in [("b2", b"/music/b/2.mp3"), ("a1", b"/music/a/1.mp3"), ("b1", b"/music/b/1.mp3")]:
+            self.lib.add(Item(title=title, path=path))
+
+        stream = ItemStream(self.lib, TrueQuery(), order_by="path", page_size=1)
+        self.assertEqual(["a1", "b1", "b2"], [i.title for i in stream])
+
+    def test_rates_are_persisted(self):
+        path = os.path.join(self.mkdtemp(), "rates.json")
+        rates = ExtractionRates(path)
+        rates.record("MP3", 100, 20)
+        rates.save()
+
+        self.assertAlmostEqual(0.2, ExtractionRates(path).get("MP3"))
+
+
+class StatsTest(TestHelper):
+    """Test the run timers and counters.
+    """
+
+    def test_timer_percentiles(self):
+        timer = Timer(sample_size=50)
+        for i in range(1, 101):
+            timer.add(i / 100.0)
+
+        summary = timer.summary()
+        self.assertEqual(100, summary["count"])
+        self.assertAlmostEqual(50.5, summary["total"])
+        self.assertEqual(1.0, summary["max"])
+        self.assertEqual(50, len(timer.samples))
+        self.assertLess(summary["p50"], summary["p99"])
+
+    def test_write_json_and_prometheus(self):
+        stats = RunStats()
+        stats.incr("items", 3)
+        stats.incr("cache_hits")
+        stats.add_time("db_store", 0.25)
+
+        path = os.path.join(self.mkdtemp(), "stats.json")
+        stats.write(path)
+        with open(path) as f:
+            summary = json.load(f)
+        self.assertEqual(3, summary["items"])
+        self.assertEqual({"items": 3, "cache_hits": 1}, summary["counters"])
+        self.assertEqual(0.25, summary["timers"]["db_store"]["p95"])
+
+        prometheus = stats.to_prometheus()
+        self.assertIn('xtractor_events_total{event="cache_hits"} 1', prometheus)
+        self.assertIn('xtractor_timer_seconds_count{timer="db_store"} 1', prometheus)
@@ -0,0 +1,614 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+import time
+
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.auto import AutoExtractor
+from beetsplug.xtractor.backend import WorkerPoolBackend
+from beetsplug.xtractor.cache import ResultCache
+from beetsplug.xtractor.command import XtractorCommand
+from beetsplug.xtractor.governor import ConcurrencyGovernor
+from beetsplug.xtractor.journal import Journal
+from beetsplug.xtractor.pipeline import Pipeline, Stage, RateLimiter
+from beetsplug.xtractor.process import ProcessLimits, parse_cpu_set
+from beetsplug.xtractor.stats import RunStats
+from beetsplug.xtractor.store import FlatOutputStore
+
+from test.fixtures.essentia_extractor_stub import make_audiodata
+from test.helper import TestHelper, PLUGIN_NAME
+
+
+class ExtractionTest(TestHelper):
+    """Test the extraction run with the stub extractor.
+    """
+
+    def setUp(self):
+        super(ExtractionTest, self).setUp()
+        self.setup_stub_extractor()
+
+    def test_extraction_stores_values(self):
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME)
+
+        item.load()
+        self.assertIsNotNone(item.get("gender"))
+        self.assertIsNotNone(item.get("mood_happy"))
+        self.assertGreater(item.get("bpm"), 0)
+        self.assertEqual(1, len(self.stub_invocations()))
+
+    def test_cache_is_reused_for_moved_and_duplicate_files(self):
+        self.config[PLUGIN_NAME]["cache"] = True
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME)
+        item.load()
+        gender = item.get("gender")
+
+        # Move the file and add a duplicate of it
+        new_path = os.path.join(self.mkdtemp(), "moved.mp3")
+        shutil.move(item.path.decode(), new_path)
+        item.path = new_path.encode()
+        item.store()
+
+        duplicate = self.add_item_with_file("two", content=b"one" * 4096)
+        self.runcli(PLUGIN_NAME, "--force")
+
+        duplicate.load()
+        self.assertEqual(gender, duplicate.get("gender"))
+        self.assertEqual(1, len(self.stub_invocations()))
+
+    def test_failed_items_are_not_retried_before_their_delay(self):
+        os.environ["XTRACTOR_STUB_FAIL"] = "corrupt"
+        item = self.add_item_with_file("corrupt")
+        self.runcli(PLUGIN_NAME)
+        self.runcli(PLUGIN_NAME)
+        self.assertEqual(1, len(self.stub_invocations()))
+
+        journal = Journal(os.path.join(os.environ["BEETSDIR"], "xtractor_journal.db"))
+        state = journal.get(item.id)
+        journal.close()
+        self.assertEqual("failed", state["state"])
+        self.assertEqual(1, state["attempts"])
+        self.assertEqual([], [f for f in os.listdir(self.config[PLUGIN_NAME]["output_path"].get()) if ".part-" in f])
+
+        del os.environ["XTRACTOR_STUB_FAIL"]
+        self.runcli(PLUGIN_NAME, "--retry-failed")
+        self.assertEqual(2, len(self.stub_invocations()))
+        item.load()
+        self.assertIsNotNone(item.get("gender"))
+
+    def test_resume_pending_items(self):
+        items = [self.add_item_with_file("item{}".format(i)) for i in range(3)]
+        journal = Journal(os.path.join(os.environ["BEETSDIR"], "xtractor_journal.db"))
+        journal.mark_pending([items[1].id])
+        journal.close()
+
+        self.runcli(PLUGIN_NAME, "--resume")
+        self.assertEqual(1, len(self.stub_invocations()))
+        items[1].load()
+        self.assertIsNotNone(items[1].get("gender"))
+
+    def test_stats_file(self):
+        self.add_item_with_file("one")
+        self.add_item_with_file("two", content=b"one" * 4096)
+        stats_path = os.path.join(self.mkdtemp(), "stats.json")
+        self.runcli(PLUGIN_NAME, "--stats-file", stats_path)
+
+        with open(stats_path) as f:
+            summary = json.load(f)
+        self.assertEqual(2, summary["items"])
+        self.assertEqual(2, summary["counters"]["stored"])
+        self.assertEqual(1, summary["counters"]["extractions"])
+        for timer in ("query", "extractor_wall", "json_parse", "db_store", "stage_extract", "stage_store"):
+            self.assertIn(timer, summary["timers"])
+
+    def test_unchanged_items_are_not_stored_or_written(self):
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME, "--write")
+        item.load()
+        bpm = item.get("bpm")
+
+        stats_path = os.path.join(self.mkdtemp(), "stats.json")
+        self.runcli(PLUGIN_NAME, "--write", "--force", "--stats-file", stats_path)
+
+        with open(stats_path) as f:
+            counters = json.load(f)["counters"]
+        self.assertEqual(0, counters.get("stored", 0))
+        self.assertEqual(1, counters["unchanged"])
+        self.assertEqual(0, counters.get("written", 0))
+        item.load()
+        self.assertEqual(bpm, item.get("bpm"))
+
+    def test_remap_from_cached_output(self):
+        self.config[PLUGIN_NAME]["cache"] = True
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME)
+
+        self.config[PLUGIN_NAME]["low_level_targets"]["remapped_danceability"] = {
+            "path": "rhythm.danceability", "type": "float", "required": True}
+        self.runcli(PLUGIN_NAME, "--from-output")
+
+        item.load()
+        self.assertAlmostEqual(item.get("danceability"), float(item.get("remapped_danceability")))
+        self.assertEqual(1, len(self.stub_invocations()))
+
+    def test_remap_from_kept_output(self):
+        self.config[PLUGIN_NAME]["cache"] = False
+        self.config[PLUGIN_NAME]["keep_output"] = True
+        item = self.add_item_with_file("one")
+        missing = self.add_item_with_file("two")
+        self.runcli(PLUGIN_NAME, "one")
+        item.load()
+        self.assertIsNotNone(item.get(helper.OUTPUT_KEY_FIELD))
+
+        self.config[PLUGIN_NAME]["low_level_targets"]["remapped_danceability"] = {
+            "path": "rhythm.danceability", "type": "float", "required": True}
+        self.runcli(PLUGIN_NAME, "--from-output")
+
+        item.load()
+        missing.load()
+        self.assertAlmostEqual(item.get("danceability"), float(item.get("remapped_danceability")))
+        self.assertIsNone(missing.get("remapped_danceability"))
+        self.assertEqual(1, len(self.stub_invocations()))
+
+    def _write_legacy_output(self, name, bpm, danceability=None):
+        # A fixed seed: no descriptor is 0
+        audiodata = make_audiodata("8" * 80)
+        audiodata["rhythm"]["bpm"] = bpm
+        if danceability is not None:
+            audiodata["rhythm"]["danceability"] = danceability
+        with open(os.path.join(self.config[PLUGIN_NAME]["output_path"].get(), name + ".json"), "w") as f:
+            json.dump(audiodata, f)
+
+    def test_legacy_outputs_are_reused(self):
+        self.config[PLUGIN_NAME]["cache"] = False
+        tagged = self.add_item_with_file("one")
+        tagged["mb_trackid"] = "d7d4e8f9-ffb0-4d6f-a9c6-5e9e1b4e1f00"
+        tagged.store()
+        untagged = self.add_item_with_file("two")
+        self._write_legacy_output(tagged.mb_trackid, 99)
+        self._write_legacy_output(hashlib.md5(untagged.path).hexdigest(), 101)
+        self.runcli(PLUGIN_NAME)
+
+        tagged.load()
+        untagged.load()
+        self.assertEqual(99, tagged.bpm)
+        self.assertEqual(101, untagged.bpm)
+        self.assertEqual([], self.stub_invocations())
+
+    def test_remap_from_legacy_output(self):
+        item = self.add_item_with_file("one")
+        item["bpm"] = 80
+        item.store()
+        self._write_legacy_output(hashlib.md5(item.path).hexdigest(), 99)
+        self.config[PLUGIN_NAME]["low_level_targets"]["remapped_danceability"] = {
+            "path": "rhythm.danceability", "type": "float", "required": True}
+        self.runcli(PLUGIN_NAME, "--from-output")
+
+        item.load()
+        self.assertEqual(99, item.bpm)
+        self.assertAlmostEqual(0x88 / 255.0 * 3, float(item.get("remapped_danceability")), places=5)
+        # The profile of the output is unknown: the item is analysed again by an incremental run
+        self.assertEqual(helper.LEGACY_PROFILE, item.get(helper.PROFILE_FIELD))
+
+    def test_zero_values_are_stored(self):
+        self.config[PLUGIN_NAME]["cache"] = False
+        item = self.add_item_with_file("one")
+        self._write_legacy_output(hashlib.md5(item.path).hexdigest(), 99, danceability=0.0)
+        self.runcli(PLUGIN_NAME)
+
+        item.load()
+        self.assertEqual(0.0, item.get("danceability"))
+        self.assertEqual([], self.stub_invocations())
+
+    def test_two_phase_extraction(self):
+        self.config[PLUGIN_NAME]["cache"] = True
+        self.config[PLUGIN_NAME]["essentia_svm_extractor"] = self.config[PLUGIN_NAME]["essentia_extractor"].get()
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME)
+
+        item.load()
+        self.assertIsNotNone(item.get("gender"))
+        self.assertGreater(item.get("bpm"), 0)
+        self.assertEqual([False, True], [path.endswith(".json") for path in self.stub_invocations()])
+
+        # A new model only runs the high-level phase again
+        self.config[PLUGIN_NAME]["extractor_profile"]["highlevel"]["svm_models"] = ["/path/to/new_model.history"]
+        self.runcli(PLUGIN_NAME, "--force")
+        self.assertEqual([False, True, True], [path.endswith(".json") for path in self.stub_invocations()])
+        self.assertEqual([], os.listdir(self.config[PLUGIN_NAME]["output_path"].get()))
+
+    def test_incremental_run(self):
+        self.config[PLUGIN_NAME]["fingerprint_hash"] = True
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME)
+        item.load()
+        self.assertIsNotNone(item.get(helper.FILE_FINGERPRINT_FIELD))
+        self.assertIsNotNone(item.get(helper.PROFILE_FIELD))
+
+        # Nothing changed
+        self.runcli(PLUGIN_NAME, "--incremental")
+        self.assertEqual(1, len(self.stub_invocations()))
+
+        # Touched, same content
+        path = item.path.decode()
+        os.utime(path, (1000000, 1000000))
+        self.runcli(PLUGIN_NAME, "--incremental")
+        self.assertEqual(1, len(self.stub_invocations()))
+        item.load()
+        self.assertIn(":1000000000000000:", item.get(helper.FILE_FINGERPRINT_FIELD))
+
+        # Analysed before the fingerprints were recorded
+        del item[helper.FILE_FINGERPRINT_FIELD]
+        item.store()
+        self.runcli(PLUGIN_NAME, "--incremental")
+        self.assertEqual(1, len(self.stub_invocations()))
+        item.load()
+        self.assertIsNotNone(item.get(helper.FILE_FINGERPRINT_FIELD))
+
+        # Replaced file
+        with open(path, "wb") as f:
+            f.write(b"new" * 5000)
+        self.runcli(PLUGIN_NAME, "--incremental")
+        self.assertEqual(2, len(self.stub_invocations()))
+
+        # Changed profile
+        self.config[PLUGIN_NAME]["extractor_profile"]["lowlevel"] = {"frameSize": 4096}
+        self.runcli(PLUGIN_NAME)
+        self.assertEqual(2, len(self.stub_invocations()))
+        self.runcli(PLUGIN_NAME, "--incremental")
+        self.assertEqual(3, len(self.stub_invocations()))
+
+    def test_remap_keeps_the_profile_of_the_output(self):
+        self.config[PLUGIN_NAME]["keep_output"] = True
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME)
+        item.load()
+        profile = item.get(helper.PROFILE_FIELD)
+
+        self.config[PLUGIN_NAME]["extractor_profile"]["lowlevel"] = {"frameSize": 4096}
+        self.runcli(PLUGIN_NAME, "--from-output", "--force")
+        item.load()
+        self.assertEqual(profile, item.get(helper.PROFILE_FIELD))
+        self.assertTrue(item.get(helper.OUTPUT_KEY_FIELD).endswith("-" + profile))
+
+        # The remapped descriptors are not current: the item is analysed again
+        self.runcli(PLUGIN_NAME, "--incremental")
+        self.assertEqual(2, len(self.stub_invocations()))
+
+    def test_stub_backend(self):
+        self.config[PLUGIN_NAME]["extractor_backend"] = "test.fixtures.stub_backend:StubBackend"
+        os.environ["XTRACTOR_STUB_FAIL"] = "corrupt"
+        item = self.add_item_with_file("one")
+        corrupt = self.add_item_with_file("corrupt")
+        stats_path = os.path.join(self.mkdtemp(), "stats.json")
+        self.runcli(PLUGIN_NAME, "--stats-file", stats_path)
+
+        item.load()
+        self.assertIsNotNone(item.get("gender"))
+        self.assertGreater(item.get("bpm"), 0)
+        with open(stats_path) as f:
+            summary = json.load(f)
+        self.assertEqual(1, summary["counters"]["extractions"])
+        self.assertEqual(1, summary["counters"]["failures"])
+        journal = Journal(os.path.join(os.environ["BEETSDIR"], "xtractor_journal.db"))
+        self.assertEqual("failed", journal.get(corrupt.id)["state"])
+        journal.close()
+
+    def test_direct_results_are_not_written_to_the_store(self):
+        self.config[PLUGIN_NAME]["extractor_backend"] = "test.fixtures.stub_backend:StubBackend"
+        self.config[PLUGIN_NAME]["cache"] = False
+        self.config[PLUGIN_NAME]["keep_output"] = False
+        item = self.add_item_with_file("one")
+        written = []
+        put_file = FlatOutputStore.put_file
+        FlatOutputStore.put_file = lambda store, key, path: written.append(key) or put_file(store, key, path)
+        try:
+            self.runcli(PLUGIN_NAME)
+        finally:
+            FlatOutputStore.put_file = put_file
+
+        item.load()
+        self.assertIsNotNone(item.get("gender"))
+        self.assertEqual([], written)
+
+    def test_worker_pool_backend_loads_the_profile_once(self):
+        self.config[PLUGIN_NAME]["extractor_backend"] = "test.fixtures.stub_backend:StubWorkerPoolBackend"
+        self.config[PLUGIN_NAME]["extractor_workers"] = 1
+        load_log = os.path.join(self.mkdtemp(), "load.log")
+        os.environ["XTRACTOR_STUB_LOAD_LOG"] = load_log
+        items = [self.add_item_with_file(title) for title in ("one", "two", "three")]
+        self.runcli(PLUGIN_NAME, "--threads", "2")
+
+        for item in items:
+            item.load()
+            self.assertIsNotNone(item.get("gender"))
+        self.assertEqual(3, len(self.stub_invocations()))
+        with open(load_log) as f:
+            self.assertEqual(1, len(f.read().splitlines()))
+
+    def test_worker_pool_timeout_kills_only_its_worker(self):
+        backend = WorkerPoolBackend(workers=2, timeout=5, loader="test.fixtures.stub_backend:load_sleeping_extractor")
+        backend.start()
+        results = {}
+
+        def extract(name):
+            results[name] = backend.extract(name, None, "profile.yml")
+
+        try:
+            threads = [threading.Thread(target=extract, args=(name,)) for name in ("hang.mp3", "fast.mp3")]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.assertEqual("killed after 5s", results["hang.mp3"].error)
+            self.assertIsNone(results["fast.mp3"].error)
+
+            # The killed worker is started again
+            for name in ("one.mp3", "two.mp3"):
+                extract(name)
+                self.assertEqual({"input": name}, results[name].audiodata)
+        finally:
+            backend.stop()
+
+    def test_prefetched_inputs(self):
+        scratch_path = self.mkdtemp()
+        self.config[PLUGIN_NAME]["prefetch_path"] = scratch_path
+        self.config[PLUGIN_NAME]["prefetch_size"] = 1
+        self.config[PLUGIN_NAME]["schedule"] = "directory"
+        items = [self.add_item_with_file("one"), self.add_item_with_file("two")]
+        self.add_item_with_file("three", content=b"one" * 4096)
+        self.runcli(PLUGIN_NAME)
+
+        for item in items:
+            item.load()
+            self.assertIsNotNone(item.get("gender"))
+        self.assertEqual(2, len(self.stub_invocations()))
+        self.assertTrue(all(path.startswith(scratch_path) for path in self.stub_invocations()))
+        self.assertEqual([], os.listdir(scratch_path))
+
+
+class CacheTest(TestHelper):
+    """Test the content addressed result cache.
+    """
+
+    def test_put_get_alias(self):
+        cache = ResultCache(os.path.join(self.mkdtemp(), "cache.db"))
+        self.assertIsNone(cache.get("key", "profile"))
+
+        cache.put("key", "profile", b'{"rhythm": {"bpm": 120}}')
+        self.assertEqual({"rhythm": {"bpm": 120}}, cache.get("key", "profile"))
+        self.assertIsNone(cache.get("key", "other-profile"))
+
+        cache.alias("key", "new-key", "profile")
+        self.assertTrue(cache.has("new-key", "profile"))
+        cache.close()
+
+    def test_content_key_ignores_location(self):
+        tmp = self.mkdtemp()
+        path_a = os.path.join(tmp, "a.mp3")
+        path_b = os.path.join(tmp, "b.mp3")
+        for path in (path_a, path_b):
+            with open(path, "wb") as f:
+                f.write(b"x" * 500000)
+
+        self.assertEqual(helper.get_content_key(path_a), helper.get_content_key(path_b))
+        self.assertNotEqual(helper.get_content_key(path_a), helper.get_content_key(path_a, full=True))
+
+
+class PipelineTest(TestHelper):
+    """Test the staged pipeline.
+    """
+
+    def test_jobs_pass_all_stages(self):
+        batches = []
+        done = []
+
+        def double(job):
+            return job * 2
+
+        def drop_odd(job):
+            return job if job % 4 == 0 else None
+
+        def collect(jobs):
+            batches.append(list(jobs))
+            return jobs
+
+        pipeline = Pipeline([
+            Stage("double", double, workers=3),
+            Stage("drop", drop_odd, workers=2),
+            Stage("collect", collect, batch_size=2, batch_interval=60),
+        ], on_done=done.append)
+        pipeline.run(range(10))
+
+        self.assertEqual(10, len(done))
+        self.assertEqual([0, 4, 8, 12, 16], sorted(sum(batches, [])))
+        self.assertEqual(3, len(batches))
+
+    def test_failing_stage_drops_job(self):
+        done = []
+
+        def fail(job):
+            raise ValueError("failed")
+
+        Pipeline([Stage("fail", fail)], on_done=done.append).run(range(3))
+        self.assertEqual([0, 1, 2], sorted(done))
+
+    def test_failing_callback_does_not_stop_the_pipeline(self):
+        done = []
+
+        def on_done(job):
+            if job == 1:
+                raise ValueError("failed")
+            done.append(job)
+
+        stats = RunStats()
+        stages = [Stage("one", lambda job: job, queue_size=1), Stage("two", lambda job: job, queue_size=1)]
+        Pipeline(stages, on_done=on_done, stats=stats).run(range(5))
+        self.assertEqual([0, 2, 3, 4], sorted(done))
+        self.assertEqual(1, stats.counters["callback_errors"])
+
+    def test_rate_limiter(self):
+        self.assertEqual(0.0, RateLimiter(0).wait())
+
+        limiter = RateLimiter(20)
+        started = time.monotonic()
+        waited = [limiter.wait() for _ in range(3)]
+        self.assertEqual(0.0, waited[0])
+        self.assertGreater(waited[1], 0.0)
+        self.assertGreaterEqual(time.monotonic() - started, 0.09)
+
+    def test_extraction_with_write_stage(self):
+        self.setup_stub_extractor()
+        items = [self.add_item_with_file("item{}".format(i)) for i in range(6)]
+        self.runcli(PLUGIN_NAME, "--threads", "3", "--write")
+
+        for item in items:
+            item.load()
+            self.assertIsNotNone(item.get("genre_rosamerica"))
+
+
+class ProcessLimitsTest(TestHelper):
+    """Test the resource controls of the extractor processes.
+    """
+
+    def test_parse_cpu_set(self):
+        self.assertEqual({0, 1, 2, 5}, parse_cpu_set("0-2,5"))
+
+    def test_cpu_sets_per_slot(self):
+        limits = ProcessLimits(cpu_affinity=["0-1", "2,3"], slots=2)
+        self.assertEqual([{0, 1}, {2, 3}], limits.cpu_sets)
+
+    def test_runaway_process_is_killed(self):
+        limits = ProcessLimits(timeout=0.5)
+        result = limits.run([sys.executable, "-c", "import time; time.sleep(30)"])
+        self.assertTrue(result.timed_out)
+        self.assertTrue(result.failed)
+
+    def test_output_exit_code_and_cpu_time(self):
+        result = ProcessLimits(timeout=30).run([sys.executable, "-c", "import sys; sum(range(3000000)); "
+                                                                      "print('out'); sys.exit(3)"])
+        self.assertEqual(3, result.returncode)
+        self.assertEqual(b"out", result.stdout.strip())
+        self.assertFalse(result.timed_out)
+        self.assertGreater(result.cpu_time, 0)
+
+    def test_invalid_ionice_class(self):
+        with self.assertRaises(ValueError):
+            ProcessLimits(ionice="fastest")
+
+
+class GovernorTest(TestHelper):
+    """Test the adaptive limit of the concurrent extractions.
+    """
+
+    def _run_governed(self, governor, threads=3, extractions=40, duration=0.01):
+        def extract():
+            for _ in range(extractions):
+                governor.acquire()
+                time.sleep(duration)
+                governor.release(duration)
+
+        workers = [threading.Thread(target=extract) for _ in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+    def test_limit_follows_load(self):
+        load = {"value": 0.5}
+        governor = ConcurrencyGovernor(min_workers=1, max_workers=3, max_load=1.0, interval=0.05, min_completions=1,
+                                       load_average=lambda: load["value"], available_memory=lambda: None)
+        self._run_governed(governor)
+        self.assertEqual(3, governor.limit)
+
+        load["value"] = 4.0
+        self._run_governed(governor, threads=1, extractions=20)
+        self.assertEqual(1, governor.limit)
+
+    def test_limit_waits_for_enough_completions(self):
+        governor = ConcurrencyGovernor(min_workers=1, max_workers=3, interval=0, min_completions=100,
+                                       load_average=lambda: None, available_memory=lambda: None)
+        self._run_governed(governor)
+        self.assertEqual(1, governor.limit)
+
+    def test_slot_is_taken_back_when_throughput_drops(self):
+        governor = ConcurrencyGovernor(min_workers=1, max_workers=3, interval=0, min_completions=1,
+                                       load_average=lambda: None, available_memory=lambda: None)
+        governor.limit = 2
+        governor._last_change = 1
+        governor._previous_level = 10.0
+        governor._waiting = 1
+        with governor._condition:
+            for throughput in (5.0, 5.0):
+                governor._measure(throughput)
+            self.assertEqual(1, governor.limit)
+            # No slot is added again right away
+            for throughput in (10.0, 10.0):
+                governor._measure(throughput)
+            self.assertEqual(1, governor.limit)
+
+    def test_admission_pauses_on_low_memory(self):
+        memory = {"value": 100}
+        governor = ConcurrencyGovernor(min_workers=2, max_workers=2, min_memory=512, interval=0.05,
+                                       load_average=lambda: None, available_memory=lambda: memory["value"])
+        # A single extraction is always admitted
+        governor.acquire()
+
+        second = threading.Thread(target=governor.acquire, daemon=True)
+        second.start()
+        second.join(0.2)
+        self.assertTrue(second.is_alive())
+
+        memory["value"] = 2048
+        second.join(2)
+        self.assertFalse(second.is_alive())
+        self.assertEqual(2, governor.active)
+
+    def test_adaptive_extraction(self):
+        self.setup_stub_extractor()
+        items = [self.add_item_with_file("item{}".format(i)) for i in range(4)]
+        self.config[PLUGIN_NAME]["adaptive_max_threads"] = 2
+        self.runcli(PLUGIN_NAME, "--adaptive")
+
+        for item in items:
+            item.load()
+            self.assertIsNotNone(item.get("mood_happy"))
+
+
+class AutoExtractorTest(TestHelper):
+    """Test the background extraction of imported items.
+    """
+
+    def setUp(self):
+        super(AutoExtractorTest, self).setUp()
+        self.setup_stub_extractor()
+
+    def test_imported_items_are_extracted_in_background(self):
+        items = [self.add_item_with_file("item{}".format(i)) for i in range(3)]
+        auto = AutoExtractor(XtractorCommand(self.config[PLUGIN_NAME]))
+        auto.enqueue(self.lib, items)
+        auto.finish()
+
+        for item in items:
+            item.load()
+            self.assertIsNotNone(item.get("gender"))
+
+    def test_processed_items_are_not_queued(self):
+        item = self.add_item_with_file("done")
+        self.runcli(PLUGIN_NAME)
+        item.load()
+
+        auto = AutoExtractor(XtractorCommand(self.config[PLUGIN_NAME]))
+        auto.enqueue(self.lib, [item])
+        auto.finish()
+        self.assertEqual(1, len(self.stub_invocations()))
@@ -0,0 +1,80 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+from beets.dbcore.query import AndQuery, RegexpQuery
+from beets.library import Item
+from beetsplug.xtractor.query import MissingFieldsQuery, FieldChangedQuery, IdSetQuery, ItemStream, count_items
+
+from test.helper import TestHelper, PLUGIN_NAME, capture_log
+
+plg_log_ns = 'beets.{}'.format(PLUGIN_NAME)
+
+
+class QueryTest(TestHelper):
+    """Test the selection of the items to be processed.
+    """
+
+    def setUp(self):
+        super(QueryTest, self).setUp()
+        self.done = Item(title="done", gender="male", danceable=0.5)
+        self.partial = Item(title="partial", gender="female")
+        self.new = Item(title="new")
+        for item in (self.done, self.partial, self.new):
+            self.lib.add(item)
+
+    def test_missing_fields_query_runs_in_sql(self):
+        query = MissingFieldsQuery(["gender", "danceable", "bpm"])
+        where, _ = query.clause()
+        self.assertIsNotNone(where)
+
+        titles = sorted(item.title for item in self.lib.items(query))
+        self.assertEqual(["new", "partial"], titles)
+        self.assertEqual(2, count_items(self.lib, query))
+
+    def test_missing_fields_query_match(self):
+        query = MissingFieldsQuery(["gender", "danceable"])
+        self.assertFalse(query.match(self.done))
+        self.assertTrue(query.match(self.partial))
+
+    def test_count_only(self):
+        with capture_log(plg_log_ns) as logs:
+            self.runcli(PLUGIN_NAME, "--count-only")
+        self.assertIn("xtractor: Number of items to be processed: 3", "\n".join(logs))
+
+    def test_field_changed_and_id_set_queries(self):
+        self.done["xtractor_profile"] = "old"
+        self.done.store()
+        self.partial["xtractor_profile"] = "new"
+        self.partial.store()
+
+        query = FieldChangedQuery("xtractor_profile", "new")
+        self.assertEqual(["done"], [item.title for item in self.lib.items(query)])
+        self.assertTrue(query.match(self.done))
+        self.assertFalse(query.match(self.new))
+
+        query = IdSetQuery({self.new.id, self.partial.id})
+        self.assertEqual(["new", "partial"], sorted(item.title for item in self.lib.items(query)))
+        self.assertEqual(2, count_items(self.lib, query))
+
+    def test_item_stream(self):
+        for i in range(5):
+            self.lib.add(Item(title="new {}".format(i)))
+        query = MissingFieldsQuery(["gender", "danceable"])
+
+        stream = ItemStream(self.lib, query, exclude_ids={self.new.id}, page_size=2)
+        self.assertEqual(["partial"] + ["new {}".format(i) for i in range(5)], [item.title for item in stream])
+        self.assertEqual([item.id for item in stream], list(stream.ids()))
+
+        # Queries matched in python are streamed as well
+        slow_query = AndQuery([query, RegexpQuery("gender", "^fem", fast=False)])
+        self.assertIsNone(slow_query.clause()[0])
+        self.assertEqual(["partial"], [item.title for item in ItemStream(self.lib, slow_query, page_size=2)])
+        self.assertEqual([self.partial.id], list(ItemStream(self.lib, slow_query, page_size=2).ids()))
+        self.assertEqual(1, count_items(self.lib, slow_query))
+
+        # A list of ids (resume)
+        stream = ItemStream(self.lib, query, item_ids=[self.done.id, self.new.id])
+        self.assertEqual([self.new.id], list(stream.ids()))
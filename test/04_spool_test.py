@@ -0,0 +1,70 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+import os
+import threading
+import time
+
+from beetsplug.xtractor.spool import Spool, STATUS_DONE
+from beetsplug.xtractor.worker import SpoolWorker
+
+from test.helper import TestHelper, PLUGIN_NAME
+
+
+class SpoolTest(TestHelper):
+    """Test the coordinator/worker mode through a spool directory.
+    """
+
+    def test_claim_is_exclusive(self):
+        spool = Spool(self.mkdtemp())
+        spool.submit("job1", {"input_path": "/a.mp3"})
+        self.assertEqual("job1", spool.claim()["job_id"])
+        self.assertIsNone(spool.claim())
+
+    def test_expired_lease_is_requeued(self):
+        spool = Spool(self.mkdtemp(), lease_timeout=10)
+        spool.submit("job1", {"input_path": "/a.mp3"})
+        spool.claim()
+        lease_path = os.path.join(spool.path, "leases", "job1.json")
+        os.utime(lease_path, (time.time() - 60, time.time() - 60))
+
+        self.assertTrue(spool.requeue_expired("job1"))
+        self.assertEqual("job1", spool.claim()["job_id"])
+
+    def test_coordinator_with_workers(self):
+        self.setup_stub_extractor()
+        spool_path = self.mkdtemp()
+        self.config[PLUGIN_NAME]["spool_poll"] = 0.05
+        items = [self.add_item_with_file("item{}".format(i)) for i in range(4)]
+        # A duplicate is extracted only once
+        items.append(self.add_item_with_file("copy", content=b"item0" * 4096))
+
+        stop = threading.Event()
+        workers = [threading.Thread(target=SpoolWorker(Spool(spool_path)).run,
+                                    kwargs={"poll_interval": 0.05, "stop": stop}) for _ in range(2)]
+        for worker in workers:
+            worker.start()
+        try:
+            self.runcli(PLUGIN_NAME, "--spool", spool_path)
+        finally:
+            stop.set()
+            for worker in workers:
+                worker.join()
+
+        for item in items:
+            item.load()
+            self.assertIsNotNone(item.get("gender"))
+        self.assertEqual(4, len(self.stub_invocations()))
+        self.assertEqual([], os.listdir(os.path.join(spool_path, "results")))
+
+    def test_failed_job(self):
+        spool = Spool(self.mkdtemp())
+        spool.submit("job1", {"input_path": "/does/not/exist.mp3", "profile": "p.yml", "extractor": "/bin/false"})
+        SpoolWorker(spool).run(once=True)
+
+        status = spool.get_status("job1")
+        self.assertNotEqual(STATUS_DONE, status["status"])
+        self.assertIn("not found", status["reason"])
@@ -0,0 +1,67 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+import os
+
+from beetsplug.xtractor.store import open_output_store
+
+from test.helper import TestHelper, PLUGIN_NAME
+
+
+class OutputStoreTest(TestHelper):
+    """Test the output store backends.
+    """
+
+    def _check_store(self, backend):
+        directory = self.mkdtemp()
+        store = open_output_store(backend, directory)
+        key = "0123456789abcdef-profile"
+        output_path = os.path.join(directory, "{}.part-1-1.json".format(key))
+        with open(output_path, "w") as f:
+            f.write('{"rhythm": {"bpm": 120}}')
+
+        self.assertFalse(store.exists(key))
+        store.put_file(key, output_path)
+        self.assertFalse(os.path.isfile(output_path))
+        self.assertTrue(store.exists(key))
+        self.assertEqual({"rhythm": {"bpm": 120}}, store.get(key))
+        self.assertEqual([key], list(store.keys()))
+
+        store.delete(key)
+        self.assertFalse(store.exists(key))
+        with self.assertRaises(FileNotFoundError):
+            store.get(key)
+        store.close()
+
+        return directory
+
+    def test_flat_store(self):
+        self._check_store("flat")
+
+    def test_sharded_store(self):
+        directory = self._check_store("sharded")
+        self.assertTrue(os.path.isdir(os.path.join(directory, "01", "23")))
+
+    def test_sqlite_store(self):
+        directory = self._check_store("sqlite")
+        self.assertTrue(os.path.isfile(os.path.join(directory, "outputs.db")))
+
+    def test_invalid_store(self):
+        with self.assertRaises(ValueError):
+            open_output_store("s3", self.mkdtemp())
+
+    def test_extraction_keeps_outputs_in_store(self):
+        self.setup_stub_extractor()
+        self.config[PLUGIN_NAME]["output_store"] = "sqlite"
+        self.config[PLUGIN_NAME]["keep_output"] = True
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME)
+
+        item.load()
+        self.assertIsNotNone(item.get("gender"))
+        store = open_output_store("sqlite", self.config[PLUGIN_NAME]["output_path"].get())
+        self.assertEqual(1, len(list(store.keys())))
+        store.close()
@@ -0,0 +1,54 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+import os
+import subprocess
+import sys
+
+from benchmark.library import generate_library
+from benchmark.run import ROOT_PATH, compare_results, run_isolated, run_pipeline_scenario, run_startup_scenario, \
+    STARTUP_BUDGET
+
+from test.helper import TestHelper
+
+
+class BenchmarkTest(TestHelper):
+    """Smoke test of the benchmark harness.
+    """
+
+    def test_generate_library(self):
+        directory = self.mkdtemp()
+        lib = generate_library(os.path.join(directory, "library.db"), 50, audio_dir=directory, processed=0.5,
+                               fields=["gender"])
+        items = list(lib.items())
+        self.assertEqual(50, len(items))
+        self.assertTrue(all(os.path.isfile(item.path) for item in items))
+        self.assertEqual(len({item.path for item in items}), 50)
+        self.assertTrue(0 < len([item for item in items if item.get("gender") is not None]) < 50)
+
+    def test_pipeline_scenario(self):
+        result = run_isolated(run_pipeline_scenario, 10, 2, self.mkdtemp(), fail_rate=0.2)
+        self.assertEqual(10, result["items"])
+        self.assertGreater(result["items_per_sec"], 0)
+        self.assertGreater(result["store_batches"], 0)
+        self.assertGreater(result["peak_rss"], 0)
+
+    def test_compare_results(self):
+        baseline = [{"scenario": "pipeline", "items": 10, "threads": 2, "items_per_sec": 100.0}]
+        self.assertEqual([], compare_results([dict(baseline[0], items_per_sec=80.0)], baseline, 0.25))
+        self.assertEqual(1, len(compare_results([dict(baseline[0], items_per_sec=70.0)], baseline, 0.25)))
+
+    def test_plugin_load_time_budget(self):
+        for auto in (False, True):
+            result = run_startup_scenario(self.mkdtemp(), repeat=3, auto=auto)
+            self.assertEqual([], result["unwanted_modules"])
+            self.assertLess(result["load_time"], STARTUP_BUDGET)
+
+    def test_actions_are_imported_when_invoked(self):
+        script = "import sys, beetsplug.xtractor.command; " \
+                 "print(' '.join(m for m in ('aggregate', 'export', 'similar') if 'beetsplug.xtractor.' + m in sys.modules))"
+        process = subprocess.run([sys.executable, "-c", script], check=True, stdout=subprocess.PIPE, cwd=ROOT_PATH)
+        self.assertEqual(b"", process.stdout.strip())
@@ -0,0 +1,91 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+import importlib.util
+import unittest
+
+from beets.library import Item
+from beetsplug.xtractor.aggregate import load_arrays, load_histograms
+
+from test.helper import TestHelper, PLUGIN_NAME
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+@unittest.skipIf(importlib.util.find_spec("numpy") is None, "numpy is not installed")
+class AggregateTest(TestHelper):
+    """Test the album aggregates.
+    """
+
+    def _add_album(self, values):
+        items = []
+        for i, (bpm, danceability, mood_mirex) in enumerate(values):
+            item = Item(path="/music/{}.mp3".format(i).encode(), title="track {}".format(i), bpm=bpm)
+            if danceability is not None:
+                item["danceability"] = danceability
+            item["mood_mirex"] = mood_mirex
+            items.append(item)
+
+        return self.lib.add_album(items)
+
+    def test_album_aggregates(self):
+        album = self._add_album([(120, 1.0, "Cluster1"), (130, 2.0, "Cluster2"), (0, 6.0, "Cluster2"),
+                                 (100, None, "Cluster3")])
+        self.runcli(PLUGIN_NAME, "aggregate")
+
+        album.load()
+        self.assertAlmostEqual(116.666667, album.get("bpm_mean"), places=5)
+        self.assertEqual(120, album.get("bpm_median"))
+        self.assertEqual(3.0, album.get("danceability_mean"))
+        self.assertEqual(2.0, album.get("danceability_median"))
+        self.assertAlmostEqual(2.160247, album.get("danceability_std"), places=5)
+        self.assertEqual("Cluster2", album.get("mood_mirex_dominant"))
+        self.assertIsNone(album.get("mood_happy_mean"))
+
+    def test_only_changed_albums_are_computed(self):
+        album = self._add_album([(120, 1.0, "Cluster1")])
+        other = self._add_album([(90, 2.0, "Cluster4")])
+        self.runcli(PLUGIN_NAME, "aggregate")
+
+        album.load()
+        other.load()
+        album["bpm_mean"] = 1.0
+        album.store()
+        other["bpm_mean"] = 1.0
+        other.store()
+
+        item = other.items().get()
+        item.bpm = 100
+        item.store()
+        self.runcli(PLUGIN_NAME, "aggregate")
+
+        album.load()
+        other.load()
+        self.assertEqual(1.0, album.get("bpm_mean"))
+        self.assertEqual(100, other.get("bpm_mean"))
+
+        self.runcli(PLUGIN_NAME, "aggregate", "--force")
+        album.load()
+        self.assertEqual(120, album.get("bpm_mean"))
+
+    def test_histograms_and_album_arrays(self):
+        values = [(120, 1.0, "Cluster1"), (130, 2.5, "Cluster2"), (0, 6.0, "Cluster2"), (95, 4.0, "Cluster3")]
+        album = self._add_album(values)
+        other = self._add_album([(60, 3.0, "Cluster1")])
+
+        histograms = load_histograms(self.lib, ["bpm", "danceability"], bins=4)
+        for field, column in (("bpm", [120, 130, 95, 60]), ("danceability", [1.0, 2.5, 6.0, 4.0, 3.0])):
+            counts, edges = numpy.histogram(column, bins=4)
+            self.assertEqual(counts.tolist(), histograms[field]["counts"])
+            numpy.testing.assert_allclose(edges, histograms[field]["edges"])
+        self.assertEqual([1, 0, 1, 1], load_histograms(self.lib, ["bpm"], [album.id], bins=4)["bpm"]["counts"])
+
+        arrays = load_arrays(self.lib, ["bpm"], ["mood_mirex"], album_ids=[other.id])
+        self.assertEqual([other.id], arrays.album_ids.tolist())
+        self.assertEqual([60.0], arrays.numeric["bpm"].tolist())
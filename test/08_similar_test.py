@@ -0,0 +1,87 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+import os
+import unittest
+
+from beets.library import Item
+from beetsplug.xtractor import helper
+from beetsplug.xtractor.similar import SimilarityIndex
+
+from test.helper import TestHelper, PLUGIN_NAME, capture_log
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+plg_log_ns = 'beets.{}'.format(PLUGIN_NAME)
+
+
+@unittest.skipIf(numpy is None, "numpy is not installed")
+class SimilarTest(TestHelper):
+    """Test the similarity index and search.
+    """
+
+    def _add_item(self, title, bpm, mood_happy):
+        item = Item(path="/music/{}.mp3".format(title).encode(), title=title, bpm=bpm)
+        if mood_happy is not None:
+            item["mood_happy"] = mood_happy
+        self.lib.add(item)
+
+        return item
+
+    def test_index_search_and_update(self):
+        index = SimilarityIndex(os.path.join(self.mkdtemp(), "index"))
+        values = numpy.array([[100, 0.1], [102, 0.2], [180, 0.9], [60, numpy.nan]])
+        index.build(["bpm", "mood_happy"], numpy.array([4, 1, 3, 2]), values)
+
+        self.assertEqual([1, 2, 3, 4], index.ids.tolist())
+        ids, distances = index.search(index.get_vectors([4])[0], k=2, exclude=[4])
+        self.assertEqual([1, 2], ids.tolist())
+        self.assertLess(distances[0], distances[1])
+
+        # Replace in place, then append
+        index.update([3], numpy.array([[101, 0.15]]))
+        self.assertEqual([3, 1], index.search(index.get_vectors([4])[0], k=2, exclude=[4])[0].tolist())
+        index.update([7], numpy.array([[100, 0.1]]))
+        self.assertCountEqual([4, 7], index.search(index.get_vectors([4])[0], k=2)[0].tolist())
+
+        index.remove([4])
+        self.assertEqual([1, 2, 3, 7], index.ids.tolist())
+
+    def test_similar_items(self):
+        self.config[PLUGIN_NAME]["similarity_fields"] = ["bpm", "mood_happy"]
+        self._add_item("alpha", 70, 0.1)
+        self._add_item("beta", 170, 0.9)
+        self._add_item("gamma", 175, 0.8)
+        self._add_item("unknown", 0, None)
+
+        with capture_log(plg_log_ns) as logs:
+            self.runcli(PLUGIN_NAME, "similar", "-k", "1", "-f", "$title", "title:beta")
+        self.assertIn("gamma", logs[-1])
+
+        index = SimilarityIndex(helper.get_data_path("similarity"))
+        index.load()
+        self.assertEqual(3, len(index.ids))
+
+        self._add_item("delta", 180, 0.8)
+        with capture_log(plg_log_ns) as logs:
+            self.runcli(PLUGIN_NAME, "similar", "--update", "-k", "1", "-f", "$title", "title:gamma")
+        self.assertIn("delta", logs[-1])
+
+    def test_index_is_updated_by_extraction(self):
+        self.setup_stub_extractor()
+        self.config[PLUGIN_NAME]["similarity_fields"] = ["bpm", "mood_happy"]
+        self._add_item("done", 120, 0.5)
+        self.runcli(PLUGIN_NAME, "similar", "title:done")
+
+        item = self.add_item_with_file("one")
+        self.runcli(PLUGIN_NAME)
+
+        index = SimilarityIndex(helper.get_data_path("similarity"))
+        index.load()
+        self.assertIn(item.id, index.ids.tolist())
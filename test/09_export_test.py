@@ -0,0 +1,142 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  Created: 3/12/20, 11:42 PM
+#  License: See LICENSE.txt
+
+import csv
+import importlib.util
+import math
+import os
+import unittest
+
+from beets.library import Item
+from beetsplug.xtractor.export import ExportColumns, ParquetWriter
+
+from test.helper import TestHelper, PLUGIN_NAME, capture_log
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+plg_log_ns = 'beets.{}'.format(PLUGIN_NAME)
+
+
+class ExportTest(TestHelper):
+    """Test the bulk export of the descriptors.
+    """
+
+    def _add_item(self, title, bpm, mood_happy=None, gender=None):
+        item = Item(path="/music/{}.mp3".format(title).encode(), title=title, bpm=bpm)
+        if mood_happy is not None:
+            item["mood_happy"] = mood_happy
+        if gender is not None:
+            item["gender"] = gender
+        self.lib.add(item)
+
+        return item
+
+    def _export(self, *args):
+        with capture_log(plg_log_ns) as logs:
+            self.runcli(PLUGIN_NAME, "export", *args)
+        return logs
+
+    def test_csv_export(self):
+        alpha = self._add_item("alpha", 120, 0.25, "male")
+        self._add_item("beta", 0)
+        self._add_item("gamma", 90, 0.75, "female")
+        output_path = os.path.join(self.mkdtemp(), "export.csv")
+
+        logs = self._export("--output", output_path, "--chunk-size", "2")
+        self.assertIn("Exported 3 of 3 items", logs[-1])
+        with open(output_path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(["alpha", "beta", "gamma"], [os.path.basename(row["path"])[:-4] for row in rows])
+        self.assertEqual(str(alpha.id), rows[0]["id"])
+        self.assertEqual(120.0, float(rows[0]["bpm"]))
+        self.assertEqual(0.25, float(rows[0]["mood_happy"]))
+        self.assertEqual("male", rows[0]["gender"])
+        self.assertEqual("", rows[1]["bpm"])
+        self.assertEqual("", rows[1]["gender"])
+
+        # Only the changed and the new items are appended
+        alpha["mood_happy"] = 0.5
+        alpha.store()
+        self._add_item("delta", 100)
+        logs = self._export("--output", output_path, "--incremental")
+        self.assertIn("Exported 2 of 4 items", logs[-1])
+        with open(output_path, newline="") as f:
+            rows = list(csv.DictReader(f))
+        self.assertEqual(5, len(rows))
+        self.assertEqual(0.5, float(rows[3]["mood_happy"]))
+
+        logs = self._export("--output", output_path, "--incremental")
+        self.assertIn("Exported 0 of 4 items", logs[-1])
+
+    @unittest.skipIf(numpy is None, "numpy is not installed")
+    def test_npy_export(self):
+        self._add_item("alpha", 120, 0.25, "male")
+        beta = self._add_item("beta", 0)
+        output_path = os.path.join(self.mkdtemp(), "export")
+
+        logs = self._export("--output", output_path, "title:alpha")
+        self.assertIn("Exported 1 of 1 items", logs[-1])
+        self._export("--output", output_path, "--chunk-size", "1")
+        ids = numpy.load(os.path.join(output_path, "id.npy"), mmap_mode="r")
+        bpm = numpy.load(os.path.join(output_path, "bpm.npy"), mmap_mode="r")
+        gender = numpy.load(os.path.join(output_path, "gender.npy"), mmap_mode="r")
+        paths = numpy.load(os.path.join(output_path, "path.npy"), mmap_mode="r")
+        self.assertEqual(2, len(ids))
+        self.assertEqual(120.0, bpm[0])
+        self.assertTrue(math.isnan(bpm[1]))
+        self.assertEqual(["male", ""], gender.tolist())
+        self.assertEqual(b"/music/beta.mp3", paths[1])
+
+        beta["gender"] = "female"
+        beta.store()
+        self._add_item("a-much-longer-title", 80, gender="female")
+        self._export("--output", output_path, "--incremental")
+        ids = numpy.load(os.path.join(output_path, "id.npy"), mmap_mode="r")
+        gender = numpy.load(os.path.join(output_path, "gender.npy"), mmap_mode="r")
+        paths = numpy.load(os.path.join(output_path, "path.npy"), mmap_mode="r")
+        self.assertEqual(4, len(ids))
+        self.assertEqual(beta.id, ids[2])
+        self.assertEqual(["male", "", "female", "female"], gender.tolist())
+        self.assertEqual(b"/music/a-much-longer-title.mp3", paths[3])
+
+    def test_incremental_export_of_other_columns(self):
+        self._add_item("alpha", 120)
+        output_path = os.path.join(self.mkdtemp(), "export.csv")
+        self._export("--output", output_path)
+
+        logs = self._export("--output", output_path, "--format", "parquet", "--incremental")
+        self.assertIn("another format", logs[-1])
+
+    @unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "pyarrow is not installed")
+    def test_parquet_export(self):
+        import pyarrow.parquet
+
+        self._add_item("alpha", 120, 0.25, "male")
+        output_path = os.path.join(self.mkdtemp(), "export.parquet")
+        self._export("--output", output_path)
+        self._add_item("beta", 90)
+        self._export("--output", output_path, "--incremental")
+
+        table = pyarrow.parquet.read_table(output_path)
+        self.assertEqual(2, table.num_rows)
+        self.assertEqual([120.0, 90.0], table.column("bpm").to_pylist())
+        self.assertEqual(["male", None], table.column("gender").to_pylist())
+        self.assertEqual(["/music/alpha.mp3", "/music/beta.mp3"], table.column("path").to_pylist())
+
+    @unittest.skipIf(importlib.util.find_spec("pyarrow") is None, "pyarrow is not installed")
+    def test_parquet_append_with_other_columns(self):
+        output_path = os.path.join(self.mkdtemp(), "export.parquet")
+        writer = ParquetWriter(output_path, ExportColumns(["bpm"], []))
+        writer.write([(1, b"/music/alpha.mp3", 120.0), (2, b"/music/beta.mp3", float("nan"))])
+        writer.close()
+
+        with self.assertRaises(ValueError):
+            ParquetWriter(output_path, ExportColumns(["bpm", "mood_happy"], []), append=True)
+        # The partial copy is removed
+        self.assertEqual(["export.parquet"], os.listdir(os.path.dirname(output_path)))
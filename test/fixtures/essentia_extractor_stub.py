@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+"""Stand-in for `streaming_extractor_music` used by the tests.
+
+Usage: essentia_extractor_stub.py INPUT OUTPUT PROFILE
+
+The values written to OUTPUT are derived from the content of INPUT so that the
+same audio always gives the same result. The high-level descriptors are only
+written when the profile has a `highlevel` section. When INPUT is a json file
+the stub acts as `streaming_extractor_music_svm`: the high-level descriptors
+are computed from the low-level result. When the XTRACTOR_STUB_LOG environment
+variable is set, every invocation is appended to that file. Inputs whose path
+contains the value of XTRACTOR_STUB_FAIL are not analysed (exit code 1).
+
+The benchmarks use the following environment variables:
+    XTRACTOR_STUB_LATENCY: seconds to wait before writing the output
+    XTRACTOR_STUB_FRAMES: number of frame values added to the output (the real
+        extractor writes 100-500KB of json per track)
+    XTRACTOR_STUB_FAIL_RATE: share (0-1) of the inputs failing (by content)
+"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+
+import yaml
+
+
+def make_audiodata(seed):
+    def val(i):
+        return int(seed[i * 2:i * 2 + 2], 16) / 255.0
+
+    return {
+        "metadata": {"version": {"essentia": "stub"}, "audio_properties": {"md5_encoded": seed}},
+        "lowlevel": {"average_loudness": val(0)},
+        "rhythm": {"bpm": 60 + val(1) * 120, "danceability": val(2) * 3, "beats_count": 100 + int(val(3) * 1000)},
+        "highlevel": {
+            "danceability": {"value": "danceable", "all": {"danceable": val(4), "not_danceable": 1 - val(4)}},
+            "gender": {"value": "female" if val(5) > 0.5 else "male", "all": {"female": val(5), "male": 1 - val(5)}},
+            "genre_rosamerica": {"value": ["cla", "dan", "hip", "jaz", "pop", "rhy", "roc", "spe"][int(val(6) * 7)]},
+            "voice_instrumental": {"value": "voice" if val(7) > 0.5 else "instrumental",
+                                   "all": {"voice": val(7), "instrumental": 1 - val(7)}},
+            "mood_acoustic": {"all": {"acoustic": val(8)}},
+            "mood_aggressive": {"all": {"aggressive": val(9)}},
+            "mood_electronic": {"all": {"electronic": val(10)}},
+            "mood_happy": {"all": {"happy": val(11)}},
+            "mood_sad": {"all": {"sad": val(12)}},
+            "mood_party": {"all": {"party": val(13)}},
+            "mood_relaxed": {"all": {"relaxed": val(14)}},
+            "moods_mirex": {"value": "Cluster{}".format(1 + int(val(15) * 4)),
+                            "all": {"Cluster{}".format(i): val(15 + i) for i in range(1, 6)}},
+        },
+    }
+
+
+def analyse(input_path, profile):
+    """returns the descriptors of the input (raises ValueError when the input "fails")
+    """
+    log_path = os.environ.get("XTRACTOR_STUB_LOG")
+    if log_path:
+        with open(log_path, "a") as f:
+            f.write(input_path + "\n")
+
+    fail_pattern = os.environ.get("XTRACTOR_STUB_FAIL")
+    if fail_pattern and fail_pattern in input_path:
+        raise ValueError("Unable to decode: {}".format(input_path))
+
+    time.sleep(float(os.environ.get("XTRACTOR_STUB_LATENCY", 0)))
+
+    if input_path.endswith(".json"):
+        with open(input_path) as f:
+            metadata = json.load(f)["metadata"]
+        return {"metadata": metadata,
+                "highlevel": make_audiodata(metadata["audio_properties"]["md5_encoded"])["highlevel"]}
+
+    with open(input_path, "rb") as f:
+        seed = hashlib.sha1(f.read()).hexdigest() * 2
+    if int(seed[:8], 16) / 0xffffffff < float(os.environ.get("XTRACTOR_STUB_FAIL_RATE", 0)):
+        raise ValueError("Unable to decode: {}".format(input_path))
+
+    audiodata = make_audiodata(seed)
+    if "highlevel" not in profile:
+        del audiodata["highlevel"]
+
+    frames = int(os.environ.get("XTRACTOR_STUB_FRAMES", 0))
+    if frames:
+        audiodata["lowlevel"]["spectral_energy"] = {
+            "frames": [round(((i * 7919) % 1000) / 1000.0, 6) for i in range(frames)]}
+
+    return audiodata
+
+
+def main(argv):
+    if len(argv) < 3:
+        sys.stderr.write("Usage: {} INPUT OUTPUT [PROFILE]\n".format(argv[0]))
+        return 1
+
+    input_path, output_path = argv[1], argv[2]
+    profile = {}
+    if len(argv) > 3:
+        with open(argv[3]) as f:
+            profile = yaml.safe_load(f) or {}
+
+    try:
+        audiodata = analyse(input_path, profile)
+    except ValueError as e:
+        sys.stderr.write("{}\n".format(e))
+        return 1
+
+    with open(output_path, "w") as f:
+        json.dump(audiodata, f)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv))
@@ -0,0 +1,65 @@
+#  Copyright: Copyright (c) 2020., Adam Jakab
+#  Author: Adam Jakab <adam at jakab dot pro>
+#  License: See LICENSE.txt
+
+"""Pure python extractor backends for the tests: they return the values of
+`essentia_extractor_stub.py` without running a process. Every load of the
+profile is appended to the file set in XTRACTOR_STUB_LOAD_LOG.
+"""
+
+import os
+import time
+
+import yaml
+
+from beetsplug.xtractor.backend import ExtractorBackend, ExtractionResult, WorkerPoolBackend
+from test.fixtures.essentia_extractor_stub import analyse
+
+
+def load_stub_extractor(profile_path):
+    with open(profile_path) as f:
+        profile = yaml.safe_load(f) or {}
+
+    log_path = os.environ.get("XTRACTOR_STUB_LOAD_LOG")
+    if log_path:
+        with open(log_path, "a") as f:
+            f.write("{} {}\n".format(os.getpid(), profile_path))
+
+    return lambda input_path: analyse(input_path, profile)
+
+
+class StubBackend(ExtractorBackend):
+    """runs the stub in the calling thread
+    """
+    _extractors = None
+
+    def __init__(self):
+        self._extractors = {}
+
+    def extract(self, input_path, output_path, profile_path):
+        result = ExtractionResult()
+        if profile_path not in self._extractors:
+            self._extractors[profile_path] = load_stub_extractor(profile_path)
+        try:
+            result.audiodata = self._extractors[profile_path](input_path)
+        except ValueError as e:
+            result.error = str(e)
+
+        return result
+
+
+class StubWorkerPoolBackend(WorkerPoolBackend):
+    """the worker pool running the stub
+    """
+    loader = "test.fixtures.stub_backend:load_stub_extractor"
+
+
+def load_sleeping_extractor(profile_path):
+    """an extractor hanging on the inputs named "*hang*"
+    """
+    def extract(input_path):
+        if "hang" in os.path.basename(input_path):
+            time.sleep(60)
+        return {"input": input_path}
+
+    return extract
@@ -177,6 +177,10 @@ class TestHelper(TestCase, Assertions):
         if 'BEETSDIR' in os.environ:
             del os.environ['BEETSDIR']
 
+        for key in ('XTRACTOR_STUB_LOG', 'XTRACTOR_STUB_LOAD_LOG', 'XTRACTOR_STUB_FAIL'):
+            if key in os.environ:
+                del os.environ[key]
+
         if hasattr(self, 'config'):
             self.config.clear()
 
@@ -206,6 +210,36 @@ class TestHelper(TestCase, Assertions):
                 print(u.args[0])
         return out.getvalue()
 
+    def setup_stub_extractor(self):
+        """Point the plugin to the stub extractor and use a file based library
+        (worker threads do not share an in-memory database)
+        """
+        stub_path = os.path.join(self._test_fixture_dir, b'essentia_extractor_stub.py').decode()
+        self.config[PLUGIN_NAME]['essentia_extractor'] = stub_path
+        self.config[PLUGIN_NAME]['output_path'] = self.mkdtemp()
+        self.config[PLUGIN_NAME]['write'] = False
+        self.config[PLUGIN_NAME]['quiet'] = True
+
+        self.lib = beets.library.Library(os.path.join(self.mkdtemp(), 'library.db'), self.libdir)
+
+        self.stub_log = os.path.join(self.mkdtemp(), 'stub.log')
+        os.environ['XTRACTOR_STUB_LOG'] = self.stub_log
+
+    def stub_invocations(self):
+        if not os.path.isfile(self.stub_log):
+            return []
+        with open(self.stub_log) as f:
+            return f.read().splitlines()
+
+    def add_item_with_file(self, title, content=None, length=180.0):
+        path = os.path.join(self.mkdtemp(), '{}.mp3'.format(title))
+        with open(path, 'wb') as f:
+            f.write(content if content is not None else title.encode() * 4096)
+
+        item = Item(path=bytestring_path(path), title=title, length=length)
+        self.lib.add(item)
+        return item
+
     def lib_path(self, path):
         return os.path.join(self.libdir, path.replace(b'/', bytestring_path(os.sep)))
 